@@ -0,0 +1,514 @@
+# approximate.py
+"""Progressive execution of aggregate SELECTs: sampled estimates first, the exact result last.
+
+One table of the query (the first FROM table with an integer key on MySQL,
+the largest sheet) is sampled: MySQL reads a few random primary-key ranges,
+which are index range scans, sheets take random rows. The sample is split
+into replicates and the SELECT runs once per replicate over its share. COUNT
+and SUM are scaled by the replicate's sampling fraction, AVG is averaged and
+MIN/MAX are combined; the spread between replicates gives a 95% error bar.
+Larger samples, then the exact query, follow in the background until done or
+cancelled.
+"""
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import SAMPLE_FRACTIONS, SAMPLE_REPLICATES, SAMPLE_MIN_ROWS
+from db_utils import execute_mysql_query
+from sheet_engine import SheetSQLEngine
+from sql_utils import (Token, TableRef, tokenize, is_keyword, is_op, referenced_tables, top_level_clause,
+                       top_level_tables, token_end, is_single_select)
+from tracing import span, in_current_context
+
+RANGES_PER_REPLICATE = 4
+Z_95 = 1.96
+
+_AGGREGATES = {"count": "sum", "sum": "sum", "avg": "avg", "min": "min", "max": "max"}
+# aggregates whose value cannot be estimated from a sample this way
+_OTHER_AGGREGATES = {"group_concat", "std", "stddev", "stddev_pop", "stddev_samp", "variance", "var_pop",
+                     "var_samp", "bit_and", "bit_or", "bit_xor", "json_arrayagg", "json_objectagg",
+                     "any_value", "total", "string_agg"}
+_SAMPLE_TABLE = "__sample"
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="progressive")
+
+
+def _match(name: str, names) -> Optional[str]:
+    lowered = {n.lower(): n for n in names}
+    return lowered.get(name.lower())
+
+
+def _split_commas(tokens: List[Token]) -> List[List[Token]]:
+    parts, current, depth = [], [], 0
+    for tok in tokens:
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif depth == 0 and is_op(tok, ","):
+            parts.append(current)
+            current = []
+            continue
+        current.append(tok)
+    parts.append(current)
+    return parts
+
+
+def _closes_at_end(tokens: List[Token], open_at: int) -> bool:
+    """True if the parenthesis at open_at is closed by the last token."""
+    depth = 0
+    for i in range(open_at, len(tokens)):
+        if is_op(tokens[i], "("):
+            depth += 1
+        elif is_op(tokens[i], ")"):
+            depth -= 1
+            if depth == 0:
+                return i == len(tokens) - 1
+    return False
+
+
+def _without_alias(item: List[Token]) -> List[Token]:
+    if len(item) > 2 and is_keyword(item[-2], "as"):
+        return item[:-2]
+    if len(item) > 1 and item[-1].kind in ("ident", "qident") and not is_keyword(item[-1], "end") and \
+            (is_op(item[-2], ")") or item[-2].kind in ("ident", "qident", "string", "number")):
+        return item[:-1]
+    return item
+
+
+def _classify(item: List[Token]) -> Optional[str]:
+    """'key', 'sum' (COUNT/SUM, scaled up), 'avg', 'min' or 'max'; None if it cannot be estimated."""
+    body = _without_alias(item)
+    if not body or any(is_keyword(t, "over") for t in body):
+        return None
+    calls = [(i, t.value.lower()) for i, t in enumerate(body[:-1])
+             if t.kind == "ident" and is_op(body[i + 1], "(")]
+    if any(name in _OTHER_AGGREGATES for _, name in calls):
+        return None
+    aggregates = [(i, name) for i, name in calls if name in _AGGREGATES]
+    if not aggregates:
+        return "key"
+    if any(i + 2 < len(body) and is_keyword(body[i + 2], "distinct") for i, _ in aggregates):
+        return None   # COUNT(DISTINCT ...) does not scale with the sample
+    # ROUND(agg, n) is estimated like agg
+    if is_keyword(body[0], "round") and len(body) > 3 and is_op(body[1], "(") and _closes_at_end(body, 1):
+        return _classify(_split_commas(body[2:-1])[0])
+    first, name = aggregates[0]
+    if first == 0 and _closes_at_end(body, 1):
+        return _AGGREGATES[name]
+    # expressions over AVG only (AVG(x) * 100, ...) are linear in it; mixtures are not
+    return "avg" if all(n == "avg" for _, n in aggregates) else None
+
+
+class SamplePlan:
+    """How an aggregate SELECT is estimated from samples of one of its tables.
+
+    kinds: per output column, see _classify. body: the statement without its
+    ORDER BY / LIMIT, which are applied after the replicates are combined.
+    candidates: tables that may be sampled, with their (start, end) offsets.
+    """
+
+    def __init__(self, sql: str, body: str, kinds: List[str], candidates: List[Tuple[TableRef, int, int]],
+                 order: List[Tuple[object, bool]], limit: Optional[int], offset: int):
+        self.sql = sql
+        self.body = body
+        self.kinds = kinds
+        self.candidates = candidates
+        self.order = order
+        self.limit = limit
+        self.offset = offset
+
+    def rewrite(self, table: Tuple[TableRef, int, int], replacement: str) -> str:
+        """body with the table reference replaced (by a derived table or a sample table)."""
+        ref, start, end = table
+        if ref.alias.lower() == ref.name.split(".")[-1].lower():
+            replacement += " AS " + self.sql[start:end].split(".")[-1].strip()
+        return self.body[:start] + replacement + self.body[end:]
+
+
+def _order_items(sql: str, tokens: List[Token], items: List[List[Token]]) -> List[Tuple[object, bool]]:
+    """(output column position or name, ascending) per ORDER BY item."""
+    clause = top_level_clause(tokens, "order", ("limit", "for"))
+    if clause is None:
+        return []
+    texts = [" ".join(t.value.lower() for t in _without_alias(item)) for item in items]
+    order = []
+    for part in _split_commas(tokens[clause[0] + 1:clause[1]]):   # past BY
+        ascending = True
+        if part and is_keyword(part[-1], "asc", "desc"):
+            ascending = is_keyword(part[-1], "asc")
+            part = part[:-1]
+        if len(part) == 1 and part[0].kind == "number":
+            order.append((int(part[0].value) - 1, ascending))
+        elif " ".join(t.value.lower() for t in part) in texts:
+            order.append((texts.index(" ".join(t.value.lower() for t in part)), ascending))
+        elif part and part[-1].kind in ("ident", "qident"):
+            order.append((part[-1].value, ascending))   # an output column name or alias
+        else:
+            return []   # expression not in the select list: leave the combined order alone
+    return order
+
+
+def plan_sampling(sql: str) -> SamplePlan:
+    """Work out how to estimate sql from samples; raises ValueError when it cannot be."""
+    q = sql.strip().rstrip(";").strip()
+    if not is_single_select(q):
+        raise ValueError("only single SELECT statements are estimated")
+    tokens = tokenize(q)
+    if not is_keyword(tokens[0], "select"):
+        raise ValueError("WITH queries are not estimated")
+    depth = 0
+    for tok in tokens:
+        depth += 1 if is_op(tok, "(") else -1 if is_op(tok, ")") else 0
+        if depth == 0 and is_keyword(tok, "union", "intersect", "except", "having", "window", "into"):
+            raise ValueError(f"{tok.value.upper()} queries are not estimated")
+    if len(tokens) > 1 and is_keyword(tokens[1], "distinct", "all"):
+        raise ValueError("SELECT DISTINCT is not estimated")
+    select = top_level_clause(tokens, "select", ("from",))
+    items = _split_commas(tokens[select[0]:select[1]])
+    kinds = [_classify(item) for item in items]
+    if None in kinds:
+        raise ValueError("the select list has values that cannot be estimated from a sample")
+    if all(k == "key" for k in kinds):
+        raise ValueError("not an aggregate query")
+
+    tail = len(q)
+    for word in ("order", "limit"):
+        clause = top_level_clause(tokens, word, ("for",) if word == "limit" else ("limit", "for"))
+        if clause is not None:
+            tail = min(tail, tokens[clause[0] - 1].pos)
+    if any(is_keyword(t, "for") and t.pos > tail for t in tokens):
+        raise ValueError("locking reads are not estimated")
+    limit, offset = None, 0
+    clause = top_level_clause(tokens, "limit", ("for",))
+    if clause is not None:
+        numbers = [int(t.value) for t in tokens[clause[0]:clause[1]] if t.kind == "number"]
+        if any(is_op(t, ",") for t in tokens[clause[0]:clause[1]]):
+            offset, limit = numbers[0], numbers[1]
+        else:
+            limit, offset = numbers[0], (numbers[1] if len(numbers) > 1 else 0)
+
+    names = [r.name.lower() for r in referenced_tables(q)]
+    candidates = [(ref, tokens[start].pos, token_end(q, tokens[end - 1]))
+                  for ref, start, end in top_level_tables(tokens)
+                  if not ref.outer and names.count(ref.name.lower()) == 1]
+    if not candidates:
+        raise ValueError("no table that can be sampled")
+    return SamplePlan(q, q[:tail].rstrip(), kinds, candidates, _order_items(q, tokens, items), limit, offset)
+
+
+def combine(frames: List[pd.DataFrame], fractions: List[float], plan: SamplePlan) -> pd.DataFrame:
+    """One estimate from the per-replicate results, with "<column> ±" 95% error columns."""
+    columns = [str(c) for c in frames[0].columns]
+    if len(columns) != len(plan.kinds):
+        raise ValueError("result columns do not match the select list")
+    keys = [c for c, k in zip(columns, plan.kinds) if k == "key"]
+    parts = []
+    for i, (df, fraction) in enumerate(zip(frames, fractions)):
+        df = df.copy()
+        df.columns = columns
+        for c, kind in zip(columns, plan.kinds):
+            if kind in ("sum", "avg"):
+                df[c] = pd.to_numeric(df[c], errors="coerce").astype(float)
+                if kind == "sum":
+                    df[c] = df[c] / fraction
+                    df[c + " ²"] = df[c] ** 2
+        parts.append(df.assign(__group=0))
+    long = pd.concat(parts, ignore_index=True)
+    grouped = long.groupby(keys or ["__group"], dropna=False, sort=False)
+    replicates = len(frames)
+    out = pd.DataFrame(index=grouped.size().index)
+    for c, kind in zip(columns, plan.kinds):
+        if kind == "key":
+            continue
+        if kind == "sum":
+            # a group missing from a replicate contributed 0 to it
+            mean = grouped[c].sum() / replicates
+            var = (grouped[c + " ²"].sum() - replicates * mean ** 2) / max(replicates - 1, 1)
+            out[c] = mean
+            out[c + " ±"] = Z_95 * np.sqrt(var.clip(lower=0) / replicates)
+        elif kind == "avg":
+            out[c] = grouped[c].mean()
+            out[c + " ±"] = Z_95 * grouped[c].std(ddof=1) / np.sqrt(grouped[c].count())
+        else:
+            out[c] = getattr(grouped[c], kind)()
+    out = out.reset_index(drop=not keys)
+    ordered = []
+    for c in columns:
+        ordered.append(c)
+        if c + " ±" in out:
+            ordered.append(c + " ±")
+    out = out[ordered]
+    if plan.order:
+        by, ascending = [], []
+        for target, asc in plan.order:
+            name = columns[target] if isinstance(target, int) and 0 <= target < len(columns) \
+                else _match(str(target), columns)
+            if name is None:
+                by = []
+                break
+            by.append(name)
+            ascending.append(asc)
+        if by:
+            out = out.sort_values(by, ascending=ascending, kind="stable")
+    if plan.limit is not None:
+        out = out.iloc[plan.offset:plan.offset + plan.limit]
+    return out.reset_index(drop=True)
+
+
+def _mysql_key(mysql_schema: Dict[str, list], table: str) -> Optional[str]:
+    """Integer primary-key column (or integer "id") to sample key ranges of."""
+    cols = mysql_schema.get(_match(table.split(".")[-1], mysql_schema) or "", [])
+    keyed = [c for c in cols if c.get("key") == "PRI"][:1] or [c for c in cols if c["name"].lower() == "id"]
+    for col in keyed:
+        if re.search(r"int", str(col.get("type", "")), re.I):
+            return col["name"]
+    return None
+
+
+class _MySQLSampler:
+    """Replicate queries over random key ranges of one MySQL table."""
+
+    def __init__(self, plan: SamplePlan, conn, mysql_schema: Dict[str, list], replicates: int,
+                 rng: np.random.Generator, min_rows: int):
+        self.plan, self.conn, self.replicates, self.rng = plan, conn, replicates, rng
+        self.table = self.key = None
+        for candidate in plan.candidates:
+            key = _mysql_key(mysql_schema, candidate[0].name)
+            if key is not None:
+                self.table, self.key = candidate, key
+                break
+        if self.table is None:
+            raise ValueError("no sampled table has an integer primary key")
+        name = plan.sql[self.table[1]:self.table[2]]
+        self.quoted_key = "`" + self.key.replace("`", "``") + "`"
+        df, err = execute_mysql_query(conn, f"SELECT MIN({self.quoted_key}), MAX({self.quoted_key}) FROM {name}")
+        if err:
+            raise ValueError(err)
+        lo, hi = df.iloc[0, 0], df.iloc[0, 1]
+        if lo is None or pd.isna(lo) or int(hi) - int(lo) + 1 < min_rows:
+            raise ValueError(f"{self.table[0].name} has a key range below {min_rows:,} rows")
+        self.lo, self.span_ = int(lo), int(hi) - int(lo) + 1
+        self.source_name = name
+
+    def __call__(self, fraction: float, cancelled: threading.Event) -> Optional[Tuple[List[pd.DataFrame], List[float]]]:
+        ranges = self.replicates * RANGES_PER_REPLICATE
+        width = max(1, int(fraction * self.span_ / ranges))
+        blocks = self.span_ // width
+        if blocks < 2 * ranges:
+            return None   # too close to the whole table to be worth sampling
+        starts = self.lo + np.sort(self.rng.choice(blocks, ranges, replace=False)) * width
+        self.rng.shuffle(starts)
+        frames, fractions = [], []
+        for r in range(self.replicates):
+            if cancelled.is_set():
+                return None
+            mine = sorted(int(s) for s in starts[r * RANGES_PER_REPLICATE:(r + 1) * RANGES_PER_REPLICATE])
+            where = " OR ".join(f"{self.quoted_key} BETWEEN {s} AND {s + width - 1}" for s in mine)
+            sql = self.plan.rewrite(self.table, f"(SELECT * FROM {self.source_name} WHERE {where})")
+            df, err = execute_mysql_query(self.conn, sql)
+            if err:
+                raise ValueError(err)
+            frames.append(df)
+            fractions.append(len(mine) * width / self.span_)
+        return frames, fractions
+
+
+class _SheetSampler:
+    """Replicate queries over random rows of the largest sheet, on a private SQLite engine."""
+
+    def __init__(self, plan: SamplePlan, df_map: Dict[str, pd.DataFrame], replicates: int,
+                 rng: np.random.Generator, min_rows: int):
+        self.plan, self.replicates, self.rng = plan, replicates, rng
+        sized = [(len(df_map[_match(c[0].name, df_map)]), c) for c in plan.candidates if _match(c[0].name, df_map)]
+        if not sized:
+            raise ValueError("no sampled table is a loaded sheet")
+        rows, self.table = max(sized, key=lambda x: x[0])
+        if rows < min_rows:
+            raise ValueError(f"{self.table[0].name} has fewer than {min_rows:,} rows")
+        self.df = df_map[_match(self.table[0].name, df_map)]
+        self.engine = SheetSQLEngine(index_after=0)
+        self.engine.sync({n: d for n, d in df_map.items() if d is not self.df})
+
+    def __call__(self, fraction: float, cancelled: threading.Event) -> Optional[Tuple[List[pd.DataFrame], List[float]]]:
+        n = int(len(self.df) * fraction)
+        if n < self.replicates or fraction >= 0.5:
+            return None
+        sql = self.plan.rewrite(self.table, f'"{_SAMPLE_TABLE}"')
+        frames, fractions = [], []
+        for rows in np.array_split(self.rng.choice(len(self.df), n, replace=False), self.replicates):
+            if cancelled.is_set():
+                return None
+            self.engine.register([_SAMPLE_TABLE], self.df.iloc[np.sort(rows)])
+            frames.append(self.engine.query(sql))
+            fractions.append(len(rows) / len(self.df))
+        return frames, fractions
+
+
+class ProgressiveResult:
+    """Estimates of one SELECT, refined in the background until exact or cancelled.
+
+    updates() yields a DataFrame per stage as it arrives. Estimates carry
+    df.attrs["approximate"] = {"fraction", "replicates", "table", "ms"} and a
+    "<column> ±" 95% error column next to each COUNT/SUM/AVG; the last update
+    is the exact result unless cancel() came first; its ResultStore is .store.
+    note says why a query got no estimates (shape, table size, ...).
+    """
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.stages: List[pd.DataFrame] = []
+        self.error: Optional[str] = None
+        self.note: Optional[str] = None
+        self.truncated: Optional[str] = None
+        self.store = None
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+        self._done = False
+        self._stream = None
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def latest(self) -> Optional[pd.DataFrame]:
+        return self.stages[-1] if self.stages else None
+
+    @property
+    def exact(self) -> bool:
+        return bool(self.stages) and "approximate" not in self.stages[-1].attrs
+
+    def cancel(self):
+        """Stop refining; the estimates so far are kept. A running MySQL query is killed."""
+        self._cancelled.set()
+        stream = self._stream
+        if stream is not None and hasattr(stream, "cancel"):
+            stream.cancel("cancelled by user")
+
+    def _emit(self, df: pd.DataFrame):
+        with self._cond:
+            self.stages.append(df)
+            self._cond.notify_all()
+
+    def _finish(self, error: Optional[str] = None):
+        with self._cond:
+            self.error = error
+            self._done = True
+            self._cond.notify_all()
+
+    def updates(self, timeout: Optional[float] = None, start: int = 0) -> Iterator[pd.DataFrame]:
+        """Yield each stage's result from stages[start] on as it arrives until the run ends
+        (or timeout passes: pollers pass the number of stages they have seen as start)."""
+        sent = start
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while len(self.stages) == sent and not self._done:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self._cond.wait(remaining)
+                fresh, done = self.stages[sent:], self._done
+            for df in fresh:
+                sent += 1
+                yield df
+            if done and sent == len(self.stages):
+                return
+
+    def result(self, timeout: Optional[float] = None) -> Optional[pd.DataFrame]:
+        for _ in self.updates(timeout):
+            pass
+        return self.latest
+
+
+def _run(job: ProgressiveResult, sampler_factory: Optional[Callable], fractions: List[float], exact: Callable):
+    with span("progressive", stages=0) as s:
+        sampler = None
+        if sampler_factory is not None:
+            try:
+                sampler = sampler_factory()
+            except Exception as e:
+                job.note = f"Estimates skipped: {e}"
+        for fraction in fractions if sampler is not None else []:
+            if job.cancelled:
+                break
+            with span("progressive.sample", fraction=fraction) as ss:
+                try:
+                    replicas = sampler(fraction, job._cancelled)
+                    df = combine(*replicas, sampler.plan) if replicas else None
+                except Exception as e:
+                    ss.error = str(e)
+                    job.note = f"Estimates stopped: {e}"
+                    break
+            if df is None:
+                continue
+            df.attrs["approximate"] = {"fraction": round(sum(replicas[1]), 6), "replicates": len(replicas[0]),
+                                       "table": sampler.table[0].name, "ms": round(ss.duration * 1000, 3)}
+            job._emit(df)
+            s.add("stages")
+        if job.cancelled:
+            s.set(cancelled=True)
+            job._finish()
+            return
+        try:
+            stream = exact()
+            job._stream = stream
+            if job.cancelled and hasattr(stream, "cancel"):
+                stream.cancel("cancelled by user")
+            for _ in stream:
+                pass
+            job._stream = None
+        except Exception as e:
+            s.error = str(e)
+            job._finish(str(e))
+            return
+        if stream.error or job.cancelled:
+            s.error = stream.error
+            job._finish(None if job.cancelled else stream.error)
+            return
+        job.truncated = stream.truncated
+        job.store = stream.store
+        if stream.store.columns:
+            job._emit(stream.store.to_frame())
+        s.add("stages")
+    job._finish()
+
+
+def start_progressive(sql: str, source: str, exact: Callable, mysql_conn=None,
+                      mysql_schema: Optional[Dict[str, list]] = None,
+                      df_map: Optional[Dict[str, pd.DataFrame]] = None,
+                      fractions: Optional[List[float]] = None, replicates: int = SAMPLE_REPLICATES,
+                      min_rows: int = SAMPLE_MIN_ROWS, seed: Optional[int] = None) -> ProgressiveResult:
+    """Start estimating sql in the background and return immediately.
+
+    source is "MySQL" or "Google Sheets" (anything else gets the exact result
+    only); exact() returns the stream of the exact query (see stream_query).
+    """
+    job = ProgressiveResult(sql)
+    factory = None
+    try:
+        plan = plan_sampling(sql)
+        rng = np.random.default_rng(seed)
+        if source == "MySQL" and mysql_conn is not None:
+            factory = partial(_MySQLSampler, plan, mysql_conn, mysql_schema or {}, replicates, rng, min_rows)
+        elif source == "Google Sheets" and df_map:
+            factory = partial(_SheetSampler, plan, df_map, replicates, rng, min_rows)
+        else:
+            job.note = "Estimates are only made for MySQL or Sheets queries."
+    except ValueError as e:
+        job.note = f"Estimates skipped: {e}"
+    _EXECUTOR.submit(in_current_context(_run), job, factory,
+                     SAMPLE_FRACTIONS if fractions is None else fractions, exact)
+    return job
@@ -0,0 +1,68 @@
+# batch_generate.py
+"""
+Generate SQL for a JSONL file of questions.
+
+    python batch_generate.py questions.jsonl answers.jsonl --schema-file schema.txt --concurrency 8 --rpm 60
+
+Each input line is a JSON object; the question is read from --field (falling back
+to "title"). Output lines are the input objects plus "sql" and "error".
+Use --mock-latency to run against mocks.MockModel instead of Gemini.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from config import SYSTEM_PROMPT_DEFAULT
+from sql_generator import agenerate_sql_batch
+
+
+def _read_jsonl(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--field", default="question")
+    parser.add_argument("--schema-file")
+    parser.add_argument("--system-prompt-file")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=60, help="requests per minute")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--mock-latency", type=float, help="use a mock model with this latency (seconds)")
+    args = parser.parse_args(argv)
+
+    records = _read_jsonl(args.input)
+    questions = [str(r.get(args.field) or r.get("title") or "") for r in records]
+    schema_context = open(args.schema_file, encoding="utf-8").read() if args.schema_file else ""
+    system_prompt = (open(args.system_prompt_file, encoding="utf-8").read()
+                     if args.system_prompt_file else SYSTEM_PROMPT_DEFAULT)
+    model = None
+    if args.mock_latency is not None:
+        from mocks import MockModel
+        model = MockModel(latency=args.mock_latency)
+
+    started = time.perf_counter()
+    results = asyncio.run(agenerate_sql_batch(questions, schema_context, system_prompt, args.temperature,
+                                              concurrency=args.concurrency, requests_per_minute=args.rpm,
+                                              model=model, use_cache=not args.no_cache))
+    elapsed = time.perf_counter() - started
+
+    errors = 0
+    with open(args.output, "w", encoding="utf-8") as out:
+        for record, sql in zip(records, results):
+            error = sql[len("-- ERROR: "):] if sql.startswith("-- ERROR:") else None
+            errors += error is not None
+            out.write(json.dumps(dict(record, sql=None if error else sql, error=error)) + "\n")
+    print(f"{len(records)} questions in {elapsed:.2f}s ({len(records) / elapsed if elapsed else 0:.1f}/s), "
+          f"{errors} errors", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1170 @@
+# benchmark.py
+"""
+Offline end-to-end benchmark: question -> generate_sql -> validate -> execute -> sheet write-back.
+
+    python benchmark.py                                   # 1k and 100k rows x 10 and 100 tables
+    python benchmark.py --rows 1000,1000000 --tables 10,1000 --sources mysql
+    python benchmark.py --questions questions.jsonl --field title --latency 0.2
+    python benchmark.py --rows 100000 --tables 10 --service-users 1,10,50
+    python benchmark.py --sources "" --import-modules "" --bulk-rows 100000 --db-latency 0.0005
+    python benchmark.py --sources "" --import-modules "" --bulk-rows "" --sheet-load 20x10000,100x1000
+    python benchmark.py --sources "" --import-modules "" --bulk-rows "" --sheet-load "" --schema-tables 100,1000 --db-latency 0.0005
+    python benchmark.py --sources "" --import-modules "" --bulk-rows "" --sheet-load "" --sheet-query-rows 200000
+    python benchmark.py --save-baseline benchmarks/baseline.json
+    python benchmark.py --baseline benchmarks/baseline.json --tolerance 0.25
+
+Nothing leaves the process: mocks.MockModel answers for Gemini after --latency
+seconds, mocks.SQLiteMySQLStandIn serves the MySQL path and mocks.FakeSpreadsheet
+the Sheets path, counting API requests. Each scenario (source x rows x tables)
+replays the questions twice, "cold" (empty SQL and result caches) and "warm";
+every --write-every'th question is followed by an UPDATE that is written back.
+Per-stage numbers come from the tracing spans. Peak memory is the largest
+traced Python allocation during an extra cold replay run under tracemalloc
+(setup excluded). The stand-in answers only the schema queries from
+information_schema, not the table versions, so MySQL results are never served
+from the result cache; Sheets results are.
+
+--service-users adds a load test per scenario: that many simulated users send
+--service-requests questions each, concurrently, to an in-process query service
+(service.py) over HTTP; rejected (429) requests are counted.
+
+Cold-start time is tracked too: each of --import-modules is imported in a fresh
+interpreter under python -X importtime ("import/<module>" scenarios), and
+importing an SDK the baseline did not (e.g. the Gemini SDK from config) counts
+as a regression.
+
+--bulk-rows loads that many rows into a MySQL table twice ("bulk/<rows>/row",
+"bulk/<rows>/batch"): one INSERT per execute_mysql_query call, then all of them
+as one script, which runs in one transaction with the INSERTs merged into
+multi-row statements. q/s is rows per second; the "mysql" API count is the
+round trips the server would see, each delayed by --db-latency.
+
+--schema-tables reads the schema of a stand-in database with that many tables
+three ways ("schema/<tables>/describe", "/information_schema", "/cached"): SHOW
+TABLES plus a DESCRIBE per table as before get_mysql_schema, get_mysql_schema
+without its cache, and a rerun served from the cache after one version query.
+The "mysql" API count is round trips per load, each delayed by --db-latency.
+
+--sheet-load loads <tabs> tabs of <rows> rows from a FakeSpreadsheet three ways
+("sheetload/<tabs>x<rows>/records", "/batch", "/cached"): get_all_records per
+tab as before SheetWorkbook, one values_batch_get with typed columns, and a
+reload served from the shared tab cache. q/s is rows per second; peak_mb and
+frame_mb (memory held by the loaded frames) are reported next to the requests.
+
+--sheet-query-rows runs --sheet-queries SELECTs over one synthetic sheet of
+that many rows two ways ("sheetquery/<rows>/pandasql", "/engine"): a fresh
+SQLite database per query, as pandasql.sqldf did, and the persistent
+SheetSQLEngine. Latency is per query; the engine's first query includes
+loading the frame.
+
+--sheet-write-rows runs an UPDATE, a DELETE and a multi-row INSERT on a tab of
+that many rows two ways ("sheetwrite/<rows>/diff", "/rewrite"): pushing only
+the affected cells and rows, and rewriting the whole sheet after each
+statement. Latency is per statement including the push; cells_written and
+the Sheets request count are reported.
+
+--fed-join joins a MySQL orders table of <rows> rows (SQLite stand-in) with a
+sheet of <keys> customers two ways ("fedjoin/<rows>x<keys>/fullscan",
+"/federated"): reading the MySQL table whole and joining locally, and
+run_federated with projection, filter and join-key pushdown. "mysql" counts
+round trips (each delayed by --db-latency) and mysql_rows the rows scanned.
+
+--prune-tables generates SQL for the questions against a synthetic schema of
+that many tables two ways ("schemaprune/<tables>/full", "/pruned"): with
+every table in the prompt, and with the SchemaIndex selection main.py sends.
+The mock model charges --latency plus --prompt-latency per 1000 prompt
+characters; prompt_chars and prompt_tokens (chars / 4) are per question.
+
+--explain-rows streams a MySQL result of that many rows and explains it two ways
+("explain/<rows>/blocking", "/background"): a blocking generate_sql call
+after the last chunk, as main.py used to, and explainer.explain_result
+started on the first chunk. Stages "ttfr" and "explain.first_token" give the
+time to the first result chunk and to the first explanation token; the mock
+model charges --latency, --token-latency per word and --prompt-latency.
+
+Exit code 1 when a scenario in --baseline regressed by more than --tolerance
+(latency, throughput, memory) or made more API calls.
+"""
+import os
+
+# the benchmark must not read or fill the on-disk SQL cache
+os.environ["SQL_CACHE_PATH"] = ":memory:"
+os.environ["SHEET_WRITE_JOURNAL"] = ""
+
+import argparse
+import hashlib
+import json
+import re
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import SCHEMA_PRUNE_MIN_TABLES, SCHEMA_PRUNE_TOP_K, RESULT_CACHE_MAX_BYTES, SYSTEM_PROMPT_DEFAULT
+import explainer
+from db_utils import execute_mysql_query, get_mysql_schema
+from federated import run_federated
+import gsheets_utils
+from gsheets_utils import SheetWorkbook, execute_sheet_sql_on_df, push_df_to_sheet, safe_table_name
+from mocks import MockModel, FakeSpreadsheet, FakeWorksheet, SQLiteMySQLStandIn
+from query_executor import stream_query
+from result_cache import ResultCache
+from schema_retriever import SchemaIndex, format_schema_context
+from service import QueryService, ServiceClient, make_server
+from sheet_engine import SheetSQLEngine
+from sheet_writer import get_sheet_writer
+from sql_generator import build_prompt, generate_sql, generate_sql_with_repair, get_sql_cache
+from sql_utils import is_single_select
+from sql_validator import validate_sql
+from tracing import span
+
+SOURCES = {"mysql": "MySQL", "sheets": "Google Sheets"}
+
+DEFAULT_QUESTIONS = [
+    "How many orders are there per status and what is their total amount?",
+    "Show the latest orders of customer 42.",
+    "Which region brings in the most revenue?",
+    "What are the five products with the highest average order amount since July?",
+    "List a few rows from the invoices table.",
+    "Total order amount per status.",
+    "Orders placed by customer 7, newest first.",
+    "Revenue by customer region.",
+    "Top products by average amount in the second half of the year.",
+    "Show some shipments.",
+]
+
+# What the mock model answers: picked per question by hash so replays are deterministic.
+WORKLOAD = (
+    "SELECT status, COUNT(*) AS orders, SUM(amount) AS total FROM orders GROUP BY status",
+    "SELECT * FROM orders WHERE customer_id = {n} ORDER BY id DESC LIMIT 100",
+    "SELECT c.region, SUM(o.amount) AS total FROM orders o JOIN customers c ON c.id = o.customer_id "
+    "GROUP BY c.region ORDER BY total DESC",
+    "SELECT product, AVG(amount) AS avg_amount FROM orders WHERE created >= '2024-07-01' "
+    "GROUP BY product ORDER BY avg_amount DESC LIMIT 5",
+    "SELECT * FROM {filler} LIMIT 10",
+)
+WRITE_BACK = "UPDATE orders SET status = 'reviewed' WHERE id = {n}"
+
+_PRODUCTS = ["laptop", "monitor", "keyboard", "mouse", "dock", "headset", "webcam", "cable"]
+_STATUSES = ["new", "paid", "shipped", "delivered", "returned"]
+_REGIONS = ["north", "south", "east", "west", "central"]
+_FILLER_WORDS = ["invoices", "shipments", "suppliers", "returns", "campaigns", "tickets", "payments", "employees"]
+
+
+def _read_jsonl(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _int_list(text: str) -> List[int]:
+    """argparse type for comma-separated counts; "" is an empty list (skip)."""
+    counts = [int(float(x)) for x in text.split(",") if x.strip()]
+    if any(n <= 0 for n in counts):
+        raise argparse.ArgumentTypeError(f"counts must be positive: {text!r}")
+    return counts
+
+
+def make_tables(rows: int, tables: int, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """orders (`rows` rows) and customers, padded with small filler tables up to `tables`."""
+    rng = np.random.default_rng(seed)
+    n_customers = max(10, min(rows // 10, 10000))
+    data = {
+        "orders": pd.DataFrame({
+            "id": np.arange(1, rows + 1),
+            "customer_id": rng.integers(1, n_customers + 1, rows),
+            "product": rng.choice(_PRODUCTS, rows),
+            "status": rng.choice(_STATUSES, rows),
+            "amount": rng.integers(100, 100000, rows) / 100,
+            "created": (np.datetime64("2024-01-01") + rng.integers(0, 366, rows)).astype(str),
+        }),
+        "customers": pd.DataFrame({
+            "id": np.arange(1, n_customers + 1),
+            "name": [f"customer {i}" for i in range(1, n_customers + 1)],
+            "region": rng.choice(_REGIONS, n_customers),
+        }),
+    }
+    filler = pd.DataFrame({"id": np.arange(1, 11), "label": [f"item {i}" for i in range(1, 11)],
+                           "value": rng.integers(0, 1000, 10)})
+    for i in range(max(tables - len(data), 0)):
+        data[f"{_FILLER_WORDS[i % len(_FILLER_WORDS)]}_{i:04d}"] = filler
+    return data
+
+
+def _sheet_values(df: pd.DataFrame) -> List[list]:
+    return [list(df.columns)] + df.astype(str).values.tolist()
+
+
+class Scenario:
+    """One data set behind one source, with fresh caches; replay() runs questions through it."""
+
+    def __init__(self, source: str, data: Dict[str, pd.DataFrame], latency: float, tag: str):
+        self.source = SOURCES[source]
+        self.rows = len(data["orders"])
+        self.fillers = [t for t in data if t not in ("orders", "customers")] or ["customers"]
+        self.db: Optional[SQLiteMySQLStandIn] = None
+        self.sh: Optional[FakeSpreadsheet] = None
+        self.book: Optional[SheetWorkbook] = None
+        self.worksheets: List[FakeWorksheet] = []
+        self.mysql_schema: Dict[str, list] = {}
+        self.sheet_schema: Dict[str, list] = {}
+        if source == "mysql":
+            self.db = SQLiteMySQLStandIn()
+            for name, df in data.items():
+                self.db.load_frame(name, df)
+            self.mysql_schema = self.db.schema()
+            full_schema = self.mysql_schema
+        else:
+            # a unique id keeps the module-level sheet cache from carrying data between scenarios
+            self.sh = FakeSpreadsheet(spreadsheet_id=f"benchmark-{tag}-{time.perf_counter_ns()}")
+            for name, df in data.items():
+                self.worksheets.append(self.sh.add(FakeWorksheet(_sheet_values(df), title=name)))
+            self.book = SheetWorkbook(self.sh)
+            full_schema = self.book.schema()
+            for title, cols in full_schema.items():
+                self.sheet_schema[title] = self.sheet_schema[safe_table_name(title)] = cols
+        self.full_schema = full_schema
+        self.schema_context = format_schema_context(full_schema)
+        self.schema_index = SchemaIndex(full_schema) if len(full_schema) > SCHEMA_PRUNE_MIN_TABLES else None
+        self.model = MockModel(latency=latency, responder=self._respond)
+        self.engine = SheetSQLEngine()
+        self.result_cache = ResultCache(RESULT_CACHE_MAX_BYTES)
+        get_sql_cache().clear()
+
+    def _respond(self, question: str) -> str:
+        h = int(hashlib.md5(question.encode("utf-8")).hexdigest(), 16)
+        return WORKLOAD[h % len(WORKLOAD)].format(n=h % 50 + 1, filler=self.fillers[h % len(self.fillers)])
+
+    def api_calls(self) -> Dict[str, int]:
+        calls = {"gemini": self.model.calls, "sheets": 0, "cells_written": 0}
+        if self.sh is not None:
+            calls["sheets"] = self.sh.requests + sum(ws.requests for ws in self.worksheets)
+            calls["cells_written"] = sum(ws.cells_written for ws in self.worksheets)
+        return calls
+
+    def _maps(self, sql: str):
+        if self.book is None:
+            return {}, {}
+        return self.book.table_maps(self.book.tables_in_sql(sql))
+
+    def _validate(self, sql: str):
+        return validate_sql(sql, self.source, self.mysql_schema, self.sheet_schema, self.db,
+                            self._maps(sql)[0], self.engine)
+
+    def execute(self, sql: str) -> Optional[str]:
+        """Run sql the way main.py does (streamed, result cache, write-back); returns the error."""
+        df_map, ws_map = self._maps(sql)
+        result = stream_query(self.source, self.db, df_map, ws_map, sql, self.engine, self.result_cache)
+        for _ in result:
+            pass
+        if self.book is not None and not is_single_select(sql):
+            for title in self.book.titles():
+                if title in df_map:
+                    self.book.set_frame(title, df_map[title])
+        return result.error
+
+    def ask(self, question: str) -> Optional[str]:
+        prompt_schema = self.schema_context
+        if self.schema_index is not None:
+            with span("schema.prune", tables=len(self.full_schema)):
+                relevant = self.schema_index.select(question, k=SCHEMA_PRUNE_TOP_K)
+            if relevant:
+                prompt_schema = format_schema_context(self.full_schema, relevant)
+        sql, check = generate_sql_with_repair(question, prompt_schema, self._validate, model=self.model)
+        if check is None:
+            return sql
+        if check.errors or check.rejected:
+            return "; ".join(check.errors) or check.rejected
+        return self.execute(check.sql)
+
+    def replay(self, questions: List[str], write_every: int) -> List[dict]:
+        """One trace summary per question: {"ms", "error", "spans": [(name, ms, requests)]}."""
+        out = []
+        for i, question in enumerate(questions):
+            with span("question", source=self.source) as trace:
+                error = self.ask(question)
+                if write_every and i % write_every == write_every - 1:
+                    with span("write_back"):
+                        error = error or self.execute(WRITE_BACK.format(n=(i * 7919) % self.rows + 1))
+            out.append({"ms": trace.duration * 1000, "error": error,
+                        "spans": [(s.name, s.duration * 1000, s.attrs.get("requests", 0))
+                                  for _, s in trace.walk()]})
+        if self.book is not None:
+            get_sheet_writer().flush()   # queued write-backs count towards this pass's API calls
+        return out
+
+
+def _pct(values: List[float], q: float) -> float:
+    return round(float(np.percentile(values, q)), 3) if values else 0.0
+
+
+def summarize(traces: List[dict], elapsed: float, api: Dict[str, int]) -> dict:
+    stages: Dict[str, dict] = {}
+    for trace in traces:
+        for name, ms, requests in trace["spans"]:
+            stage = stages.setdefault(name, {"ms": [], "requests": 0})
+            stage["ms"].append(ms)
+            if isinstance(requests, (int, float)):
+                stage["requests"] += requests
+    latencies = [t["ms"] for t in traces]
+    return {
+        "questions": len(traces),
+        "errors": sum(t["error"] is not None for t in traces),
+        "p50_ms": _pct(latencies, 50),
+        "p95_ms": _pct(latencies, 95),
+        "throughput_qps": round(len(traces) / elapsed, 3) if elapsed else 0.0,
+        "api": api,
+        "stages": {name: {"count": len(s["ms"]), "p50_ms": _pct(s["ms"], 50), "p95_ms": _pct(s["ms"], 95),
+                          "requests": s["requests"]}
+                   for name, s in stages.items() if name != "question"},
+    }
+
+
+def run_scenario(source: str, rows: int, tables: int, questions: List[str], latency: float,
+                 write_every: int, memory: bool = True) -> Dict[str, dict]:
+    """{"<source>/<rows>x<tables>/cold": summary, ".../warm": summary}"""
+    tag = f"{source}/{rows}x{tables}"
+    data = make_tables(rows, tables)
+    results = {}
+    scenario = Scenario(source, data, latency, tag)
+    for phase in ("cold", "warm"):
+        before = scenario.api_calls()
+        started = time.perf_counter()
+        traces = scenario.replay(questions, write_every)
+        elapsed = time.perf_counter() - started
+        after = scenario.api_calls()
+        results[f"{tag}/{phase}"] = summarize(traces, elapsed, {k: after[k] - before[k] for k in after})
+    if memory:
+        # separate pass: tracemalloc slows allocation-heavy code and would skew the latencies above
+        scenario = Scenario(source, data, latency, tag)
+        tracemalloc.start()
+        try:
+            scenario.replay(questions, write_every)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        results[f"{tag}/cold"]["peak_mb"] = round(peak / 2 ** 20, 2)
+    return results
+
+
+BULK_TABLE = "CREATE TABLE bulk_orders (id INT PRIMARY KEY, customer_id INT, product VARCHAR(32), amount DECIMAL(10,2))"
+BULK_INSERT = "INSERT INTO bulk_orders (id, customer_id, product, amount) VALUES ({}, {}, '{}', {})"
+
+
+def run_bulk_insert(rows: int, db_latency: float) -> Dict[str, dict]:
+    """{"bulk/<rows>/row": summary, "bulk/<rows>/batch": summary} for loading `rows` INSERTs.
+
+    Latencies are per call in row mode and per round trip in batch mode.
+    """
+    rng = np.random.default_rng(0)
+    statements = [BULK_INSERT.format(i, c, _PRODUCTS[p], a) for i, c, p, a in
+                  zip(range(1, rows + 1), rng.integers(1, 10000, rows), rng.integers(0, len(_PRODUCTS), rows),
+                      rng.integers(100, 100000, rows) / 100)]
+    results = {}
+    for mode in ("row", "batch"):
+        db = SQLiteMySQLStandIn(latency=db_latency)
+        execute_mysql_query(db, BULK_TABLE)
+        db.round_trips = 0
+        errors, latencies = [], []
+        started = time.perf_counter()
+        if mode == "row":
+            for q in statements:
+                t = time.perf_counter()
+                errors.append(execute_mysql_query(db, q)[1])
+                latencies.append((time.perf_counter() - t) * 1000)
+        else:
+            df, err = execute_mysql_query(db, ";\n".join(statements))
+            errors.append(err)
+            if df is not None:
+                latencies = [e["ms"] for e in df.attrs["batch"].statements]
+        elapsed = time.perf_counter() - started
+        trips = db.round_trips
+        loaded = int(execute_mysql_query(db, "SELECT COUNT(*) AS n FROM bulk_orders")[0]["n"].iloc[0])
+        errors = [e for e in errors if e] + ([f"loaded {loaded} of {rows} rows"] if loaded != rows else [])
+        results[f"bulk/{rows}/{mode}"] = {
+            "questions": rows,
+            "errors": len(errors),
+            "error": errors[0] if errors else None,
+            "p50_ms": _pct(latencies, 50),
+            "p95_ms": _pct(latencies, 95),
+            "throughput_qps": round(rows / elapsed, 3) if elapsed else 0.0,
+            "api": {"gemini": 0, "sheets": 0, "cells_written": 0, "mysql": trips},
+            "stages": {"mysql.execute" if mode == "row" else "mysql.batch": {
+                "count": len(latencies), "p50_ms": _pct(latencies, 50), "p95_ms": _pct(latencies, 95),
+                "requests": trips}},
+        }
+        db.close()
+    return results
+
+
+def _describe_schema(conn) -> Dict[str, list]:
+    """The loader get_mysql_schema replaced: SHOW TABLES, then one DESCRIBE per table."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SHOW TABLES")
+        schema = {}
+        for (table,) in cursor.fetchall():
+            cursor.execute(f"DESCRIBE `{table}`")
+            schema[table] = [{"name": col[0], "type": col[1]} for col in cursor.fetchall()]
+        return schema
+    finally:
+        cursor.close()
+
+
+def run_schema_load(tables: int, db_latency: float, runs: int = 3) -> Dict[str, dict]:
+    """{"schema/<tables>/describe" | "/information_schema" | "/cached": summary} for reading a schema.
+
+    describe: SHOW TABLES plus DESCRIBE per table (the old loader).
+    information_schema: get_mysql_schema without its cache (version check plus
+    three queries). cached: get_mysql_schema on a warm cache, i.e. a Streamlit
+    rerun (one version query). Latency is per full load; every round trip is
+    delayed by db_latency.
+    """
+    db = SQLiteMySQLStandIn(latency=0.0)
+    # a unique database keeps other scenarios' schemas out of the cache key
+    db.database = f"benchmark-schema-{tables}-{time.perf_counter_ns()}"
+    db._db.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, name TEXT)")
+    for i in range(tables):
+        db._db.execute(f"CREATE TABLE t_{i:04d} (id INTEGER PRIMARY KEY, customer_id INTEGER "
+                       f"REFERENCES customers(id), product VARCHAR(32), amount DECIMAL(10,2), "
+                       f"created DATETIME, note TEXT)")
+        db._db.execute(f"CREATE INDEX t_{i:04d}_customer ON t_{i:04d} (customer_id)")
+    db.latency = db_latency
+    loaders = {
+        "describe": lambda: _describe_schema(db),
+        "information_schema": lambda: get_mysql_schema(db, use_cache=False),
+        "cached": lambda: get_mysql_schema(db),
+    }
+    results = {}
+    for mode, load in loaders.items():
+        latencies, errors = [], []
+        if mode == "cached":
+            get_mysql_schema(db)
+        db.round_trips = 0
+        for _ in range(runs):
+            started = time.perf_counter()
+            schema = load()
+            latencies.append((time.perf_counter() - started) * 1000)
+            if len(schema) != tables + 1:
+                errors.append(f"loaded {len(schema)} of {tables + 1} tables")
+        results[f"schema/{tables}/{mode}"] = {
+            "questions": runs,
+            "errors": len(errors),
+            "error": errors[0] if errors else None,
+            "p50_ms": _pct(latencies, 50),
+            "p95_ms": _pct(latencies, 95),
+            "throughput_qps": round(runs / (sum(latencies) / 1000), 3) if sum(latencies) else 0.0,
+            "api": {"gemini": 0, "sheets": 0, "cells_written": 0, "mysql": db.round_trips // runs},
+            "stages": {},
+        }
+    db.close()
+    return results
+
+
+def _load_records(sh: FakeSpreadsheet, titles: List[str]) -> Dict[str, pd.DataFrame]:
+    """The loader SheetWorkbook replaced: get_all_records per tab, all columns left as Python objects."""
+    return {title: pd.DataFrame(sh.worksheet(title).get_all_records()) for title in titles}
+
+
+def run_sheet_load(tabs: int, rows: int, runs: int = 3) -> Dict[str, dict]:
+    """{"sheetload/<tabs>x<rows>/records" | "/batch" | "/cached": summary} for loading every tab.
+
+    records: one get_all_records request per tab (the old loader). batch: one
+    values_batch_get for all tabs with typed columns (SheetWorkbook, cold). cached:
+    a new workbook on an unchanged spreadsheet, served from the shared tab cache.
+    Latency is per full load; peak_mb comes from a separate tracemalloc pass and
+    frame_mb is what the loaded frames hold.
+    """
+    values = _sheet_values(make_tables(rows, 1)["orders"])
+    titles = [f"tab_{i:03d}" for i in range(tabs)]
+
+    def spreadsheet():
+        # a unique id keeps each cold load from hitting the module-level caches
+        sh = FakeSpreadsheet(spreadsheet_id=f"benchmark-load-{time.perf_counter_ns()}")
+        for title in titles:
+            sh.add(FakeWorksheet(values, title=title))
+        return sh
+
+    warm = spreadsheet()
+    SheetWorkbook(warm).load(titles)
+    loaders = {
+        "records": lambda: (lambda sh: _load_records(sh, titles))(spreadsheet()),
+        "batch": lambda: SheetWorkbook(spreadsheet()).load(titles),
+        "cached": lambda: SheetWorkbook(warm).load(titles),
+    }
+    results = {}
+    for mode, load in loaders.items():
+        latencies, requests, frames = [], 0, {}
+        for _ in range(runs):
+            before = warm.requests + sum(ws.requests for ws in warm._worksheets)
+            started = time.perf_counter()
+            frames = load()
+            latencies.append((time.perf_counter() - started) * 1000)
+            if mode == "cached":
+                requests = warm.requests + sum(ws.requests for ws in warm._worksheets) - before
+        if mode != "cached":
+            sh = spreadsheet()
+            SheetWorkbook(sh).load(titles) if mode == "batch" else _load_records(sh, titles)
+            requests = sh.requests + sum(ws.requests for ws in sh._worksheets)
+        frame_bytes = sum(int(df.memory_usage(deep=True).sum()) for df in frames.values())
+        del frames
+        tracemalloc.start()
+        try:
+            kept = load()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        del kept
+        results[f"sheetload/{tabs}x{rows}/{mode}"] = {
+            "questions": runs,
+            "errors": 0,
+            "p50_ms": _pct(latencies, 50),
+            "p95_ms": _pct(latencies, 95),
+            "throughput_qps": round(tabs * rows / (sum(latencies) / len(latencies) / 1000), 3) if latencies else 0.0,
+            "peak_mb": round(peak / 2 ** 20, 2),
+            "frame_mb": round(frame_bytes / 2 ** 20, 2),
+            "api": {"gemini": 0, "sheets": requests, "cells_written": 0},
+            "stages": {},
+        }
+    return results
+
+
+SHEET_QUERIES = (
+    "SELECT status, COUNT(*) AS orders, SUM(amount) AS total FROM orders GROUP BY status",
+    "SELECT * FROM orders WHERE customer_id = {n} ORDER BY id DESC LIMIT 100",
+    "SELECT product, AVG(amount) AS avg_amount FROM orders WHERE created >= '2024-07-01' "
+    "GROUP BY product ORDER BY avg_amount DESC LIMIT 5",
+    "SELECT COUNT(*) AS n FROM orders WHERE amount BETWEEN {n} AND {n} + 50",
+)
+
+
+def _sqldf(sql: str, df_map: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """The path SheetSQLEngine replaced, as pandasql.sqldf ran it: a fresh SQLite
+    database per query with every referenced frame copied in."""
+    import sqlite3
+    db = sqlite3.connect(":memory:")
+    try:
+        for name, df in df_map.items():
+            if re.search(rf"\b{re.escape(name)}\b", sql):
+                df.to_sql(name, db, index=False)
+        return pd.read_sql_query(sql, db)
+    finally:
+        db.close()
+
+
+def _same_frame(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    # an index can change the scan order, and with it the last bits of a float SUM/AVG
+    try:
+        pd.testing.assert_frame_equal(a, b, check_exact=False)
+        return True
+    except AssertionError:
+        return False
+
+
+def run_sheet_query(rows: int, queries: int) -> Dict[str, dict]:
+    """{"sheetquery/<rows>/pandasql" | "/engine": summary} for `queries` SELECTs on one sheet.
+
+    pandasql: a fresh SQLite database loaded with the frame for every query.
+    engine: one SheetSQLEngine, loaded by the first query (that load counts
+    towards its latency) and reused by the rest. Both run the same statements;
+    a result that differs between them counts as an error.
+    """
+    df_map = {"orders": make_tables(rows, 1)["orders"]}
+    statements = [SHEET_QUERIES[i % len(SHEET_QUERIES)].format(n=i * 37 % 500 + 1) for i in range(queries)]
+    engine = SheetSQLEngine()
+
+    def run_engine(sql):
+        engine.sync(df_map)
+        return engine.query(sql)
+
+    results, answers = {}, {}
+    for mode, run in (("pandasql", lambda sql: _sqldf(sql, df_map)), ("engine", run_engine)):
+        latencies, frames = [], []
+        for sql in statements:
+            started = time.perf_counter()
+            frames.append(run(sql))
+            latencies.append((time.perf_counter() - started) * 1000)
+        answers[mode] = frames
+        errors = 0
+        if mode != "pandasql":
+            errors = sum(not _same_frame(a, b) for a, b in zip(frames, answers["pandasql"]))
+        results[f"sheetquery/{rows}/{mode}"] = {
+            "questions": queries,
+            "errors": errors,
+            "p50_ms": _pct(latencies, 50),
+            "p95_ms": _pct(latencies, 95),
+            "throughput_qps": round(queries / (sum(latencies) / 1000), 3) if latencies else 0.0,
+            "api": {"gemini": 0, "sheets": 0, "cells_written": 0},
+            "stages": {},
+        }
+    return results
+
+
+SHEET_MUTATIONS = (
+    "UPDATE orders SET status = 'reviewed' WHERE UPPER(product) = 'DOCK' AND amount > 900",
+    "DELETE FROM orders WHERE customer_id IN (1, 2, 3) OR (status = 'returned' AND amount BETWEEN 100 AND 110)",
+    "INSERT INTO orders (id, customer_id, product, status, amount, created) VALUES "
+    + ", ".join(f"({10 ** 9 + i}, {i}, 'cable', 'new', 9.5, '2024-12-31')" for i in range(20)),
+)
+
+
+def run_sheet_write(rows: int) -> Dict[str, dict]:
+    """{"sheetwrite/<rows>/diff" | "/rewrite": summary} for SHEET_MUTATIONS on one <rows>-row tab.
+
+    diff: execute_sheet_sql_on_df pushing only the affected cells and rows
+    (write-behind off, so the push is timed with the statement). rewrite: the
+    same statements, each followed by a full-sheet push_df_to_sheet as before
+    diff-based write-back. Latency is per statement; a sheet that ends up
+    different from the frame counts as an error.
+    """
+    values = _sheet_values(make_tables(rows, 1)["orders"])
+    results = {}
+    write_behind = gsheets_utils.SHEET_WRITE_BEHIND
+    gsheets_utils.SHEET_WRITE_BEHIND = False
+    try:
+        for mode in ("diff", "rewrite"):
+            sh = FakeSpreadsheet(spreadsheet_id=f"benchmark-write-{time.perf_counter_ns()}")
+            ws = sh.add(FakeWorksheet(values, title="orders"))
+            df_map = {"orders": SheetWorkbook(sh).load(["orders"])["orders"]}
+            ws.requests = sh.requests = 0
+            latencies, errors = [], []
+            for sql in SHEET_MUTATIONS:
+                started = time.perf_counter()
+                if mode == "diff":
+                    _, err = execute_sheet_sql_on_df(df_map, sql, {"orders": ws})
+                else:
+                    _, err = execute_sheet_sql_on_df(df_map, sql, {})
+                    push_df_to_sheet(ws, df_map["orders"])
+                latencies.append((time.perf_counter() - started) * 1000)
+                if err:
+                    errors.append(err)
+            if ws.values != gsheets_utils.sheet_values_with_header(df_map["orders"]):
+                errors.append("sheet differs from the frame")
+            results[f"sheetwrite/{rows}/{mode}"] = {
+                "questions": len(SHEET_MUTATIONS),
+                "errors": len(errors),
+                "error": errors[0] if errors else None,
+                "p50_ms": _pct(latencies, 50),
+                "p95_ms": _pct(latencies, 95),
+                "throughput_qps": round(len(latencies) / (sum(latencies) / 1000), 3) if latencies else 0.0,
+                "api": {"gemini": 0, "sheets": sh.requests + ws.requests, "cells_written": ws.cells_written},
+                "stages": {},
+            }
+    finally:
+        gsheets_utils.SHEET_WRITE_BEHIND = write_behind
+    return results
+
+
+FEDERATED_QUERIES = (
+    "SELECT v.tier, COUNT(*) AS orders, SUM(o.amount) AS total FROM orders o "
+    "JOIN vip v ON v.customer_id = o.customer_id WHERE o.status = 'paid' GROUP BY v.tier ORDER BY v.tier",
+    "SELECT o.id, o.amount, v.tier FROM orders o JOIN vip v ON o.customer_id = v.customer_id "
+    "WHERE o.amount > 900 ORDER BY o.id",
+)
+
+
+def _full_scan_join(sql: str, db, mysql_schema: Dict[str, list], df_map: Dict[str, pd.DataFrame]):
+    """Federated execution without pushdown: every MySQL table read whole, then joined locally."""
+    pieces = dict(df_map)
+    for table in mysql_schema:
+        if re.search(rf"\b{re.escape(table)}\b", sql):
+            df, err = execute_mysql_query(db, f"SELECT * FROM `{table}`")
+            if err:
+                return None, err
+            if df.attrs.get("truncated"):
+                return None, f"scan of {table} stopped early: {df.attrs['truncated']}"
+            pieces[table] = df
+    engine = SheetSQLEngine(index_after=0)
+    engine.sync(pieces)
+    return engine.query(sql), None
+
+
+def run_federated_join(rows: int, keys: int, db_latency: float) -> Dict[str, dict]:
+    """{"fedjoin/<rows>x<keys>/fullscan" | "/federated": summary} for FEDERATED_QUERIES.
+
+    A <rows>-row MySQL orders table (SQLite stand-in) is joined with a sheet of
+    <keys> customers. fullscan: SELECT * of the MySQL table, then the join runs
+    locally. federated: run_federated with projection, filter and join-key
+    pushdown. Latency is per query; "mysql" counts round trips and mysql_rows
+    the rows the scans returned. A result that differs between the two counts
+    as an error.
+    """
+    data = make_tables(rows, 1)
+    db = SQLiteMySQLStandIn(latency=db_latency)
+    db.load_frame("orders", data["orders"])
+    mysql_schema = db.schema()
+    customers = data["customers"]["id"]
+    vip = pd.DataFrame({"customer_id": customers.iloc[:keys].to_numpy(),
+                        "tier": [("gold", "silver", "bronze")[i % 3] for i in range(min(keys, len(customers)))]})
+    df_map = {"vip": vip}
+    answers, results = {}, {}
+    for mode, run in (("fullscan", _full_scan_join), ("federated", run_federated)):
+        latencies, errors, frames = [], [], []
+        db.round_trips = db.rows_fetched = 0
+        for sql in FEDERATED_QUERIES:
+            started = time.perf_counter()
+            df, err = run(sql, db, mysql_schema, df_map)
+            latencies.append((time.perf_counter() - started) * 1000)
+            if err:
+                errors.append(err)
+            frames.append(df)
+        answers[mode] = frames
+        if mode != "fullscan":
+            errors += [f"query {i + 1} differs from the full scan" for i, (a, b) in
+                       enumerate(zip(frames, answers["fullscan"])) if a is None or b is None or not _same_frame(a, b)]
+        results[f"fedjoin/{rows}x{keys}/{mode}"] = {
+            "questions": len(FEDERATED_QUERIES),
+            "errors": len(errors),
+            "error": errors[0] if errors else None,
+            "p50_ms": _pct(latencies, 50),
+            "p95_ms": _pct(latencies, 95),
+            "throughput_qps": round(len(latencies) / (sum(latencies) / 1000), 3) if latencies else 0.0,
+            "api": {"gemini": 0, "sheets": 0, "cells_written": 0, "mysql": db.round_trips},
+            "mysql_rows": db.rows_fetched,
+            "stages": {},
+        }
+    db.close()
+    return results
+
+
+_SCHEMA_AREAS = ["sales", "crm", "billing", "hr", "inventory", "logistics", "marketing", "support", "finance",
+                 "procurement", "web", "mobile", "analytics", "legal", "ops", "partner", "retail", "wholesale",
+                 "audit", "payroll", "events", "content", "research", "quality", "security"]
+_SCHEMA_ENTITIES = ["orders", "customers", "products", "invoices", "shipments", "suppliers", "employees",
+                    "campaigns", "tickets", "payments", "regions", "warehouses", "contracts", "accounts",
+                    "leads", "returns", "refunds", "budgets", "projects", "tasks", "assets", "vendors",
+                    "stores", "carts", "sessions", "reviews", "coupons", "subscriptions", "plans", "teams",
+                    "departments", "locations", "devices", "licenses", "audits", "expenses", "quotes",
+                    "deliveries", "carriers", "promotions"]
+
+
+def make_wide_schema(tables: int) -> Dict[str, list]:
+    """{table: [{name, type}]} of `tables` <area>_<entity> tables, each linked to two others by <entity>_id."""
+    names = [f"{area}_{entity}" for area in _SCHEMA_AREAS for entity in _SCHEMA_ENTITIES]
+    names += [f"{n}_{i // len(names) + 1}" for i, n in enumerate(names * (tables // len(names)))]
+    schema = {}
+    for i, table in enumerate(names[:tables]):
+        area, entity = table.split("_")[:2]
+        cols = [{"name": "id", "type": "int"}, {"name": "name", "type": "varchar(100)"}]
+        for j in (1, 7):
+            other = _SCHEMA_ENTITIES[(_SCHEMA_ENTITIES.index(entity) + j) % len(_SCHEMA_ENTITIES)]
+            cols.append({"name": f"{other.rstrip('s')}_id", "type": "int", "references": f"{area}_{other}.id"})
+        cols += [{"name": "status", "type": "varchar(20)"}, {"name": "amount", "type": "decimal(10,2)"},
+                 {"name": "created_at", "type": "datetime"}, {"name": "updated_at", "type": "datetime"}]
+        schema[table] = cols
+    return schema
+
+
+def run_schema_prune(tables: int, questions: List[str], latency: float, prompt_latency: float) -> Dict[str, dict]:
+    """{"schemaprune/<tables>/full" | "/pruned": summary} for generating SQL against a wide schema.
+
+    full: every table in the prompt. pruned: SchemaIndex.select (top
+    SCHEMA_PRUNE_TOP_K plus join neighbours), as main.py does; building the
+    index is timed once (index_ms). Latency is per question, end to end through
+    generate_sql on a MockModel whose first token costs `latency` plus
+    `prompt_latency` per 1000 prompt characters. prompt_chars/prompt_tokens are
+    means per question; tokens are estimated as chars / 4 like the app's caption.
+    """
+    schema = make_wide_schema(tables)
+    full_context = format_schema_context(schema)
+    started = time.perf_counter()
+    index = SchemaIndex(schema)
+    index_ms = (time.perf_counter() - started) * 1000
+    results = {}
+    for mode in ("full", "pruned"):
+        model = MockModel(latency=latency, prompt_latency=prompt_latency)
+        latencies, prune_ms, chars, fallbacks = [], [], [], 0
+        for question in questions:
+            started = time.perf_counter()
+            context = full_context
+            if mode == "pruned":
+                relevant = index.select(question, k=SCHEMA_PRUNE_TOP_K)
+                prune_ms.append((time.perf_counter() - started) * 1000)
+                if relevant:
+                    context = format_schema_context(schema, relevant)
+                else:
+                    fallbacks += 1
+            generate_sql(question, context, use_cache=False, model=model)
+            latencies.append((time.perf_counter() - started) * 1000)
+            chars.append(len(build_prompt(question, context, SYSTEM_PROMPT_DEFAULT)))
+        summary = {
+            "questions": len(questions),
+            "errors": 0,
+            "p50_ms": _pct(latencies, 50),
+            "p95_ms": _pct(latencies, 95),
+            "throughput_qps": round(len(latencies) / (sum(latencies) / 1000), 3) if latencies else 0.0,
+            "prompt_chars": round(float(np.mean(chars))),
+            "prompt_tokens": round(float(np.mean(chars)) / 4),
+            "api": {"gemini": model.calls, "sheets": 0, "cells_written": 0},
+            "stages": {},
+        }
+        if mode == "pruned":
+            summary["index_ms"] = round(index_ms, 3)
+            summary["full_schema_fallbacks"] = fallbacks
+            summary["stages"]["schema.prune"] = {"count": len(prune_ms), "p50_ms": _pct(prune_ms, 50),
+                                                 "p95_ms": _pct(prune_ms, 95), "requests": 0}
+        results[f"schemaprune/{tables}/{mode}"] = summary
+    return results
+
+
+# The summary request main.py sent through generate_sql (with the SQL system prompt) before explainer.py.
+_BLOCKING_EXPLAIN_PROMPT = """You are a data analyst. The user ran this SQL:
+{sql}
+
+Here are up to first 10 rows (CSV):
+{sample}
+
+Provide a short (2-4 sentence) plain-English summary of what the results show. Return only the summary."""
+
+
+def _timing_stage(values: List[float]) -> dict:
+    return {"count": len(values), "p50_ms": _pct(values, 50), "p95_ms": _pct(values, 95), "requests": 0}
+
+
+def run_explain(rows: int, queries: int, latency: float, token_latency: float,
+                prompt_latency: float) -> Dict[str, dict]:
+    """{"explain/<rows>/blocking" | "/background": summary} for explaining streamed MySQL results.
+
+    Each query streams a <rows>-row result from the stand-in and is explained by
+    a MockModel (--latency, plus token_latency per word and prompt_latency per
+    1000 prompt characters). blocking: after the last chunk, one generate_sql
+    call with the SQL system prompt, as main.py did. background: explain_result
+    started on the first chunk and streamed. Stages "ttfr" (first result chunk)
+    and "explain.first_token" are measured from the start of execution; p50/p95
+    are the time until both result and explanation are complete.
+    """
+    db = SQLiteMySQLStandIn()
+    db.load_frame("orders", make_tables(rows, 1)["orders"])
+    results = {}
+    for mode in ("blocking", "background"):
+        explainer._CACHE.clear()
+        model = MockModel(latency=latency, token_latency=token_latency, prompt_latency=prompt_latency)
+        ttfr, first_token, done, errors = [], [], [], []
+        for i in range(queries):
+            sql = f"SELECT * FROM orders WHERE amount > {i}"
+            started = time.perf_counter()
+            stream = stream_query("MySQL", db, {}, {}, sql)
+            job, first = None, None
+            for chunk in stream:
+                if first is None:
+                    first = chunk
+                    ttfr.append((time.perf_counter() - started) * 1000)
+                    if mode == "background":
+                        job = explainer.explain_result(sql, chunk, model=model)
+            if first is None or stream.error:
+                errors.append(stream.error or "no rows")
+                continue
+            if mode == "blocking":
+                text = generate_sql(_BLOCKING_EXPLAIN_PROMPT.format(sql=sql, sample=first.head(10).to_csv(index=False)),
+                                    "", SYSTEM_PROMPT_DEFAULT, temperature=0.2, use_cache=False, model=model)
+                first_token.append((time.perf_counter() - started) * 1000)
+            else:
+                text = job.result()
+                if job.error:
+                    errors.append(job.error)
+                first_token.append((job.first_token_at - started) * 1000 if job.first_token_at else 0.0)
+            done.append((time.perf_counter() - started) * 1000)
+            if not text.strip():
+                errors.append("empty explanation")
+        results[f"explain/{rows}/{mode}"] = {
+            "questions": queries,
+            "errors": len(errors),
+            "error": errors[0] if errors else None,
+            "p50_ms": _pct(done, 50),
+            "p95_ms": _pct(done, 95),
+            "throughput_qps": round(len(done) / (sum(done) / 1000), 3) if done else 0.0,
+            "api": {"gemini": model.calls, "sheets": 0, "cells_written": 0},
+            "stages": {"ttfr": _timing_stage(ttfr), "explain.first_token": _timing_stage(first_token)},
+        }
+    db.close()
+    return results
+
+
+IMPORT_MODULES = "config,sql_generator,query_executor,service,main"
+# SDKs that should only load once their source is used
+HEAVY_MODULES = ("google.generativeai", "gspread", "google.oauth2", "mysql.connector", "streamlit")
+_IMPORT_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|( +)(\S+)")
+
+
+def run_import_time(module: str, runs: int = 3) -> Dict[str, dict]:
+    """Cold `import module` in fresh interpreters, timed with python -X importtime.
+
+    Stages are the module's direct imports (cumulative ms); "sdks" lists the
+    HEAVY_MODULES that got loaded. For main this includes running the Streamlit
+    script once in bare mode, i.e. roughly the first render.
+    """
+    totals, stages, sdks, error = [], {}, set(), None
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                              capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+        if proc.returncode:
+            error = (proc.stderr.strip().splitlines() or ["import failed"])[-1]
+            break
+        for line in proc.stderr.splitlines():
+            m = _IMPORT_LINE.match(line)
+            if not m:
+                continue
+            ms, depth, name = int(m.group(1)) / 1000, (len(m.group(2)) - 1) // 2, m.group(3)
+            if name in HEAVY_MODULES:
+                sdks.add(name)
+            if depth == 0 and name == module:
+                totals.append(ms)
+            elif depth == 1:
+                stages.setdefault(name, []).append(ms)
+    top = sorted(stages.items(), key=lambda kv: -max(kv[1]))[:8]
+    return {f"import/{module}": {
+        "questions": len(totals),
+        "errors": int(error is not None),
+        "error": error,
+        "p50_ms": _pct(totals, 50),
+        "p95_ms": _pct(totals, 95),
+        "throughput_qps": 0.0,
+        "api": {"gemini": 0, "sheets": 0, "cells_written": 0},
+        "sdks": sorted(sdks),
+        "stages": {name: {"count": len(ms), "p50_ms": _pct(ms, 50), "p95_ms": _pct(ms, 95), "requests": 0}
+                   for name, ms in top},
+    }}
+
+
+def _trace_spans(node: dict):
+    """(name, ms, requests) for a trace serialized with Span.to_dict()."""
+    yield node.get("name", ""), node.get("ms", 0.0), node.get("requests", 0)
+    for child in node.get("children", []):
+        yield from _trace_spans(child)
+
+
+def run_service_load(source: str, rows: int, tables: int, questions: List[str], latency: float,
+                     users: int, requests_per_user: int) -> Dict[str, dict]:
+    """`users` simulated users asking through the HTTP service at once, `requests_per_user` questions each.
+
+    Latency is measured at the client; stages come from the traces the service returns.
+    """
+    tag = f"service/{source}/{rows}x{tables}/{users}u"
+    scenario = Scenario(source, make_tables(rows, tables), latency, tag)
+    service = QueryService(model=scenario.model)
+    service.register("benchmark", mysql_conn=scenario.db, book=scenario.book,
+                     mysql_schema=scenario.mysql_schema if scenario.db is not None else None)
+    server = make_server(service, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, name="benchmark-service", daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    traces: List[dict] = []
+    rejected = []
+    lock = threading.Lock()
+
+    def simulate(i: int):
+        client = ServiceClient(url, user=f"user{i}")
+        for j in range(requests_per_user):
+            started = time.perf_counter()
+            try:
+                job = client.ask(questions[(i + j) % len(questions)], scenario.source, "benchmark")
+            except RuntimeError as e:
+                with lock:
+                    rejected.append(str(e))
+                continue
+            error = job.get("error") or (None if job["state"] == "done" else job["state"])
+            with lock:
+                traces.append({"ms": (time.perf_counter() - started) * 1000, "error": error,
+                               "spans": list(_trace_spans(job.get("trace") or {}))})
+
+    before = scenario.api_calls()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=simulate, args=(i,)) for i in range(users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    after = scenario.api_calls()
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+    summary = summarize(traces, elapsed, {k: after[k] - before[k] for k in after})
+    summary["rejected"] = len(rejected)
+    return {tag: summary}
+
+
+def compare(current: Dict[str, dict], baseline: Dict[str, dict], tolerance: float,
+            min_delta_ms: float = 5.0) -> List[str]:
+    """Human-readable regressions of current against baseline (scenarios missing from either are skipped).
+
+    Latency and throughput changes smaller than min_delta_ms per question are noise, whatever the ratio.
+    """
+    problems = []
+    for name, base in baseline.items():
+        cur = current.get(name)
+        if cur is None:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if cur[key] > base[key] * (1 + tolerance) and cur[key] - base[key] > min_delta_ms:
+                problems.append(f"{name}: {key} {base[key]:.1f} -> {cur[key]:.1f}")
+        if base.get("throughput_qps") and cur["throughput_qps"] < base["throughput_qps"] / (1 + tolerance) and \
+                (1 / max(cur["throughput_qps"], 1e-9) - 1 / base["throughput_qps"]) * 1000 > min_delta_ms:
+            problems.append(f"{name}: throughput {base['throughput_qps']:.1f} -> {cur['throughput_qps']:.1f} q/s")
+        if "peak_mb" in base and "peak_mb" in cur and \
+                cur["peak_mb"] > base["peak_mb"] * (1 + tolerance) and cur["peak_mb"] - base["peak_mb"] > 1:
+            problems.append(f"{name}: peak memory {base['peak_mb']:.1f} -> {cur['peak_mb']:.1f} MB")
+        for key, value in base.get("api", {}).items():
+            if cur.get("api", {}).get(key, 0) > value:
+                problems.append(f"{name}: {key} API calls {value} -> {cur['api'][key]}")
+        for sdk in sorted(set(cur.get("sdks", [])) - set(base.get("sdks", []))):
+            problems.append(f"{name}: now imports {sdk}")
+        if cur.get("rejected", 0) > base.get("rejected", 0):
+            problems.append(f"{name}: rejected requests {base.get('rejected', 0)} -> {cur['rejected']}")
+        if cur["errors"] > base.get("errors", 0):
+            problems.append(f"{name}: errors {base.get('errors', 0)} -> {cur['errors']}")
+    return problems
+
+
+# (header, width): every field is right-aligned except the scenario name, and fields
+# are separated by a space so an over-wide value cannot run into its neighbour
+REPORT_COLUMNS = (("scenario", 32), ("n", 5), ("err", 4), ("p50 ms", 9), ("p95 ms", 9), ("q/s", 11),
+                  ("peak MB", 8), ("gemini", 7), ("sheets", 7))
+
+
+def _report_line(values) -> str:
+    name, *rest = values
+    return " ".join([f"{name:<{REPORT_COLUMNS[0][1]}}"] +
+                    [f"{v:>{w}}" for v, (_, w) in zip(rest, REPORT_COLUMNS[1:])]).rstrip()
+
+
+def report(results: Dict[str, dict], stages: bool = True) -> str:
+    lines = [_report_line([h for h, _ in REPORT_COLUMNS])]
+    for name, r in results.items():
+        peak = f"{r['peak_mb']:.1f}" if "peak_mb" in r else "-"
+        lines.append(_report_line([name, r["questions"], r["errors"], f"{r['p50_ms']:.1f}", f"{r['p95_ms']:.1f}",
+                                   f"{r['throughput_qps']:.1f}", peak, r["api"]["gemini"], r["api"]["sheets"]]))
+        if stages:
+            for stage, s in sorted(r["stages"].items(), key=lambda kv: -kv[1]["p50_ms"] * kv[1]["count"]):
+                lines.append(_report_line([f"    {stage}", s["count"], "", f"{s['p50_ms']:.1f}", f"{s['p95_ms']:.1f}",
+                                           "", "", "", s["requests"] or ""]))
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", help="JSONL file of questions (default: a built-in set)")
+    parser.add_argument("--field", default="question")
+    parser.add_argument("--limit", type=int, help="use only the first N questions")
+    parser.add_argument("--sources", default="mysql,sheets")
+    parser.add_argument("--rows", type=_int_list, default="1000,100000", help="comma-separated row counts (orders table)")
+    parser.add_argument("--tables", type=_int_list, default="10,100", help="comma-separated table counts")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock Gemini latency (seconds)")
+    parser.add_argument("--write-every", type=int, default=4, help="write back after every Nth question (0: never)")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--service-users", type=_int_list, default="",
+                        help="comma-separated concurrent user counts for the query-service load test")
+    parser.add_argument("--service-requests", type=int, default=5, help="questions per simulated user")
+    parser.add_argument("--import-modules", default=IMPORT_MODULES,
+                        help="modules whose cold import time is measured (empty: skip)")
+    parser.add_argument("--bulk-rows", type=_int_list, default="100000",
+                        help="comma-separated row counts for the bulk-insert comparison (empty: skip)")
+    parser.add_argument("--db-latency", type=float, default=0.0,
+                        help="simulated MySQL round-trip time (seconds) in the bulk-insert and schema-load comparisons")
+    parser.add_argument("--schema-tables", type=_int_list, default="100,1000",
+                        help="comma-separated table counts for the MySQL schema-load comparison (empty: skip)")
+    parser.add_argument("--sheet-load", default="20x10000",
+                        help="comma-separated <tabs>x<rows> for the Sheets load comparison (empty: skip)")
+    parser.add_argument("--sheet-query-rows", type=_int_list, default="200000",
+                        help="comma-separated row counts for the repeated Sheets SELECT comparison (empty: skip)")
+    parser.add_argument("--sheet-queries", type=int, default=20, help="SELECTs per --sheet-query-rows scenario")
+    parser.add_argument("--sheet-write-rows", type=_int_list, default="500000",
+                        help="comma-separated row counts for the Sheets write-back comparison (empty: skip)")
+    parser.add_argument("--fed-join", default="50000x200",
+                        help="comma-separated <rows>x<keys> for the cross-source join comparison (empty: skip)")
+    parser.add_argument("--prune-tables", type=_int_list, default="1000",
+                        help="comma-separated table counts for the schema-pruning comparison (empty: skip)")
+    parser.add_argument("--prompt-latency", type=float, default=0.002,
+                        help="mock Gemini time per 1000 prompt characters (seconds) in the schema-pruning comparison")
+    parser.add_argument("--explain-rows", type=_int_list, default="100000",
+                        help="comma-separated result sizes for the explanation comparison (empty: skip)")
+    parser.add_argument("--token-latency", type=float, default=0.01,
+                        help="mock Gemini time per streamed word (seconds) in the explanation comparison")
+    parser.add_argument("--no-stages", action="store_true", help="only print per-scenario totals")
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown / growth")
+    parser.add_argument("--min-delta-ms", type=float, default=5.0, help="ignore slowdowns smaller than this")
+    args = parser.parse_args(argv)
+
+    if args.questions:
+        records = _read_jsonl(args.questions)
+        questions = [str(r.get(args.field) or r.get("title") or "") for r in records]
+    else:
+        questions = list(DEFAULT_QUESTIONS)
+    questions = [q for q in questions if q.strip()][:args.limit]
+    if not questions:
+        print("no questions", file=sys.stderr)
+        return 2
+
+    results: Dict[str, dict] = {}
+    for module in [m.strip() for m in args.import_modules.split(",") if m.strip()]:
+        print(f"import/{module} ...", file=sys.stderr)
+        results.update(run_import_time(module))
+    for rows in args.bulk_rows:
+        print(f"bulk/{rows} ...", file=sys.stderr)
+        results.update(run_bulk_insert(rows, args.db_latency))
+    for tables in args.schema_tables:
+        print(f"schema/{tables} ...", file=sys.stderr)
+        results.update(run_schema_load(tables, args.db_latency))
+    for shape in [x.strip() for x in args.sheet_load.split(",") if x.strip()]:
+        tabs, _, rows = shape.partition("x")
+        print(f"sheetload/{shape} ...", file=sys.stderr)
+        results.update(run_sheet_load(int(tabs), int(float(rows))))
+    for rows in args.sheet_query_rows:
+        print(f"sheetquery/{rows} ...", file=sys.stderr)
+        results.update(run_sheet_query(rows, args.sheet_queries))
+    for rows in args.sheet_write_rows:
+        print(f"sheetwrite/{rows} ...", file=sys.stderr)
+        results.update(run_sheet_write(rows))
+    for shape in [x.strip() for x in args.fed_join.split(",") if x.strip()]:
+        rows, _, keys = shape.partition("x")
+        print(f"fedjoin/{shape} ...", file=sys.stderr)
+        results.update(run_federated_join(int(float(rows)), int(keys), args.db_latency))
+    for tables in args.prune_tables:
+        print(f"schemaprune/{tables} ...", file=sys.stderr)
+        results.update(run_schema_prune(tables, questions, args.latency, args.prompt_latency))
+    for rows in args.explain_rows:
+        print(f"explain/{rows} ...", file=sys.stderr)
+        results.update(run_explain(rows, min(len(questions), 5), args.latency, args.token_latency,
+                                   args.prompt_latency))
+    for source in [s.strip() for s in args.sources.split(",") if s.strip()]:
+        if source not in SOURCES:
+            parser.error(f"unknown source {source!r}; use {', '.join(SOURCES)}")
+        for rows in args.rows:
+            for tables in args.tables:
+                print(f"{source}/{rows}x{tables} ...", file=sys.stderr)
+                results.update(run_scenario(source, rows, tables, questions, args.latency, args.write_every,
+                                            memory=not args.no_memory))
+                for users in args.service_users:
+                    print(f"service/{source}/{rows}x{tables}/{users}u ...", file=sys.stderr)
+                    results.update(run_service_load(source, rows, tables, questions, args.latency, users,
+                                                    args.service_requests))
+    print(report(results, stages=not args.no_stages))
+
+    document = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "latency": args.latency,
+                "questions": len(questions), "scenarios": results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(document, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        problems = compare(results, baseline.get("scenarios", {}), args.tolerance, args.min_delta_ms)
+        for problem in problems:
+            print(f"REGRESSION {problem}", file=sys.stderr)
+        if problems:
+            return 1
+        print(f"no regressions against {args.baseline}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,5 @@
 import os
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 load_dotenv()
 
@@ -8,6 +7,123 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GSHEET_SERVICE_ACCOUNT_FILE = os.getenv("GSHEET_SERVICE_ACCOUNT_FILE")
 
 DEFAULT_GEMINI_MODEL = "gemini-2.0-flash"
+
+# Local state files (SQL cache, sheet write journal) live under DATA_DIR (relative
+# to the app directory), so the app finds them whatever directory it is started from.
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("DATA_DIR", ".")))
+
+
+def data_path(path: str) -> str:
+    """path resolved against DATA_DIR; absolute paths, "" and ":memory:" are kept."""
+    if not path or path == ":memory:" or os.path.isabs(path):
+        return path
+    return os.path.join(DATA_DIR, path)
+
+# MySQL schema cache: entries are reused until the TTL expires or a DDL/data
+# change shows up in information_schema.TABLES.
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "300"))
+
+# Process-wide MySQL connection pool shared by all Streamlit sessions.
+MYSQL_POOL_SIZE = int(os.getenv("MYSQL_POOL_SIZE", "5"))
+MYSQL_POOL_MAX_OVERFLOW = int(os.getenv("MYSQL_POOL_MAX_OVERFLOW", "10"))
+MYSQL_POOL_TIMEOUT = float(os.getenv("MYSQL_POOL_TIMEOUT", "30"))
+MYSQL_POOL_RECYCLE = float(os.getenv("MYSQL_POOL_RECYCLE", "3600"))
+MYSQL_POOL_PRE_PING = os.getenv("MYSQL_POOL_PRE_PING", "1") == "1"
+
+# SELECT results are streamed in chunks; past these limits the query is killed.
+MYSQL_STREAM_CHUNK_ROWS = int(os.getenv("MYSQL_STREAM_CHUNK_ROWS", "5000"))
+MYSQL_MAX_RESULT_ROWS = int(os.getenv("MYSQL_MAX_RESULT_ROWS", "100000"))
+MYSQL_MAX_RESULT_BYTES = int(os.getenv("MYSQL_MAX_RESULT_BYTES", str(256 * 1024 * 1024)))
+MYSQL_QUERY_TIMEOUT = float(os.getenv("MYSQL_QUERY_TIMEOUT", "120"))
+
+# Multi-statement scripts run as one transaction; consecutive INSERT ... VALUES
+# into the same table are sent as one multi-row INSERT of at most this many bytes
+# (keep it below the server's max_allowed_packet).
+MYSQL_BATCH_MAX_BYTES = int(os.getenv("MYSQL_BATCH_MAX_BYTES", str(1024 * 1024)))
+
+# Google Sheets writes go through a background write-behind queue (sheet_writer.py):
+# a tab's changes are pushed SHEET_WRITE_DELAY seconds after the first one (or
+# once SHEET_WRITE_MAX_OPS are pending), and journalled in SHEET_WRITE_JOURNAL
+# ("" = no journal) until they reach the sheet.
+SHEET_WRITE_BEHIND = os.getenv("SHEET_WRITE_BEHIND", "1") == "1"
+SHEET_WRITE_DELAY = float(os.getenv("SHEET_WRITE_DELAY", "2"))
+SHEET_WRITE_MAX_OPS = int(os.getenv("SHEET_WRITE_MAX_OPS", "50"))
+SHEET_WRITE_MAX_RETRIES = int(os.getenv("SHEET_WRITE_MAX_RETRIES", "6"))
+SHEET_WRITE_JOURNAL = data_path(os.getenv("SHEET_WRITE_JOURNAL", ".sheet_writes.jsonl"))
+
+# Local question -> SQL cache in front of Gemini.
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "1") == "1"
+SQL_CACHE_PATH = data_path(os.getenv("SQL_CACHE_PATH", ".sql_cache.sqlite3"))
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "5000"))
+SQL_CACHE_TTL = float(os.getenv("SQL_CACHE_TTL", str(7 * 24 * 3600)))
+# Near-duplicate lookup via Gemini embeddings (off by default, costs an embed call per miss).
+SQL_CACHE_EMBEDDINGS = os.getenv("SQL_CACHE_EMBEDDINGS", "0") == "1"
+SQL_CACHE_SIMILARITY = float(os.getenv("SQL_CACHE_SIMILARITY", "0.95"))
+GEMINI_EMBEDDING_MODEL = "models/text-embedding-004"
+
+# Schemas with more tables than this are pruned to the top-k relevant tables
+# (plus join neighbours) before being sent to Gemini.
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv("SCHEMA_PRUNE_MIN_TABLES", "20"))
+SCHEMA_PRUNE_TOP_K = int(os.getenv("SCHEMA_PRUNE_TOP_K", "8"))
+
+# Federated joins send the sheet's distinct join keys to MySQL as an IN list
+# when there are at most this many (0 disables); the MySQL scan then reads only
+# matching rows instead of the whole table.
+FEDERATED_KEY_PUSHDOWN_MAX = int(os.getenv("FEDERATED_KEY_PUSHDOWN_MAX", "1000"))
+
+# Sheet columns filtered on this many times get a SQLite index (0 disables).
+SHEET_INDEX_AFTER = int(os.getenv("SHEET_INDEX_AFTER", "3"))
+
+# In-memory cache of SELECT results, keyed on normalized SQL + table versions.
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Result explanations: own (small) model settings, streamed in the background.
+EXPLAIN_GEMINI_MODEL = os.getenv("EXPLAIN_GEMINI_MODEL", DEFAULT_GEMINI_MODEL)
+EXPLAIN_MODE = os.getenv("EXPLAIN_MODE", "auto")   # auto | on_demand | off
+EXPLAIN_CACHE_MAX_ENTRIES = int(os.getenv("EXPLAIN_CACHE_MAX_ENTRIES", "500"))
+
+# Pre-execution validation: MySQL statements whose EXPLAIN estimates more rows
+# examined than the budget get LIMIT VALIDATE_AUTO_LIMIT added (plain SELECTs)
+# or are rejected (0 disables the budget / the auto LIMIT).
+VALIDATE_MAX_ROWS_EXAMINED = int(os.getenv("VALIDATE_MAX_ROWS_EXAMINED", "10000000"))
+VALIDATE_AUTO_LIMIT = int(os.getenv("VALIDATE_AUTO_LIMIT", "1000"))
+VALIDATE_REPAIR_ATTEMPTS = int(os.getenv("VALIDATE_REPAIR_ATTEMPTS", "2"))
+
+# Result viewer (result_store.py): rows per page, rows per export batch, and the
+# size above which an export being prepared moves from memory to a temp file.
+RESULT_PAGE_SIZE = int(os.getenv("RESULT_PAGE_SIZE", "100"))
+RESULT_EXPORT_BATCH_ROWS = int(os.getenv("RESULT_EXPORT_BATCH_ROWS", "50000"))
+RESULT_SPOOL_MAX_BYTES = int(os.getenv("RESULT_SPOOL_MAX_BYTES", str(16 * 1024 * 1024)))
+
+# Progressive mode (approximate.py): an aggregate SELECT first runs on each of
+# SAMPLE_FRACTIONS of its largest table (MySQL: of the primary-key range), split
+# into SAMPLE_REPLICATES subsamples whose spread gives the error bars, then on
+# the full data. Tables smaller than SAMPLE_MIN_ROWS go straight to the exact query.
+SAMPLE_FRACTIONS = [float(f) for f in os.getenv("SAMPLE_FRACTIONS", "0.01,0.1").split(",") if f.strip()]
+SAMPLE_REPLICATES = int(os.getenv("SAMPLE_REPLICATES", "8"))
+SAMPLE_MIN_ROWS = int(os.getenv("SAMPLE_MIN_ROWS", "100000"))
+
+# Tracing: TRACE_LOG is "" (off), "stderr" or a file path for one JSON line per
+# trace; TRACE_METRICS_PORT > 0 serves Prometheus metrics on /metrics.
+TRACE_LOG = os.getenv("TRACE_LOG", "")
+TRACE_METRICS_PORT = int(os.getenv("TRACE_METRICS_PORT", "0"))
+TRACE_KEEP = int(os.getenv("TRACE_KEEP", "20"))
+
+# Headless query service (service.py). With QUERY_SERVICE_URL set, main.py only
+# collects input and renders results; the pipeline runs in the service.
+QUERY_SERVICE_URL = os.getenv("QUERY_SERVICE_URL", "")
+SERVICE_HOST = os.getenv("SERVICE_HOST", "127.0.0.1")
+SERVICE_PORT = int(os.getenv("SERVICE_PORT", "8765"))
+SERVICE_IO_WORKERS = int(os.getenv("SERVICE_IO_WORKERS", "16"))
+# Sheets SELECTs over at least SERVICE_PROCESS_MIN_ROWS rows run in a process pool (0 workers disables).
+SERVICE_CPU_WORKERS = int(os.getenv("SERVICE_CPU_WORKERS", "2"))
+SERVICE_PROCESS_MIN_ROWS = int(os.getenv("SERVICE_PROCESS_MIN_ROWS", "200000"))
+SERVICE_USER_CONCURRENCY = int(os.getenv("SERVICE_USER_CONCURRENCY", "2"))
+SERVICE_MAX_QUEUE = int(os.getenv("SERVICE_MAX_QUEUE", "100"))
+SERVICE_WAIT_TIMEOUT = float(os.getenv("SERVICE_WAIT_TIMEOUT", "120"))
+SERVICE_JOB_TTL = float(os.getenv("SERVICE_JOB_TTL", "600"))
+SERVICE_MAX_RESULT_ROWS = int(os.getenv("SERVICE_MAX_RESULT_ROWS", "10000"))
 SYSTEM_PROMPT_DEFAULT = """
 Given a natural language question and a database/schema, the assistant should:
 
@@ -73,8 +189,5 @@ Given a natural language question and a database/schema, the assistant should:
     Always ensure the final SQL is syntactically valid for a typical SQL dialect (e.g., ANSI-style) and is designed to execute successfully and return the intended result.
 
 """
-# Configure Gemini
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
-
-MODEL = genai.GenerativeModel(DEFAULT_GEMINI_MODEL)
+# Gemini is configured and the model client built on first use (sql_generator.get_model),
+# so importing config does not load the SDK.
@@ -1,10 +1,27 @@
 # db_utils.py
-import mysql.connector
+import queue
+import threading
+import time
+import weakref
+from contextlib import contextmanager
 import pandas as pd
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, List
+
+from config import (SCHEMA_CACHE_TTL, MYSQL_POOL_SIZE, MYSQL_POOL_MAX_OVERFLOW,
+                    MYSQL_POOL_TIMEOUT, MYSQL_POOL_RECYCLE, MYSQL_POOL_PRE_PING,
+                    MYSQL_STREAM_CHUNK_ROWS, MYSQL_MAX_RESULT_ROWS, MYSQL_MAX_RESULT_BYTES,
+                    MYSQL_QUERY_TIMEOUT, MYSQL_BATCH_MAX_BYTES)
+from sql_utils import Token, referenced_tables, statement_type, split_statement_tokens, is_keyword, is_op
+from tracing import span, start_span
+
+# connection -> the connect_mysql arguments it was opened with, so a stream on a
+# raw connection can open a second one to send KILL QUERY
+_CONNECT_PARAMS: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
 
 def connect_mysql(host: str, port: int, user: str, password: str, database: str):
     """Return a mysql.connector connection or raise error."""
+    import mysql.connector  # imported on first connect; sheets-only sessions never load it
     conn = mysql.connector.connect(
         host=host,
         port=port,
@@ -14,36 +31,786 @@ def connect_mysql(host: str, port: int, user: str, password: str, database: str)
         autocommit=False,
         charset='utf8mb4'
     )
+    _CONNECT_PARAMS[conn] = (host, port, user, password, database)
     return conn
 
-def get_mysql_schema(conn) -> Dict[str, list]:
-    """Return dict {table: [{name,type}, ...]}"""
-    cursor = conn.cursor()
-    cursor.execute("SHOW TABLES")
-    tables = cursor.fetchall()
-    schema = {}
-    for (table,) in tables:
-        cursor.execute(f"DESCRIBE `{table}`")
-        cols = cursor.fetchall()
-        schema[table] = [{"name": col[0], "type": col[1]} for col in cols]
-    cursor.close()
+
+class MySQLPool:
+    """Thread-safe pool of mysql.connector connections.
+
+    Keeps up to `size` idle connections and opens at most `max_overflow` extra
+    ones under load. Connections older than `recycle` seconds are replaced and,
+    with `pre_ping`, each checkout is health-checked before being handed out.
+    """
+
+    def __init__(self, host: str, port: int, user: str, password: str, database: str,
+                 size: int = MYSQL_POOL_SIZE, max_overflow: int = MYSQL_POOL_MAX_OVERFLOW,
+                 timeout: float = MYSQL_POOL_TIMEOUT, recycle: float = MYSQL_POOL_RECYCLE,
+                 pre_ping: bool = MYSQL_POOL_PRE_PING):
+        self.params = {"host": host, "port": port, "user": user, "password": password, "database": database}
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._open = 0
+        self._created_at: Dict[Any, float] = {}   # keyed on the connection, not id(): ids get reused
+        self._stats = {"checkouts": 0, "waits": 0, "wait_time": 0.0, "connects": 0,
+                       "recycled": 0, "invalidated": 0}
+
+    # connection-like attributes so schema caching keys off the pool params
+    @property
+    def server_host(self):
+        return self.params["host"]
+
+    @property
+    def server_port(self):
+        return self.params["port"]
+
+    @property
+    def user(self):
+        return self.params["user"]
+
+    @property
+    def database(self):
+        return self.params["database"]
+
+    def _connect(self):
+        conn = connect_mysql(**self.params)
+        with self._lock:
+            self._created_at[conn] = time.monotonic()
+            self._stats["connects"] += 1
+        return conn
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created_at.pop(conn, None)
+            self._open -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, conn) -> bool:
+        with self._lock:
+            expired = time.monotonic() - self._created_at.get(conn, 0) > self.recycle
+            if expired:
+                self._stats["recycled"] += 1
+        if expired:
+            return False
+        if not self.pre_ping:
+            return True
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Check out a healthy connection, opening or waiting for one as needed."""
+        deadline = time.monotonic() + self.timeout
+        waited = False
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = None
+                with self._lock:
+                    can_open = self._open < self.size + self.max_overflow
+                    if can_open:
+                        self._open += 1
+                if can_open:
+                    try:
+                        conn = self._connect()
+                    except Exception:
+                        with self._lock:
+                            self._open -= 1
+                        raise
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"MySQL pool exhausted after {self.timeout:.0f}s "
+                                           f"({self.size}+{self.max_overflow} connections in use)")
+                    if not waited:
+                        with self._lock:
+                            self._stats["waits"] += 1
+                        waited = True
+                    started = time.monotonic()
+                    try:
+                        conn = self._idle.get(timeout=remaining)
+                    except queue.Empty:
+                        continue
+                    finally:
+                        with self._lock:
+                            self._stats["wait_time"] += time.monotonic() - started
+                if not self._healthy(conn):
+                    self._discard(conn)
+                    continue
+            with self._lock:
+                self._stats["checkouts"] += 1
+            return conn
+
+    def release(self, conn):
+        """Return a connection; overflow connections beyond `size` idle ones are closed."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        if self._idle.qsize() >= self.size:
+            self._discard(conn)
+        else:
+            self._idle.put(conn)
+
+    def invalidate(self, conn):
+        """Close a connection that must not go back to the pool."""
+        with self._lock:
+            self._stats["invalidated"] += 1
+        self._discard(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            # The failure may have left the socket unusable; ping decides.
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self.invalidate(conn)
+                raise
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return counters: checkouts, waits, wait_time, plus open/idle connections."""
+        with self._lock:
+            return dict(self._stats, open=self._open, idle=self._idle.qsize(),
+                        size=self.size, max_overflow=self.max_overflow)
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+# Pools are process-wide and shared between Streamlit sessions.
+_POOLS: Dict[tuple, MySQLPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_mysql_pool(host: str, port: int, user: str, password: str, database: str) -> MySQLPool:
+    """Return the shared pool for these connection params, creating it on first use.
+
+    The first connection is opened eagerly so bad credentials fail here.
+    """
+    key = (host, int(port), user, password, database)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = MySQLPool(host, int(port), user, password, database)
+            pool.release(pool.acquire())
+            _POOLS[key] = pool
+    return pool
+
+
+@contextmanager
+def borrow_connection(conn_or_pool):
+    """Yield a raw connection from a MySQLPool, or the connection itself."""
+    if isinstance(conn_or_pool, MySQLPool):
+        with conn_or_pool.connection() as conn:
+            yield conn
+    else:
+        yield conn_or_pool
+
+
+@contextmanager
+def _sibling_connection(conn):
+    """Yield a second connection to conn's server: a pooled one, one opened from
+    conn's connect_mysql parameters, or conn.open_sibling() (offline stand-ins)."""
+    if isinstance(conn, MySQLPool):
+        with conn.connection() as sibling:
+            yield sibling
+        return
+    params = _CONNECT_PARAMS.get(conn)
+    if params is not None:
+        sibling = connect_mysql(*params)
+    elif hasattr(conn, "open_sibling"):
+        sibling = conn.open_sibling()
+    else:
+        raise RuntimeError("no pool or connection parameters to open a second connection")
+    try:
+        yield sibling
+    finally:
+        sibling.close()
+
+_SCHEMA_COLUMNS_SQL = """
+SELECT c.TABLE_NAME, c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, c.COLUMN_KEY
+FROM information_schema.COLUMNS c
+WHERE c.TABLE_SCHEMA = DATABASE()
+ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION
+"""
+
+_SCHEMA_INDEXES_SQL = """
+SELECT s.TABLE_NAME, s.INDEX_NAME, s.COLUMN_NAME, s.NON_UNIQUE
+FROM information_schema.STATISTICS s
+WHERE s.TABLE_SCHEMA = DATABASE()
+ORDER BY s.TABLE_NAME, s.INDEX_NAME, s.SEQ_IN_INDEX
+"""
+
+_SCHEMA_FOREIGN_KEYS_SQL = """
+SELECT k.TABLE_NAME, k.COLUMN_NAME, k.REFERENCED_TABLE_NAME, k.REFERENCED_COLUMN_NAME
+FROM information_schema.KEY_COLUMN_USAGE k
+WHERE k.TABLE_SCHEMA = DATABASE() AND k.REFERENCED_TABLE_NAME IS NOT NULL
+"""
+
+# Changes whenever a table is created/dropped/altered (CREATE_TIME moves on
+# rebuild) or written to (UPDATE_TIME), so it doubles as the cache version.
+_SCHEMA_VERSION_SQL = """
+SELECT COUNT(*), MAX(CREATE_TIME), MAX(UPDATE_TIME), SUM(CRC32(TABLE_NAME))
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE()
+"""
+
+# {(host, port, user, database): (loaded_at, version, schema)}
+_SCHEMA_CACHE: Dict[tuple, tuple] = {}
+
+
+def _schema_cache_key(conn) -> tuple:
+    return (getattr(conn, "server_host", None), getattr(conn, "server_port", None),
+            getattr(conn, "user", None), getattr(conn, "database", None))
+
+
+def _schema_version(cursor) -> tuple:
+    cursor.execute(_SCHEMA_VERSION_SQL)
+    return tuple(str(v) for v in cursor.fetchone())
+
+
+def _load_mysql_schema(cursor) -> Dict[str, list]:
+    cursor.execute(_SCHEMA_COLUMNS_SQL)
+    schema: Dict[str, list] = {}
+    for table, name, col_type, nullable, key in cursor.fetchall():
+        schema.setdefault(table, []).append({
+            "name": name,
+            "type": col_type.decode() if isinstance(col_type, bytes) else col_type,
+            "nullable": nullable == "YES",
+            "key": key or "",
+            "indexes": [],
+        })
+    cursor.execute(_SCHEMA_INDEXES_SQL)
+    for table, index_name, column, non_unique in cursor.fetchall():
+        for col in schema.get(table, []):
+            if col["name"] == column:
+                col["indexes"].append(index_name if int(non_unique) else f"{index_name} (unique)")
+    cursor.execute(_SCHEMA_FOREIGN_KEYS_SQL)
+    for table, column, ref_table, ref_column in cursor.fetchall():
+        for col in schema.get(table, []):
+            if col["name"] == column:
+                col["references"] = f"{ref_table}.{ref_column}"
     return schema
 
+
+def get_mysql_schema(conn, use_cache: bool = True, ttl: float = SCHEMA_CACHE_TTL) -> Dict[str, list]:
+    """Return dict {table: [{name,type,nullable,key,indexes[,references]}, ...]}
+
+    Columns, keys, indexes and foreign keys are read from information_schema in
+    three queries.
+    The result is cached per connection params; within the TTL a cached entry is
+    reused as long as the information_schema.TABLES version row is unchanged.
+    """
+    key = _schema_cache_key(conn)
+    with span("mysql.schema", cached=True) as s, borrow_connection(conn) as raw:
+        cursor = raw.cursor()
+        try:
+            cached = _SCHEMA_CACHE.get(key) if use_cache else None
+            version = _schema_version(cursor)
+            if cached and time.monotonic() - cached[0] < ttl and version == cached[1]:
+                return cached[2]
+            schema = _load_mysql_schema(cursor)
+            _SCHEMA_CACHE[key] = (time.monotonic(), version, schema)
+            s.set(cached=False, tables=len(schema))
+            return schema
+        finally:
+            cursor.close()
+
+
+def invalidate_mysql_schema(conn=None):
+    """Drop the cached schema for conn (or every cached schema)."""
+    if conn is None:
+        _SCHEMA_CACHE.clear()
+    else:
+        _SCHEMA_CACHE.pop(_schema_cache_key(conn), None)
+
+_TABLE_VERSIONS_SQL = """
+SELECT TABLE_NAME, TABLE_TYPE, CREATE_TIME, UPDATE_TIME
+FROM information_schema.TABLES
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})
+"""
+
+# Writes made through execute_mysql_query in this process:
+# {(connection key, table): count}, plus a per-connection epoch bumped by DDL
+# and other statements whose target tables cannot be determined.
+_MYSQL_WRITES: Dict[tuple, int] = {}
+_MYSQL_WRITES_LOCK = threading.Lock()
+
+
+# Statements that can change data or schema; anything else (SELECT, SHOW,
+# DESCRIBE, EXPLAIN, SET, ...) leaves the write counters alone.
+_MYSQL_WRITE_STATEMENTS = {"insert", "update", "delete", "replace",
+                           "create", "alter", "drop", "truncate", "rename", "load", "call"}
+
+
+def _record_mysql_write(conn, q: str):
+    key = _schema_cache_key(conn)
+    try:
+        kind = statement_type(q)
+        if kind not in _MYSQL_WRITE_STATEMENTS:
+            return
+        tables = [r.name.lower() for r in referenced_tables(q)] \
+            if kind in ("insert", "update", "delete", "replace") else []
+    except ValueError:
+        tables = []
+    with _MYSQL_WRITES_LOCK:
+        for name in tables or [None]:
+            _MYSQL_WRITES[(key, name)] = _MYSQL_WRITES.get((key, name), 0) + 1
+
+
+def mysql_table_versions(conn, tables) -> Optional[Dict[str, tuple]]:
+    """{table: version} for base tables of the current database, or None if any is unknown.
+
+    A version combines CREATE_TIME/UPDATE_TIME from information_schema (so writes
+    from other clients are seen, at one-second granularity) with this process's
+    own write counters. Views, temporary and schema-qualified tables return None
+    because no reliable version exists for them.
+    """
+    names = list(dict.fromkeys(tables))
+    if not names or any("." in n for n in names):
+        return None
+    key = _schema_cache_key(conn)
+    try:
+        with borrow_connection(conn) as raw:
+            cursor = raw.cursor()
+            try:
+                try:
+                    # MySQL 8 caches table statistics for a day by default
+                    cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+                except Exception:
+                    pass
+                cursor.execute(_TABLE_VERSIONS_SQL.format(", ".join(["%s"] * len(names))), names)
+                rows = cursor.fetchall()
+            finally:
+                cursor.close()
+    except Exception:
+        return None
+    found = {str(r[0]).lower(): r for r in rows}
+    versions = {}
+    with _MYSQL_WRITES_LOCK:
+        epoch = _MYSQL_WRITES.get((key, None), 0)
+        for name in names:
+            row = found.get(name.lower())
+            if row is None or row[1] != "BASE TABLE":
+                return None
+            versions[name] = (key, str(row[2]), str(row[3]), epoch, _MYSQL_WRITES.get((key, name.lower()), 0))
+    return versions
+
+class QueryStream:
+    """Iterate a SELECT as DataFrame chunks using an unbuffered (server-side) cursor.
+
+    Only one chunk is held at a time. When max_rows/max_bytes is exceeded or the
+    timeout fires, the running statement is stopped with KILL QUERY (issued on a
+    second connection, see _sibling_connection) and iteration ends. After
+    iterating, `truncated` holds the reason the stream was cut short and `error`
+    any failure message, including a KILL QUERY that could not be sent.
+    """
+
+    def __init__(self, conn, query: str, chunk_rows: int = MYSQL_STREAM_CHUNK_ROWS,
+                 max_rows: int = MYSQL_MAX_RESULT_ROWS, max_bytes: int = MYSQL_MAX_RESULT_BYTES,
+                 timeout: float = MYSQL_QUERY_TIMEOUT):
+        self.conn = conn
+        self.query = query.strip().rstrip(';')
+        self.chunk_rows = chunk_rows
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.columns: list = []
+        self.rows = 0
+        self.bytes = 0
+        self.truncated: Optional[str] = None
+        self.error: Optional[str] = None
+        self._killed = threading.Event()
+        self._thread_id: Optional[int] = None
+
+    def cancel(self, reason: str = "cancelled"):
+        """Stop the stream from another thread; a running statement is killed."""
+        if self._thread_id is None:
+            self._killed.set()
+            self.truncated = self.truncated or reason
+        else:
+            self._kill(self._thread_id, reason)
+
+    def _kill(self, thread_id: int, reason: str):
+        if self._killed.is_set():
+            return
+        self._killed.set()
+        self.truncated = self.truncated or reason
+        try:
+            with _sibling_connection(self.conn) as killer:
+                cursor = killer.cursor()
+                cursor.execute(f"KILL QUERY {int(thread_id)}")
+                cursor.close()
+        except Exception as e:
+            # the server keeps running the statement and the rest gets drained
+            self.error = self.error or f"Could not stop the query ({reason}): {e}"
+
+    def __iter__(self):
+        # not made current: the span stays open across yields into the caller
+        trace = start_span("mysql.stream", rows=0, bytes=0, chunks=0)
+        pool = self.conn if isinstance(self.conn, MySQLPool) else None
+        raw = pool.acquire() if pool else self.conn
+        trace.set(acquire_ms=round(trace.duration * 1000, 3))
+        broken = False
+        timer = None
+        cursor = None
+        try:
+            thread_id = self._thread_id = raw.connection_id
+            timer = threading.Timer(self.timeout, self._kill,
+                                    args=(thread_id, f"timed out after {self.timeout:.0f}s"))
+            timer.daemon = True
+            timer.start()
+            cursor = raw.cursor(buffered=False)
+            cursor.execute(self.query)
+            self.columns = [d[0] for d in cursor.description or []]
+            while not self._killed.is_set():
+                size = min(self.chunk_rows, self.max_rows - self.rows)
+                if size <= 0:
+                    # exactly max_rows rows is a complete result, not a truncated one
+                    if cursor.fetchone() is not None:
+                        self._kill(thread_id, f"row limit of {self.max_rows} reached")
+                    break
+                batch = cursor.fetchmany(size)
+                if not batch:
+                    break
+                chunk = pd.DataFrame.from_records(batch, columns=self.columns)
+                self.rows += len(chunk)
+                self.bytes += int(chunk.memory_usage(deep=True).sum())
+                trace.set(rows=self.rows, bytes=self.bytes, chunks=trace.attrs["chunks"] + 1)
+                if "first_chunk_ms" not in trace.attrs:
+                    trace.set(first_chunk_ms=round(trace.duration * 1000, 3))
+                try:
+                    yield chunk
+                except GeneratorExit:
+                    self._kill(thread_id, "discarded by caller")
+                    raise
+                if self.bytes >= self.max_bytes:
+                    self._kill(thread_id, f"size limit of {self.max_bytes} bytes reached")
+        except Exception as e:
+            if not self._killed.is_set():
+                self.error = str(e)
+            broken = True
+        finally:
+            if timer:
+                timer.cancel()
+            if cursor is not None:
+                try:
+                    # drains whatever the server still sends (nothing once killed)
+                    cursor.close()
+                except Exception:
+                    broken = True
+            if self._killed.is_set():
+                try:
+                    raw.consume_results()
+                except Exception:
+                    broken = True
+            if pool:
+                if broken:
+                    pool.invalidate(raw)
+                else:
+                    pool.release(raw)
+            if self.truncated:
+                trace.set(truncated=self.truncated)
+            trace.end(error=self.error)
+
+    def to_frame(self) -> pd.DataFrame:
+        """Collect the (limited) stream into one DataFrame."""
+        chunks = list(self)
+        if not chunks:
+            return pd.DataFrame(columns=self.columns)
+        df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+        if self.truncated:
+            df.attrs["truncated"] = self.truncated
+        return df
+
+
 def execute_mysql_query(conn, query: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
-    """Execute query on MySQL. Returns (DataFrame or None, error message or None)."""
+    """Execute query on MySQL. Returns (DataFrame or None, error message or None).
+
+    conn may be a MySQLPool, in which case a connection is borrowed for the query.
+    SELECTs (and WITH ... SELECT) are streamed and capped at MYSQL_MAX_RESULT_ROWS /
+    MYSQL_MAX_RESULT_BYTES; a capped result carries the reason in df.attrs["truncated"].
+    A script of several statements runs in one transaction (_execute_batch) and
+    df.attrs["batch"] then holds every statement's outcome.
+    """
+    try:
+        statements = split_statement_tokens(query)
+    except ValueError:   # let the server report what the tokenizer could not read
+        statements = [(query.strip().rstrip(';'), [])]
+    if len(statements) > 1:
+        return _execute_batch(conn, statements)
+    q, tokens = statements[0] if statements else ("", [])
+    if _kind(q, tokens) == "select":
+        stream = QueryStream(conn, q)
+        df = stream.to_frame()
+        if stream.error:
+            return None, stream.error
+        return df, None
+    try:
+        with span("mysql.execute", statement=q.split(None, 1)[0].lower() if q else "") as s, \
+                borrow_connection(conn) as raw:
+            df, err = _execute_on_connection(raw, q)
+            if df is not None and "affected_rows" in df:
+                s.set(affected_rows=int(df["affected_rows"].iloc[0]))
+            if err:
+                s.error = err
+            return df, err
+    except Exception as e:
+        return None, str(e)
+    finally:
+        # counted even on failure: part of the statement may have been applied
+        _record_mysql_write(conn, q)
+
+
+def _fetch_frame(conn, cursor, max_rows: int = MYSQL_MAX_RESULT_ROWS) -> pd.DataFrame:
+    """The current result set (SHOW, DESCRIBE, a SELECT in a batch), capped at max_rows."""
+    columns = [d[0] for d in cursor.description or []]
+    rows = cursor.fetchmany(max_rows + 1)
+    df = pd.DataFrame.from_records(rows[:max_rows], columns=columns)
+    if len(rows) > max_rows:
+        conn.consume_results()
+        df.attrs["truncated"] = f"row limit of {max_rows} reached"
+    return df
+
+
+def _execute_on_connection(conn, q: str) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
     try:
         cursor = conn.cursor()
-        q = query.strip().rstrip(';')
-        if q.lower().startswith("select"):
-            df = pd.read_sql(q, conn)
-            return df, None
-        else:
-            cursor.execute(q)
-            conn.commit()
-            return pd.DataFrame({"affected_rows": [cursor.rowcount]}), None
+        cursor.execute(q)
+        df = _fetch_frame(conn, cursor) if cursor.with_rows else pd.DataFrame({"affected_rows": [cursor.rowcount]})
+        conn.commit()
+        return df, None
     except Exception as e:
         try:
             conn.rollback()
         except Exception:
             pass
         return None, str(e)
+
+
+class BatchResult:
+    """Per-statement outcome of a batch, carried in df.attrs["batch"].
+
+    statements: one dict per round trip with statement (its number in the
+    script, "a-b" for merged INSERTs), type, sql, ms and affected_rows or rows;
+    result sets are kept in frames under the same position. pandas copies attrs
+    on most operations, so the object hands out itself instead of a deep copy.
+    """
+
+    def __init__(self):
+        self.statements: List[Dict[str, Any]] = []
+        self.frames: Dict[int, pd.DataFrame] = {}
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def summary(self) -> pd.DataFrame:
+        return pd.DataFrame(self.statements, columns=["statement", "type", "affected_rows", "rows", "ms"])
+
+
+# Statements MySQL runs outside the open transaction: it commits what ran before
+# them, and DDL commits itself (CREATE/DROP TEMPORARY TABLE excepted).
+_IMPLICIT_COMMIT_STATEMENTS = ("create", "alter", "drop", "rename", "truncate", "grant", "revoke", "lock",
+                               "unlock", "begin", "start", "commit", "analyze", "optimize", "repair", "check",
+                               "flush", "reset", "install", "uninstall")
+
+
+def _commits_implicitly(tokens: List[Token]) -> bool:
+    if not tokens or not is_keyword(tokens[0], *_IMPLICIT_COMMIT_STATEMENTS):
+        return False
+    return not (len(tokens) > 1 and is_keyword(tokens[0], "create", "drop") and is_keyword(tokens[1], "temporary"))
+
+
+def _kind(sql: str, tokens: List[Token]) -> str:
+    """statement_type, without tokenizing again unless the statement starts with WITH."""
+    if not tokens:
+        return ""
+    if not is_keyword(tokens[0], "with"):
+        return tokens[0].value.lower()
+    try:
+        return statement_type(sql)
+    except ValueError:
+        return ""
+
+
+def _literal_rows(sql: str, tokens: List[Token], offset: int) -> bool:
+    """True if the VALUES tuples hold only literals (numbers, strings, NULL, DEFAULT, signs).
+
+    Subqueries and functions (NOW(), LAST_INSERT_ID(), (SELECT MAX(id) + 1 ...))
+    are evaluated once per statement, so merging their rows would change them.
+    """
+    depth = 0
+    for tok in tokens:
+        if is_op(tok, "("):
+            depth += 1
+            if depth > 1:
+                return False
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif is_op(tok, ",", "+", "-") or tok.kind in ("number", "string") or \
+                is_keyword(tok, "null", "true", "false", "default"):
+            continue
+        elif tok.kind == "qident" and sql[tok.pos - offset] == '"':
+            continue   # "text" is a string in MySQL's default mode
+        else:
+            return False
+    return True
+
+
+def _insert_values(sql: str, tokens: List[Token]) -> Optional[Tuple[str, str]]:
+    """(INSERT ... VALUES prefix, row tuples) of a plain INSERT that can be merged, else None.
+
+    INSERT ... SELECT / SET, ON DUPLICATE KEY UPDATE, row aliases and rows with
+    anything but literals are left alone.
+    """
+    if not tokens or not is_keyword(tokens[0], "insert"):
+        return None
+    depth, values_at = 0, None
+    for i, tok in enumerate(tokens):
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif depth == 0 and values_at is None:
+            if is_keyword(tok, "values", "value"):
+                values_at = i
+            elif is_keyword(tok, "select", "set", "with", "table"):
+                return None
+        elif depth == 0 and values_at is not None and not is_op(tok, ","):
+            return None   # ON DUPLICATE KEY UPDATE, AS alias, ...
+    if values_at is None or values_at + 1 >= len(tokens) or not is_op(tokens[values_at + 1], "("):
+        return None
+    offset = tokens[0].pos   # positions index into the whole script
+    if not _literal_rows(sql, tokens[values_at + 1:], offset):
+        return None
+    prefix = " ".join(sql[:tokens[values_at].pos - offset].split())
+    return prefix, sql[tokens[values_at + 1].pos - offset:].strip()
+
+
+def _batch_groups(statements: List[Tuple[str, List[Token]]], max_bytes: int) -> List[Tuple[str, int, int]]:
+    """(sql, first, last) per round trip: runs of INSERT ... VALUES into the same
+    table and columns become one multi-row INSERT of at most max_bytes."""
+    groups: List[Tuple[str, int, int]] = []
+    prefix, rows, first, size = None, [], 0, 0
+
+    def close(last):
+        if prefix is not None:
+            groups.append((f"{prefix} VALUES {', '.join(rows)}" if last > first else statements[first][0],
+                           first, last))
+
+    for i, (q, tokens) in enumerate(statements):
+        parts = _insert_values(q, tokens)
+        if parts and parts[0] == prefix and size + len(parts[1]) + 2 <= max_bytes:
+            rows.append(parts[1])
+            size += len(parts[1]) + 2
+            continue
+        close(i - 1)
+        if parts:
+            prefix, rows, first, size = parts[0], [parts[1]], i, len(parts[0]) + len(parts[1]) + 8
+        else:
+            prefix = None
+            groups.append((q, i, i))
+    close(len(statements) - 1)
+    return groups
+
+
+def _execute_batch(conn, statements: List[Tuple[str, List[Token]]],
+                   max_bytes: int = MYSQL_BATCH_MAX_BYTES) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """Run a script's statements (split_statement_tokens) on one connection in one transaction.
+
+    Consecutive INSERT ... VALUES into the same table and column list are sent
+    as one multi-row INSERT (the rewrite cursor.executemany does), so a bulk
+    load costs a round trip per max_bytes of SQL instead of one per row. Each
+    round trip is timed. Returns the last result set, or a per-statement
+    summary when no statement returned rows; either way df.attrs["batch"] is a
+    BatchResult with every statement's affected rows, timing and result set.
+    On failure the transaction is rolled back and the error names the statement.
+    MySQL commits implicitly around DDL (CREATE, ALTER, DROP, ...), so the error
+    also says how many statements had already been committed that way.
+    """
+    groups = _batch_groups(statements, max_bytes)
+    batch = BatchResult()
+    done = 0
+    committed = 0   # leading statements an implicit commit made permanent
+    try:
+        with span("mysql.batch", statements=len(statements), round_trips=len(groups)) as s, \
+                borrow_connection(conn) as raw:
+            cursor = raw.cursor()
+            try:
+                for sql, first, last in groups:
+                    label = str(first + 1) if first == last else f"{first + 1}-{last + 1}"
+                    started = time.perf_counter()
+                    implicit = _commits_implicitly(statements[first][1])
+                    if implicit:
+                        committed = first   # committed before the statement runs, even if it fails
+                    cursor.execute(sql)
+                    if implicit:
+                        committed = last + 1
+                    entry = {"statement": label, "type": _kind(*statements[first]), "sql": sql}
+                    if cursor.with_rows:
+                        frame = _fetch_frame(raw, cursor)
+                        batch.frames[len(batch.statements)] = frame
+                        entry["rows"] = len(frame)
+                    else:
+                        entry["affected_rows"] = cursor.rowcount
+                    entry["ms"] = round((time.perf_counter() - started) * 1000, 3)
+                    batch.statements.append(entry)
+                    done = last + 1
+                raw.commit()
+            except Exception as e:
+                try:
+                    raw.rollback()
+                except Exception:
+                    pass
+                if len(batch.statements) == len(groups):
+                    where = "Commit"
+                else:
+                    _, first, last = groups[len(batch.statements)]
+                    where = f"Statement {first + 1}" if first == last else f"Statements {first + 1}-{last + 1}"
+                if committed:
+                    err = (f"{where} failed ({committed} statements already committed by an implicit "
+                           f"commit, {done - committed} rolled back): {e}")
+                else:
+                    err = f"{where} failed ({len(statements)} statements rolled back): {e}"
+                s.error = err
+                return None, err
+            s.set(affected_rows=sum(e.get("affected_rows", 0) for e in batch.statements),
+                  result_sets=len(batch.frames))
+    except Exception as e:
+        return None, str(e)
+    finally:
+        for _, first, _ in groups:
+            if first > done:
+                break
+            _record_mysql_write(conn, statements[first][0])   # a merged INSERT writes the same table
+    if batch.frames:
+        df = batch.frames[max(batch.frames)].copy()
+    else:
+        df = batch.summary().drop(columns="rows")
+    df.attrs["batch"] = batch
+    return df, None
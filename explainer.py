@@ -0,0 +1,166 @@
+# explainer.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from config import GOOGLE_API_KEY, EXPLAIN_GEMINI_MODEL, EXPLAIN_CACHE_MAX_ENTRIES
+from sql_generator import get_model, generation_config
+from tracing import span, record_usage, in_current_context
+
+# Short on purpose: the SQL-generation system prompt is not needed to summarise rows.
+EXPLAIN_PROMPT = """You are a data analyst. In 2-4 plain-English sentences, summarise what this result shows.
+
+SQL:
+{sql}
+
+Columns: {columns}
+First rows (CSV):
+{sample}
+Summary:"""
+
+EXPLAIN_SAMPLE_ROWS = 10
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="explain")
+_CACHE: "OrderedDict[str, str]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def result_sample(df: pd.DataFrame) -> str:
+    """The rows sent to the model; available as soon as the first chunk is."""
+    return df.head(EXPLAIN_SAMPLE_ROWS).to_csv(index=False)
+
+
+def explanation_key(sql: str, sample: str) -> str:
+    """Cache key: the SQL plus a fingerprint of the rows the explanation is based on."""
+    return hashlib.sha256(f"{EXPLAIN_GEMINI_MODEL}\0{sql.strip()}\0{sample}".encode("utf-8")).hexdigest()
+
+
+class Explanation:
+    """A result explanation being generated in the background.
+
+    Text arrives in pieces; tokens() yields them as they come and can be fed to
+    st.write_stream. started/first_token_at/finished_at are perf_counter stamps.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.text = ""
+        self.error: Optional[str] = None
+        self.cached = False
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._cancelled = threading.Event()
+        self._cond = threading.Condition()
+        self._done = False
+
+    @property
+    def done(self) -> bool:
+        return self._done
+
+    def cancel(self):
+        """Stop consuming the model stream; text received so far is kept."""
+        self._cancelled.set()
+
+    def _emit(self, piece: str):
+        with self._cond:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.text += piece
+            self._cond.notify_all()
+
+    def _finish(self, error: Optional[str] = None):
+        with self._cond:
+            self.error = error
+            self.finished_at = time.perf_counter()
+            self._done = True
+            self._cond.notify_all()
+
+    def tokens(self, timeout: Optional[float] = None) -> Iterator[str]:
+        """Yield text as it arrives until the explanation is complete (or timeout passes)."""
+        sent = 0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while len(self.text) == sent and not self._done:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return
+                    self._cond.wait(remaining)
+                piece, done = self.text[sent:], self._done
+            if piece:
+                sent += len(piece)
+                yield piece
+            if done and sent == len(self.text):
+                return
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        for _ in self.tokens(timeout):
+            pass
+        return self.text
+
+
+def _run(job: Explanation, prompt: str, model, temperature: float):
+    with span("explain", prompt_chars=len(prompt)) as s:
+        try:
+            stream = model.generate_content(
+                contents=prompt,
+                generation_config=generation_config(temperature, max_output_tokens=256),
+                stream=True,
+            )
+            chunk = None
+            for chunk in stream:
+                if job._cancelled.is_set():
+                    s.set(cancelled=True)
+                    break
+                try:
+                    piece = chunk.text
+                except ValueError:
+                    continue  # chunk without text parts (e.g. safety metadata)
+                if job.first_token_at is None:
+                    s.set(first_token_ms=round(s.duration * 1000, 3))
+                job._emit(piece)
+            s.set(chars=len(job.text))
+            record_usage(s, chunk)  # the last chunk carries the totals
+        except Exception as e:
+            s.error = str(e)
+            job._finish(str(e))
+            return
+    if not job._cancelled.is_set() and job.text.strip():
+        with _CACHE_LOCK:
+            _CACHE[job.key] = job.text
+            _CACHE.move_to_end(job.key)
+            while len(_CACHE) > EXPLAIN_CACHE_MAX_ENTRIES:
+                _CACHE.popitem(last=False)
+    job._finish()
+
+
+def explain_result(sql: str, df: pd.DataFrame, model=None, temperature: float = 0.2) -> Explanation:
+    """Start explaining a result in the background and return immediately.
+
+    Only the first EXPLAIN_SAMPLE_ROWS rows are used, so this can be called
+    with the first streamed chunk. Repeated (SQL, rows) pairs are answered from
+    an in-memory cache without calling the model.
+    """
+    sample = result_sample(df)
+    job = Explanation(explanation_key(sql, sample))
+    with _CACHE_LOCK:
+        cached = _CACHE.get(job.key)
+        if cached is not None:
+            _CACHE.move_to_end(job.key)
+    if cached is not None:
+        job.cached = True
+        job._emit(cached)
+        job._finish()
+        return job
+    if model is None and not GOOGLE_API_KEY:
+        job._finish("GOOGLE_API_KEY not set in environment.")
+        return job
+    prompt = EXPLAIN_PROMPT.format(sql=sql.strip(), columns=", ".join(map(str, df.columns)), sample=sample)
+    _EXECUTOR.submit(in_current_context(_run), job, prompt, model or get_model(EXPLAIN_GEMINI_MODEL), temperature)
+    return job
@@ -0,0 +1,291 @@
+# federated.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from config import FEDERATED_KEY_PUSHDOWN_MAX
+from db_utils import execute_mysql_query
+from sheet_engine import SheetSQLEngine
+from tracing import span, in_current_context
+from sql_utils import (Token, TableRef, tokenize, is_keyword, is_op, referenced_tables,
+                       split_top_level, top_level_clause, token_end)
+
+
+def _quote_mysql(name: str) -> str:
+    return ".".join("`" + part.replace("`", "``") + "`" for part in name.split("."))
+
+
+def _mysql_literal(value) -> str:
+    if isinstance(value, (bool, np.bool_)):
+        return "1" if value else "0"
+    if isinstance(value, (int, np.integer)):
+        return str(int(value))
+    if isinstance(value, (float, np.floating)):
+        return repr(float(value))
+    text = str(value.isoformat(sep=" ") if hasattr(value, "isoformat") else value)
+    return "'" + text.replace("\\", "\\\\").replace("'", "''") + "'"
+
+
+class FederatedPlan:
+    """How a SELECT spanning MySQL tables and sheet DataFrames is split up.
+
+    mysql_queries: {table: pushed-down SELECT sent to MySQL}
+    sheet_columns: {table: columns kept from the sheet (None = all)}
+    The original SQL then runs locally over those pieces.
+    """
+
+    def __init__(self, sql: str, mysql_queries: Dict[str, str], sheet_columns: Dict[str, Optional[List[str]]]):
+        self.sql = sql
+        self.mysql_queries = mysql_queries
+        self.sheet_columns = sheet_columns
+
+    def describe(self) -> str:
+        lines = [f"MySQL: {q}" for q in self.mysql_queries.values()]
+        lines += [f"Sheet: {t} ({', '.join(c) if c else '*'})" for t, c in self.sheet_columns.items()]
+        return "\n".join(lines)
+
+
+def _match(name: str, names) -> Optional[str]:
+    lowered = {n.lower(): n for n in names}
+    return lowered.get(name.lower())
+
+
+def _column_refs(tokens: List[Token]) -> List[Tuple[Optional[str], str]]:
+    """(qualifier or None, column) for every identifier that may be a column, plus "*" markers."""
+    refs = []
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if tok.kind in ("ident", "qident"):
+            if i + 2 < len(tokens) and is_op(tokens[i + 1], "."):
+                nxt = tokens[i + 2]
+                refs.append((tok.value, "*" if is_op(nxt, "*") else nxt.value))
+                i += 3
+                continue
+            if not (i + 1 < len(tokens) and is_op(tokens[i + 1], "(")):  # skip function names
+                refs.append((None, tok.value))
+        elif is_op(tok, "*") and i > 0 and (is_keyword(tokens[i - 1], "select", "distinct") or is_op(tokens[i - 1], ",")):
+            refs.append((None, "*"))
+        i += 1
+    return refs
+
+
+def _needed_columns(refs, ref: TableRef, columns: List[str]) -> Optional[List[str]]:
+    """Columns of one table the query can touch; None means all of them."""
+    needed = set()
+    for qualifier, col in refs:
+        if qualifier is not None and qualifier.lower() not in (ref.alias.lower(), ref.name.lower()):
+            continue
+        if col == "*":
+            return None
+        match = _match(col, columns)
+        if match:
+            needed.add(match)
+    return [c for c in columns if c in needed] or columns[:1]
+
+
+def _conjunct_owner(conjunct: List[Token], refs_by_alias: Dict[str, TableRef],
+                    columns: Dict[str, List[str]]) -> Optional[TableRef]:
+    """The single table a WHERE conjunct depends on, or None if it spans tables / is unsafe to push."""
+    owners = set()
+    for tok in conjunct:
+        if is_keyword(tok, "select", "exists"):
+            return None  # subqueries stay local
+    for qualifier, col in _column_refs(conjunct):
+        if qualifier is not None:
+            ref = refs_by_alias.get(qualifier.lower())
+            if ref is None:
+                return None
+            owners.add(ref)
+            continue
+        holders = [r for r in refs_by_alias.values() if _match(col, columns.get(r.name, []))]
+        if len(holders) > 1:
+            return None
+        owners.update(holders)
+    return owners.pop() if len(owners) == 1 else None
+
+
+_ON_ENDERS = ("join", "inner", "left", "right", "full", "cross", "natural", "straight_join", "where", "group",
+              "order", "limit", "having", "union", "window")
+
+
+def _join_equalities(tokens: List[Token], refs_by_alias: Dict[str, TableRef],
+                     columns: Dict[str, List[str]]) -> List[Tuple[TableRef, str, TableRef, str]]:
+    """(ref, column, ref, column) for every top-level ON conjunct of the form a.x = b.y."""
+    out = []
+    depth = 0
+    body: Optional[List[Token]] = None
+    bodies = []
+    for tok in tokens:
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        if depth == 0 and tok.kind == "ident" and tok.value.lower() in _ON_ENDERS + ("on",):
+            if body is not None:
+                bodies.append(body)
+            body = [] if is_keyword(tok, "on") else None
+        elif body is not None:
+            body.append(tok)
+    if body is not None:
+        bodies.append(body)
+    for body in bodies:
+        for conjunct in split_top_level(body, "and"):
+            eq = [i for i, t in enumerate(conjunct) if t.kind == "op"]
+            eq = [i for i in eq if is_op(conjunct[i], "=")]
+            if len(eq) != 1:
+                continue
+            sides = conjunct[:eq[0]], conjunct[eq[0] + 1:]
+            if not all(side and all(t.kind in ("ident", "qident") or is_op(t, ".") for t in side)
+                       and len(_column_refs(side)) == 1 for side in sides):
+                continue
+            owners = [_conjunct_owner(side, refs_by_alias, columns) for side in sides]
+            if None in owners or owners[0] is owners[1]:
+                continue
+            names = [_match(_column_refs(side)[0][1], columns[o.name]) for side, o in zip(sides, owners)]
+            if None not in names:
+                out.append((owners[0], names[0], owners[1], names[1]))
+    return out
+
+
+def plan_federated(sql: str, mysql_schema: Dict[str, list], df_map: Dict[str, pd.DataFrame]) -> FederatedPlan:
+    """Split a cross-source SELECT into per-source scans with projection and filter pushdown.
+
+    Equi-join keys from a sheet (at most FEDERATED_KEY_PUSHDOWN_MAX distinct
+    values) are pushed into the joined MySQL scan as an IN list.
+    Raises ValueError when a referenced table belongs to neither source.
+    """
+    tokens = tokenize(sql)
+    refs = referenced_tables(sql)
+    columns: Dict[str, List[str]] = {}
+    source: Dict[str, str] = {}
+    for ref in refs:
+        if _match(ref.name, mysql_schema):
+            source[ref.name] = "mysql"
+            columns[ref.name] = [c["name"] for c in mysql_schema[_match(ref.name, mysql_schema)]]
+        elif _match(ref.name, df_map):
+            source[ref.name] = "sheet"
+            columns[ref.name] = [str(c) for c in df_map[_match(ref.name, df_map)].columns]
+        else:
+            raise ValueError(f"Table '{ref.name}' is neither a MySQL table nor a loaded sheet.")
+
+    column_refs = _column_refs(tokens)
+    # WHERE conjuncts that touch one MySQL table are pushed to it (and still re-applied locally).
+    pushed: Dict[str, List[str]] = {}
+    no_pushdown = any(is_keyword(t, "right", "full") for t in tokens)
+    clause = top_level_clause(tokens, "where")
+    if clause and not no_pushdown:
+        refs_by_alias = {r.alias.lower(): r for r in refs}
+        for conjunct in split_top_level(tokens[clause[0]:clause[1]], "and"):
+            if not conjunct:
+                continue
+            owner = _conjunct_owner(conjunct, refs_by_alias, columns)
+            if owner is not None and source[owner.name] == "mysql" and not owner.outer:
+                end = token_end(sql, conjunct[-1])
+                pushed.setdefault(owner.alias, []).append(sql[conjunct[0].pos:end])
+
+    seen = [r.name.lower() for r in refs]
+    # Inner-join keys found in a sheet narrow the MySQL scan to rows that can match. Not
+    # for a MySQL table that an outer join preserves: its unmatched rows are part of the result.
+    outer_join = no_pushdown or any(is_keyword(t, "left") for t in tokens)
+    if FEDERATED_KEY_PUSHDOWN_MAX > 0 and not no_pushdown:
+        refs_by_alias = {r.alias.lower(): r for r in refs}
+        for a, a_col, b, b_col in _join_equalities(tokens, refs_by_alias, columns):
+            for m, m_col, sh, sh_col in ((a, a_col, b, b_col), (b, b_col, a, a_col)):
+                if source[m.name] != "mysql" or source[sh.name] != "sheet" or sh.outer or \
+                        (outer_join and not m.outer) or seen.count(m.name.lower()) > 1:
+                    continue
+                keys = df_map[_match(sh.name, df_map)][sh_col].dropna().unique()
+                if len(keys) > FEDERATED_KEY_PUSHDOWN_MAX:
+                    continue
+                in_list = ", ".join(_mysql_literal(k) for k in keys)
+                pushed.setdefault(m.alias, []).append(
+                    f"{_quote_mysql(m.alias)}.{_quote_mysql(m_col)} IN ({in_list})" if in_list else "1 = 0")
+
+    mysql_queries, sheet_columns = {}, {}
+    for ref in refs:
+        # a table used twice (self join) is scanned once, unfiltered and unpruned
+        repeated = seen.count(ref.name.lower()) > 1
+        needed = None if repeated else _needed_columns(column_refs, ref, columns[ref.name])
+        if source[ref.name] == "mysql":
+            select = ", ".join(_quote_mysql(c) for c in needed) if needed else "*"
+            q = f"SELECT {select} FROM {_quote_mysql(ref.name)} AS {_quote_mysql(ref.alias)}"
+            if pushed.get(ref.alias) and not repeated:
+                q += " WHERE " + " AND ".join(f"({c})" for c in pushed[ref.alias])
+            mysql_queries[ref.name] = q
+        else:
+            sheet_columns[ref.name] = needed
+    return FederatedPlan(sql, mysql_queries, sheet_columns)
+
+
+def run_federated(sql: str, mysql_conn, mysql_schema: Dict[str, list],
+                  df_map: Dict[str, pd.DataFrame]) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    """Execute a SELECT joining MySQL tables with sheet DataFrames.
+
+    MySQL scans run concurrently (one pooled connection each); sheet frames are
+    pruned to the referenced columns; the original statement then runs on a
+    throwaway in-memory SQLite engine over the pieces. A MySQL scan cut short by
+    the result row/size limits is an error rather than a partial join.
+    """
+    with span("federated") as s:
+        try:
+            plan = plan_federated(sql, mysql_schema, df_map)
+        except ValueError as e:
+            return None, str(e)
+        s.set(mysql_scans=len(plan.mysql_queries), sheet_tables=len(plan.sheet_columns))
+        return _run_plan(plan, sql, mysql_conn, df_map)
+
+
+def _run_plan(plan: FederatedPlan, sql: str, mysql_conn,
+              df_map: Dict[str, pd.DataFrame]) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+    pieces: Dict[str, pd.DataFrame] = {}
+    truncated = []
+    if plan.mysql_queries:
+        with ThreadPoolExecutor(max_workers=len(plan.mysql_queries)) as pool:
+            futures = {t: pool.submit(in_current_context(execute_mysql_query), mysql_conn, q)
+                       for t, q in plan.mysql_queries.items()}
+        for table, fut in futures.items():
+            df, err = fut.result()
+            if err:
+                return None, f"MySQL part failed ({table}): {err}"
+            if df.attrs.get("truncated"):
+                truncated.append(f"{table} ({df.attrs['truncated']})")
+            pieces[table] = df
+        if truncated:
+            # a join over a partial scan is wrong, not just short: refuse it
+            return None, (f"MySQL scan of {', '.join(truncated)} stopped early, so the cross-source result "
+                          f"would be incomplete. Filter the MySQL table(s) further.")
+    for table, cols in plan.sheet_columns.items():
+        df = df_map[_match(table, df_map)]
+        pieces[table] = df[cols] if cols else df
+
+    with span("federated.join", rows_in=sum(len(p) for p in pieces.values())):
+        engine = SheetSQLEngine(index_after=0)
+        try:
+            engine.sync(pieces)
+            res = engine.query(sql.strip().rstrip(';'))
+        except Exception as e:
+            return None, f"Federated execution failed: {e}"
+    res.attrs["federated_plan"] = plan.describe()
+    return res, None
+
+
+def route_tables(sql: str, mysql_tables: Set[str], sheet_tables: Set[str]) -> str:
+    """'mysql', 'sheets', 'federated' or 'unknown' depending on where the referenced tables live.
+
+    Names present in both sources count as MySQL tables.
+    """
+    refs = referenced_tables(sql)
+    if not refs:
+        return "unknown"
+    owners = set()
+    for ref in refs:
+        if _match(ref.name, mysql_tables):
+            owners.add("mysql")
+        elif _match(ref.name, sheet_tables):
+            owners.add("sheets")
+        else:
+            return "unknown"
+    return owners.pop() if len(owners) == 1 else "federated"
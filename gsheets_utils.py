@@ -1,142 +1,615 @@
 # gsheets_utils.py
+import itertools
 import re
+import numpy as np
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
-from pandasql import sqldf
-from typing import Tuple, Dict, Optional
+from typing import TYPE_CHECKING, Tuple, Dict, List, Optional
 
-def connect_google_sheet(sa_file: str, sheet_name: str) -> Tuple[gspread.Spreadsheet, gspread.Worksheet, pd.DataFrame]:
+from config import SHEET_WRITE_BEHIND
+from sheet_engine import SheetSQLEngine
+from sheet_predicates import (compile_where, resolve_column, coerce_value, coerce_column_values,
+                              assignments_from_set, parse_literal_tuple, widened_dtype)
+from sql_utils import Token, tokenize, is_keyword
+from tracing import span
+
+if TYPE_CHECKING:
+    import gspread  # loaded by open_google_workbook on first connect
+
+# {(spreadsheet id, tab title): (modified time, DataFrame)} - shared by all sessions
+_SHEET_CACHE: Dict[Tuple[str, str], Tuple[str, pd.DataFrame]] = {}
+# {(spreadsheet id, tab title, header): {column: "int" | "float" | "datetime" | "str"}}
+_DTYPE_CACHE: Dict[tuple, Dict[str, str]] = {}
+
+# Source of df.attrs["version"]: every loaded or mutated sheet frame gets a new number.
+_FRAME_VERSIONS = itertools.count(1)
+
+_DATE_LIKE = re.compile(r"^\d{4}-\d{1,2}-\d{1,2}([ T]\d{1,2}:\d{2}(:\d{2})?)?$|^\d{1,2}/\d{1,2}/\d{2,4}$")
+
+def rowcol_to_a1(row: int, col: int) -> str:
+    """gspread.utils.rowcol_to_a1 without importing gspread."""
+    label = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        label = chr(65 + rem) + label
+    return f"{label}{row}"
+
+def quote_sheet_title(title: str) -> str:
+    """Tab title as the sheet part of an A1 range: quoted, with embedded quotes doubled."""
+    return "'" + title.replace("'", "''") + "'"
+
+def safe_table_name(title: str) -> str:
+    return re.sub(r'\W|^(?=\d)', '_', title)
+
+def frame_version(df: pd.DataFrame) -> int:
+    """Data version of a sheet frame; changes whenever the SQL handlers mutate it."""
+    if "version" not in df.attrs:
+        df.attrs["version"] = next(_FRAME_VERSIONS)
+    return df.attrs["version"]
+
+def _convert_column(col: pd.Series, kind: str) -> Optional[pd.Series]:
+    """Convert a string column to `kind`; None if some non-empty cell does not fit."""
+    filled = col != ""
+    if kind == "str":
+        return col
+    if kind == "datetime":
+        out = pd.to_datetime(col.where(filled), errors="coerce", format="mixed")
+    else:
+        out = pd.to_numeric(col.where(filled), errors="coerce")
+    if out[filled].isna().any():
+        return None
+    if kind == "int":
+        if not filled.all():
+            return None
+        # int64, not downcast: INSERT/UPDATE values must fit without wrapping
+        return out.astype("int64")
+    return out
+
+def _infer_kind(col: pd.Series) -> str:
+    sample = col[col != ""]
+    if sample.empty:
+        return "str"
+    # parsing a whole text column as numbers is the slow part of a load: rule it out on a few cells
+    numbers = pd.to_numeric(sample.head(20), errors="coerce")
+    if numbers.notna().all():
+        numbers = pd.to_numeric(sample, errors="coerce")
+    if numbers.notna().all():
+        integral = (numbers % 1 == 0).all() and len(sample) == len(col)
+        return "int" if integral else "float"
+    if sample.head(20).str.match(_DATE_LIKE).all() and \
+            pd.to_datetime(sample, errors="coerce", format="mixed").notna().all():
+        return "datetime"
+    return "str"
+
+def frame_from_values(values: List[list], dtypes: Optional[Dict[str, str]] = None) -> Tuple[pd.DataFrame, Dict[str, str]]:
+    """Build a typed DataFrame from raw sheet values (first row = header).
+
+    Columns are converted to int64/float64/datetime dtypes; `dtypes` from a
+    previous load is tried first so unchanged columns skip inference.
+    Returns (df, dtypes actually used).
+    """
+    if not values:
+        return pd.DataFrame(), {}
+    header = [str(h) for h in values[0]]
+    width = len(header)
+    rows = [list(r[:width]) + [""] * (width - len(r)) for r in values[1:]]
+    raw = pd.DataFrame(rows, columns=header, dtype=object) if rows else pd.DataFrame(columns=header, dtype=object)
+    used = {}
+    data = {}
+    for name in header:
+        col = raw[name].astype(str) if len(raw) else raw[name]
+        kind = (dtypes or {}).get(name)
+        converted = _convert_column(col, kind) if kind else None
+        if converted is None:
+            kind = _infer_kind(col)
+            converted = _convert_column(col, kind)
+            if converted is None:
+                kind, converted = "str", col
+        used[name] = kind
+        data[name] = converted
+    return pd.DataFrame(data, columns=header), used
+
+class SheetWorkbook:
+    """Every worksheet of a spreadsheet exposed as a table, fetched on first reference.
+
+    The worksheet list and header rows are fetched once per workbook. Tab
+    contents are fetched together with one values_batch_get, converted with
+    cached column types and shared across sessions keyed on the file's
+    modified time, so unchanged tabs are not downloaded again.
+    """
+
+    def __init__(self, sh: "gspread.Spreadsheet"):
+        self.sh = sh
+        self.frames: Dict[str, pd.DataFrame] = {}
+        self._worksheets: Optional[List["gspread.Worksheet"]] = None
+        self._headers: Optional[Dict[str, List[str]]] = None
+
+    def worksheets(self) -> List["gspread.Worksheet"]:
+        if self._worksheets is None:
+            self._worksheets = self.sh.worksheets()
+        return self._worksheets
+
+    def titles(self) -> List[str]:
+        return [ws.title for ws in self.worksheets()]
+
+    def worksheet(self, title: str) -> "gspread.Worksheet":
+        for ws in self.worksheets():
+            if ws.title == title:
+                return ws
+        raise KeyError(title)
+
+    def modified_time(self) -> Optional[str]:
+        """Drive modifiedTime of the file, or None if it cannot be read."""
+        for attr in ("get_lastUpdateTime", "lastUpdateTime"):
+            try:
+                value = getattr(self.sh, attr)
+                return str(value() if callable(value) else value)
+            except Exception:
+                continue
+        return None
+
+    def headers(self) -> Dict[str, List[str]]:
+        """Header row of every tab (one request)."""
+        if self._headers is None:
+            titles = self.titles()
+            resp = self.sh.values_batch_get([f"{quote_sheet_title(t)}!1:1" for t in titles])
+            self._headers = {}
+            for title, vr in zip(titles, resp.get("valueRanges", [])):
+                rows = vr.get("values", [])
+                self._headers[title] = [str(h) for h in rows[0]] if rows else []
+        return self._headers
+
+    def schema(self) -> Dict[str, list]:
+        """{table: [{name,type}, ...]} for every tab; types come from loaded/cached dtypes."""
+        out = {}
+        for title, header in self.headers().items():
+            if title in self.frames:
+                out.update(get_sheet_schema_from_df(self.frames[title], title))
+                continue
+            kinds = _DTYPE_CACHE.get((self.sh.id, title, tuple(header)), {})
+            out[title] = [{"name": c, "type": kinds.get(c, "text")} for c in header]
+        return out
+
+    def load(self, titles: List[str]) -> Dict[str, pd.DataFrame]:
+        """Make sure `titles` are loaded; missing or changed tabs are fetched in one batch."""
+        missing = [t for t in titles if t not in self.frames]
+        if not missing:
+            return {t: self.frames[t] for t in titles}
+        with span("sheets.load", tabs=len(missing)) as s:
+            self._load_missing(missing, s)
+        return {t: self.frames[t] for t in titles}
+
+    def _load_missing(self, missing: List[str], s):
+        modified = self.modified_time()
+        fetch = []
+        for title in missing:
+            cached = _SHEET_CACHE.get((self.sh.id, title))
+            if modified is not None and cached and cached[0] == modified:
+                # private copy: mutations in this session must not leak into the cache
+                self.frames[title] = cached[1].copy()
+            else:
+                fetch.append(title)
+        s.set(cache_hits=len(missing) - len(fetch))
+        if fetch:
+            writer = tokens = None
+            if SHEET_WRITE_BEHIND:
+                from sheet_writer import get_sheet_writer  # imports this module
+                writer = get_sheet_writer()
+                tokens = {t: writer.load_token(self.worksheet(t)) for t in fetch}
+            resp = self.sh.values_batch_get([quote_sheet_title(t) for t in fetch])
+            s.set(requests=1)
+            for title, vr in zip(fetch, resp.get("valueRanges", [])):
+                values = vr.get("values", [])
+                s.add("rows", max(len(values) - 1, 0))
+                s.add("cells", sum(len(r) for r in values))
+                header = tuple(str(h) for h in values[0]) if values else ()
+                key = (self.sh.id, title, header)
+                df, kinds = frame_from_values(values, _DTYPE_CACHE.get(key))
+                _DTYPE_CACHE[key] = kinds
+                frame_version(df)  # before caching, so per-session copies share it
+                if writer is not None:
+                    writer.loaded(self.worksheet(title), tokens[title], frame_version(df))
+                self.frames[title] = df
+                if modified is not None:
+                    # the session mutates self.frames in place; the cache keeps what the sheet holds
+                    _SHEET_CACHE[(self.sh.id, title)] = (modified, df.copy())
+
+    def frame(self, title: str) -> pd.DataFrame:
+        return self.load([title])[title]
+
+    def set_frame(self, title: str, df: pd.DataFrame):
+        """Record the in-memory state after a mutation (the shared cache entry is dropped)."""
+        self.frames[title] = df
+        _SHEET_CACHE.pop((self.sh.id, title), None)
+
+    def tables_in_sql(self, sql: str) -> List[str]:
+        """Tabs whose title or safe name appears as an identifier in sql."""
+        found = []
+        for title in self.titles():
+            for name in {title, safe_table_name(title)}:
+                if re.search(r"(?<![\w])[`\"\[]?" + re.escape(name) + r"[`\"\]]?(?![\w])", sql, flags=re.I):
+                    found.append(title)
+                    break
+        return found
+
+    def table_maps(self, titles: List[str]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, "gspread.Worksheet"]]:
+        """(df_map, ws_map) for the given tabs, each under its title and safe name."""
+        df_map, ws_map = {}, {}
+        for title, df in self.load(titles).items():
+            ws = self.worksheet(title)
+            for name in (title, safe_table_name(title)):
+                df_map[name] = df
+                ws_map[name] = ws
+        return df_map, ws_map
+
+def open_google_workbook(sa_file: str, sheet_name: str) -> SheetWorkbook:
+    import gspread
+    from google.oauth2.service_account import Credentials
     scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
     creds = Credentials.from_service_account_file(sa_file, scopes=scopes)
     client = gspread.authorize(creds)
-    sh = client.open(sheet_name)
-    ws = sh.sheet1
-    df = pd.DataFrame(ws.get_all_records())
-    return sh, ws, df
+    book = SheetWorkbook(client.open(sheet_name))
+    if SHEET_WRITE_BEHIND:
+        from sheet_writer import get_sheet_writer
+        get_sheet_writer().recover(book)   # writes a previous process journalled but never sent
+    return book
+
+def connect_google_sheet(sa_file: str, sheet_name: str) -> Tuple["gspread.Spreadsheet", "gspread.Worksheet", pd.DataFrame]:
+    book = open_google_workbook(sa_file, sheet_name)
+    ws = book.worksheets()[0]
+    return book.sh, ws, book.frame(ws.title)
 
 def get_sheet_schema_from_df(df: pd.DataFrame, sheet_name: str):
     return {sheet_name: [{"name": c, "type": str(df[c].dtype)} for c in df.columns]}
 
-def push_df_to_sheet(ws: gspread.Worksheet, df: pd.DataFrame):
-    """Push DataFrame to the worksheet (overwrite contents)."""
+def _sheet_values(df: pd.DataFrame) -> List[List[str]]:
+    """Cell strings for df (NaN -> ""), converted column-wise rather than per row."""
+    out = df.astype(object)
+    for c in df.columns[[pd.api.types.is_datetime64_any_dtype(t) for t in df.dtypes]]:
+        col = df[c]
+        fmt = "%Y-%m-%d" if (col.dropna() == col.dropna().dt.normalize()).all() else "%Y-%m-%d %H:%M:%S"
+        out[c] = col.dt.strftime(fmt).astype(object)
+    return out.where(df.notna(), "").astype(str).values.tolist()
+
+def _runs(positions: np.ndarray) -> List[Tuple[int, int]]:
+    """Split sorted row positions into [(first, last), ...] runs of consecutive rows."""
+    if len(positions) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(positions) != 1)
+    starts = np.concatenate([[0], breaks + 1])
+    ends = np.concatenate([breaks, [len(positions) - 1]])
+    return [(int(positions[a]), int(positions[b])) for a, b in zip(starts, ends)]
+
+def append_sheet_rows(ws: "gspread.Worksheet", rows: pd.DataFrame):
+    """Append DataFrame rows below the existing data (one request)."""
+    if rows is not None and len(rows):
+        append_sheet_values(ws, _sheet_values(rows))
+
+def append_sheet_values(ws: "gspread.Worksheet", values: List[List[str]]):
+    """Append rows of cell strings below the existing data (one request)."""
+    if values:
+        with span("sheets.write", op="append", rows=len(values), cells=sum(map(len, values)), requests=1):
+            ws.append_rows(values)
+
+def update_sheet_rows(ws: "gspread.Worksheet", df: pd.DataFrame, positions, columns):
+    """Rewrite only `columns` of the rows at `positions` (0-based, header excluded) in one batch_update."""
+    positions = np.sort(np.asarray(positions, dtype=np.int64))
+    if len(positions) == 0:
+        return
+    col_idx = [df.columns.get_loc(c) for c in columns]
+    lo, hi = min(col_idx), max(col_idx)
+    write_sheet_cells(ws, positions, _sheet_values(df.iloc[positions, lo:hi + 1]), lo, hi)
+
+def write_sheet_cells(ws: "gspread.Worksheet", positions, values: List[List[str]], lo: int, hi: int):
+    """Write columns lo..hi (0-based) of the rows at sorted `positions` in one batch_update.
+
+    values holds one list of hi - lo + 1 cell strings per position.
+    """
+    data, k = [], 0
+    for first, last in _runs(np.asarray(positions, dtype=np.int64)):
+        n = last - first + 1
+        data.append({
+            "range": f"{rowcol_to_a1(first + 2, lo + 1)}:{rowcol_to_a1(last + 2, hi + 1)}",
+            "values": values[k:k + n],
+        })
+        k += n
+    if data:
+        with span("sheets.write", op="update", rows=len(values), cells=len(values) * (hi - lo + 1), requests=1):
+            ws.batch_update(data)
+
+def delete_sheet_rows(ws: "gspread.Worksheet", positions):
+    """Delete rows at `positions` (0-based, header excluded) bottom-up in one batch request."""
+    runs = _runs(np.sort(np.asarray(positions, dtype=np.int64)))
+    if not runs:
+        return
+    requests = [{
+        "deleteDimension": {
+            "range": {"sheetId": ws.id, "dimension": "ROWS", "startIndex": first + 1, "endIndex": last + 2}
+        }
+    } for first, last in reversed(runs)]
+    with span("sheets.write", op="delete", rows=len(positions), requests=1):
+        ws.spreadsheet.batch_update({"requests": requests})
+
+def push_df_to_sheet(ws: "gspread.Worksheet", df: pd.DataFrame, previous: Optional[pd.DataFrame] = None):
+    """Push DataFrame to the worksheet.
+
+    With `previous` (what the sheet currently holds) only the difference is sent:
+    changed cells via batch_update, extra rows via append_rows, surplus trailing
+    rows deleted. Otherwise the sheet is overwritten in place, clearing only the
+    area below the new data, so it is never empty in between.
+    """
     if df is None:
         return
     if df.empty:
-        ws.clear()
+        with span("sheets.write", op="clear", requests=1):
+            ws.clear()
+        return
+    if previous is not None and list(previous.columns) == list(df.columns):
+        with span("sheets.push", diff=True):
+            _push_diff(ws, previous, df)
         return
     # gspread expects list of lists, first row = header
-    values = [list(df.columns)]
-    for _, row in df.fillna("").iterrows():
-        values.append([str(x) for x in row.tolist()])
-    ws.clear()
-    ws.update(values)
+    overwrite_sheet(ws, sheet_values_with_header(df))
+
+def sheet_values_with_header(df: pd.DataFrame) -> List[List[str]]:
+    return [[str(c) for c in df.columns]] + _sheet_values(df)
+
+def overwrite_sheet(ws: "gspread.Worksheet", values: List[List[str]]):
+    """Write values (header first) from A1 and clear whatever lies outside them."""
+    width = len(values[0]) if values else 0
+    with span("sheets.write", op="overwrite", rows=len(values) - 1, cells=sum(map(len, values)), requests=1) as s:
+        ws.update(values, "A1")
+        extra = []
+        if ws.row_count > len(values):
+            extra.append(f"A{len(values) + 1}:{rowcol_to_a1(ws.row_count, max(ws.col_count, width))}")
+        if ws.col_count > width:
+            extra.append(f"{rowcol_to_a1(1, width + 1)}:{rowcol_to_a1(len(values), ws.col_count)}")
+        if extra:
+            ws.batch_clear(extra)
+            s.add("requests")
+
+def _push_diff(ws: "gspread.Worksheet", old: pd.DataFrame, new: pd.DataFrame):
+    shared = min(len(old), len(new))
+    if shared:
+        old_vals = np.array(_sheet_values(old.iloc[:shared]), dtype=object)
+        new_vals = np.array(_sheet_values(new.iloc[:shared]), dtype=object)
+        changed = old_vals != new_vals
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows):
+            cols = np.flatnonzero(changed[rows].any(axis=0))
+            update_sheet_rows(ws, new, rows, [new.columns[cols[0]], new.columns[cols[-1]]])
+    if len(new) > len(old):
+        append_sheet_rows(ws, new.iloc[len(old):])
+    elif len(old) > len(new):
+        delete_sheet_rows(ws, np.arange(len(new), len(old)))
+
+def _store(df_map: Dict[str, pd.DataFrame], table: str, df: pd.DataFrame):
+    """Replace df_map[table] and every other name bound to the same DataFrame.
+
+    The frame gets a new version, which retires cached results that read it.
+    """
+    df.attrs["version"] = next(_FRAME_VERSIONS)
+    old = df_map.get(table)
+    for name in [n for n, d in df_map.items() if d is old]:
+        df_map[name] = df
+    df_map[table] = df
+
+def _queue_write(ws: "gspread.Worksheet", sql: str, rows_before: int, op: dict, base_version: int, version: int):
+    """Hand a change to the write-behind queue instead of pushing it now (see sheet_writer.py)."""
+    from sheet_writer import get_sheet_writer  # imports this module
+    get_sheet_writer().submit(ws, sql, rows_before, op, base_version, version)
+
+def _table_ref(q: str, tokens: List[Token], i: int, stop_words: Tuple[str, ...]) -> Tuple[str, int]:
+    """Read a table name starting at tokens[i] (unquoted names may contain spaces/hyphens)."""
+    if i < len(tokens) and tokens[i].kind == "qident":
+        return tokens[i].value, i + 1
+    start = i
+    while i < len(tokens) and not is_keyword(tokens[i], *stop_words) and tokens[i].value not in ("(", ";"):
+        i += 1
+    if start == i:
+        return "", i
+    last = tokens[i - 1]
+    return q[tokens[start].pos:last.pos + len(last.value)].strip(), i
+
+def _find_table(df_map: Dict[str, pd.DataFrame], name: str) -> Optional[str]:
+    if name in df_map:
+        return name
+    lowered = {k.lower(): k for k in df_map}
+    return lowered.get(name.lower())
+
+def _column_name(df: pd.DataFrame, name: str) -> str:
+    """Existing column matching name (case-insensitive), or name itself for a new column."""
+    try:
+        return resolve_column(df, name)
+    except ValueError:
+        return name
+
+def _where_mask(df: pd.DataFrame, q: str, tokens: List[Token], where_at: Optional[int]) -> pd.Series:
+    """Boolean mask for the WHERE clause starting at tokens[where_at] (all rows if None)."""
+    if where_at is None:
+        return pd.Series(True, index=df.index)
+    if where_at + 1 >= len(tokens):
+        raise ValueError("Empty WHERE clause.")
+    return compile_where(q[tokens[where_at + 1].pos:])(df)
 
 def execute_sheet_sql_on_df(df_map: Dict[str, pd.DataFrame],
                             sql: str,
-                            sheet_ws_map: Dict[str, gspread.Worksheet]) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
+                            sheet_ws_map: Dict[str, "gspread.Worksheet"],
+                            engine: Optional[SheetSQLEngine] = None) -> Tuple[Optional[pd.DataFrame], Optional[str]]:
     """
-    Execute SQL against pandas DataFrame(s) using pandasql.
-    sheet_ws_map: mapping table_name -> gspread.Worksheet to push back changes.
+    Execute SQL against pandas DataFrame(s) using an in-memory SQLite engine.
+    sheet_ws_map: mapping table_name -> gspread.Worksheet to push back changes
+    (queued on the write-behind SheetWriter when SHEET_WRITE_BEHIND is set).
+    engine: persistent SheetSQLEngine (e.g. one per session); when omitted a
+    throwaway engine is built for this call. Mutations are applied to both the
+    DataFrame and the engine.
     """
+    with span("sheets.execute", statement=sql.strip().split(None, 1)[0].lower() if sql.strip() else "") as s:
+        df, err = _execute_sheet_sql(df_map, sql, sheet_ws_map, engine)
+        if df is not None and "affected_rows" in df.columns and len(df.columns) == 1:
+            s.set(affected_rows=int(df["affected_rows"].iloc[0]))
+        elif df is not None:
+            s.set(rows=len(df))
+        s.error = err
+        return df, err
+
+def _execute_sheet_sql(df_map, sql, sheet_ws_map, engine):
     q = sql.strip().rstrip(';')
     q_lower = q.lower()
 
     try:
         # SELECT
         if q_lower.startswith("select"):
-            pysqldf = lambda qtext: sqldf(qtext, df_map)
-            res = pysqldf(q)
+            if engine is None:
+                engine = SheetSQLEngine(index_after=0)
+            engine.sync(df_map)
+            res = engine.query(q)
             return res, None
 
-        # INSERT INTO <table> (col, ...) VALUES (v, ...)
+        # INSERT INTO <table> [(col, ...)] VALUES (v, ...)[, (v, ...)]
         if q_lower.startswith("insert into"):
-            m = re.match(r"insert\s+into\s+[`\"]?([a-zA-Z0-9_\- ]+)[`\"]?\s*\(([^)]+)\)\s*values\s*\((.+)\)", q, flags=re.I)
-            if not m:
-                return None, "Unsupported INSERT format."
-            table = m.group(1).strip()
-            cols_raw = m.group(2)
-            vals_raw = m.group(3)
-            cols = [c.strip().strip("`\"'") for c in cols_raw.split(",")]
-            vals = [v.strip().strip("'\"") for v in re.split(r',\s*(?![^()]*\))', vals_raw)]
-            if table not in df_map:
-                return None, f"Sheet/table '{table}' not found."
+            tokens = tokenize(q)
+            table, i = _table_ref(q, tokens, 2, ("values", "value"))
+            table = _find_table(df_map, table)
+            if table is None:
+                return None, f"Sheet/table '{_table_ref(q, tokens, 2, ('values', 'value'))[0]}' not found."
             df = df_map[table]
-            if len(cols) != len(vals):
-                return None, "Column count does not match value count."
-            new_row = {col: None for col in df.columns}
-            for c, v in zip(cols, vals):
-                # preserve case as column names in df
-                if c in new_row:
-                    new_row[c] = v
-                else:
-                    new_row[c] = v
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            df_map[table] = df
+            rows_before = len(df)
+            base_version = frame_version(df)
+            old_columns = list(df.columns)
+            cols = old_columns
+            if i < len(tokens) and tokens[i].value == "(":
+                cols, i = [], i + 1
+                while tokens[i].value != ")":
+                    if tokens[i].value != ",":
+                        cols.append(_column_name(df, tokens[i].value))
+                    i += 1
+                i += 1
+            if i >= len(tokens) or not is_keyword(tokens[i], "values", "value"):
+                return None, "Unsupported INSERT format."
+            i += 1
+            rows = []
+            while True:
+                values, i = parse_literal_tuple(tokens, i)
+                if len(values) != len(cols):
+                    return None, "Column count does not match value count."
+                rows.append(values)
+                if i < len(tokens) and tokens[i].value == ",":
+                    i += 1
+                    continue
+                break
+            if i < len(tokens):
+                return None, "Unsupported INSERT format."
+            added = pd.DataFrame(rows, columns=cols)
+            for c in cols:
+                if c in df.columns:
+                    added[c] = coerce_column_values(df[c], added[c].tolist())
+            added = added.reindex(columns=old_columns + [c for c in cols if c not in old_columns])
+            for c in old_columns:
+                # widen the column rather than narrowing a value (5000 into int8, 1.5 into int)
+                dtype = widened_dtype(df[c], [None if pd.isna(v) else v for v in added[c].tolist()])
+                if dtype != df[c].dtype:
+                    df = df.astype({c: dtype})
+                try:
+                    added[c] = added[c].astype(dtype)
+                except (ValueError, TypeError):
+                    pass  # e.g. text into a datetime column; concat upcasts
+            # one concat for all rows
+            df = pd.concat([df, added], ignore_index=True)
+            _store(df_map, table, df)
+            if engine is not None:
+                engine.apply_insert(table, added, df)
             # push back
-            if table in sheet_ws_map:
+            if table in sheet_ws_map and SHEET_WRITE_BEHIND:
+                if old_columns and list(df.columns) == old_columns:
+                    op = {"op": "append", "values": _sheet_values(added[old_columns])}
+                else:
+                    op = {"op": "overwrite", "values": sheet_values_with_header(df)}
+                _queue_write(sheet_ws_map[table], sql, rows_before, op, base_version, frame_version(df))
+            elif table in sheet_ws_map:
                 try:
-                    push_df_to_sheet(sheet_ws_map[table], df)
+                    if old_columns and list(df.columns) == old_columns:
+                        append_sheet_rows(sheet_ws_map[table], added[old_columns])
+                    else:
+                        push_df_to_sheet(sheet_ws_map[table], df)
                 except Exception as e:
-                    return pd.DataFrame({"affected_rows": [1]}), f"Insert ok in-memory but failed to push to sheet: {e}"
-            return pd.DataFrame({"affected_rows": [1]}), None
+                    return pd.DataFrame({"affected_rows": [len(added)]}), f"Insert ok in-memory but failed to push to sheet: {e}"
+            return pd.DataFrame({"affected_rows": [len(added)]}), None
 
-        # UPDATE (simple equality WHERE)
+        # UPDATE <table> SET col = value, ... [WHERE <predicate>]
         if q_lower.startswith("update"):
-            m = re.match(r"update\s+[`\"]?([a-zA-Z0-9_\- ]+)[`\"]?\s+set\s+(.+?)\s+where\s+(.+)", q, flags=re.I)
-            if not m:
+            tokens = tokenize(q)
+            table_ref, i = _table_ref(q, tokens, 1, ("set",))
+            table = _find_table(df_map, table_ref)
+            if table is None:
+                return None, f"Sheet/table '{table_ref}' not found."
+            if i >= len(tokens):
                 return None, "Unsupported UPDATE format."
-            table = m.group(1).strip()
-            set_clause = m.group(2).strip()
-            where_clause = m.group(3).strip()
-            if table not in df_map:
-                return None, f"Sheet/table '{table}' not found."
             df = df_map[table]
-            assignments = {}
-            for part in re.split(r',\s*(?![^()]*\))', set_clause):
-                if '=' not in part:
-                    return None, f"Invalid SET clause: {part}"
-                k, v = part.split('=', 1)
-                assignments[k.strip().strip("`\"'")] = v.strip().strip("'\"")
-            m2 = re.match(r"([a-zA-Z0-9_`\" ]+)\s*=\s*('?\"?)(.+?)\2$", where_clause)
-            if not m2:
-                return None, "Unsupported WHERE clause for UPDATE (only simple equality supported)."
-            where_col = m2.group(1).strip().strip("`\"'")
-            where_val = m2.group(3)
-            mask = df[where_col].astype(str) == where_val
-            df.loc[mask, list(assignments.keys())] = pd.Series(assignments)
-            df_map[table] = df
-            if table in sheet_ws_map:
+            base_version = frame_version(df)
+            where_at = next((j for j in range(i + 1, len(tokens)) if is_keyword(tokens[j], "where")), None)
+            assignments = assignments_from_set(tokens[i + 1:where_at])
+            assignments = {_column_name(df, k): v for k, v in assignments.items()}
+            mask = _where_mask(df, q, tokens, where_at)
+            old_columns = list(df.columns)
+            for col, value in assignments.items():
+                if col in df.columns:
+                    typed = coerce_value(df[col], value)
+                    if typed is None and value is not None:
+                        df[col] = df[col].astype(object)
+                    else:
+                        value = typed
+                        dtype = widened_dtype(df[col], [value])
+                        if dtype != df[col].dtype:
+                            df[col] = df[col].astype(dtype)
+                    assignments[col] = value
+                df.loc[mask, col] = value
+            _store(df_map, table, df)
+            if engine is not None:
+                engine.apply_update(table, mask.to_numpy(), assignments, df)
+            if table in sheet_ws_map and SHEET_WRITE_BEHIND and mask.any():
+                if all(c in old_columns for c in assignments):
+                    positions = np.flatnonzero(mask.to_numpy())
+                    op = {"op": "update", "positions": positions, "values": _sheet_values(df.iloc[positions]),
+                          "columns": [df.columns.get_loc(c) for c in assignments]}
+                else:
+                    op = {"op": "overwrite", "values": sheet_values_with_header(df)}
+                _queue_write(sheet_ws_map[table], sql, len(df), op, base_version, frame_version(df))
+            elif table in sheet_ws_map and not SHEET_WRITE_BEHIND:
                 try:
-                    push_df_to_sheet(sheet_ws_map[table], df)
+                    if all(c in old_columns for c in assignments):
+                        update_sheet_rows(sheet_ws_map[table], df, np.flatnonzero(mask.to_numpy()), list(assignments))
+                    else:
+                        push_df_to_sheet(sheet_ws_map[table], df)
                 except Exception as e:
                     return pd.DataFrame({"affected_rows": [mask.sum()]}), f"Update ok in-memory but failed to push: {e}"
             return pd.DataFrame({"affected_rows": [int(mask.sum())]}), None
 
-        # DELETE FROM <table> WHERE col = value
+        # DELETE FROM <table> [WHERE <predicate>]
         if q_lower.startswith("delete"):
-            m = re.match(r"delete\s+from\s+[`\"]?([a-zA-Z0-9_\- ]+)[`\"]?\s+where\s+(.+)", q, flags=re.I)
-            if not m:
+            tokens = tokenize(q)
+            if len(tokens) < 3 or not is_keyword(tokens[1], "from"):
                 return None, "Unsupported DELETE format."
-            table = m.group(1).strip()
-            where_clause = m.group(2).strip()
-            if table not in df_map:
-                return None, f"Sheet/table '{table}' not found."
+            table_ref, i = _table_ref(q, tokens, 2, ("where",))
+            table = _find_table(df_map, table_ref)
+            if table is None:
+                return None, f"Sheet/table '{table_ref}' not found."
             df = df_map[table]
-            m2 = re.match(r"([a-zA-Z0-9_`\" ]+)\s*=\s*('?\"?)(.+?)\2$", where_clause)
-            if not m2:
-                return None, "Unsupported WHERE clause for DELETE (only simple equality supported)."
-            where_col = m2.group(1).strip().strip("`\"'")
-            where_val = m2.group(3)
-            mask = df[where_col].astype(str) == where_val
-            removed = df[mask].copy()
-            df_map[table] = df.loc[~mask].reset_index(drop=True)
-            if table in sheet_ws_map:
+            base_version = frame_version(df)
+            mask = _where_mask(df, q, tokens, i if i < len(tokens) else None)
+            removed = int(mask.sum())
+            _store(df_map, table, df.loc[~mask].reset_index(drop=True))
+            if engine is not None:
+                engine.apply_delete(table, mask.to_numpy(), df_map[table])
+            if table in sheet_ws_map and SHEET_WRITE_BEHIND and removed:
+                _queue_write(sheet_ws_map[table], sql, len(df),
+                             {"op": "delete", "positions": np.flatnonzero(mask.to_numpy())},
+                             base_version, frame_version(df_map[table]))
+            elif table in sheet_ws_map and not SHEET_WRITE_BEHIND:
                 try:
-                    push_df_to_sheet(sheet_ws_map[table], df_map[table])
+                    delete_sheet_rows(sheet_ws_map[table], np.flatnonzero(mask.to_numpy()))
                 except Exception as e:
-                    return pd.DataFrame({"affected_rows": [len(removed)]}), f"Delete ok in-memory but failed to push: {e}"
-            return pd.DataFrame({"affected_rows": [len(removed)]}), None
+                    return pd.DataFrame({"affected_rows": [removed]}), f"Delete ok in-memory but failed to push: {e}"
+            return pd.DataFrame({"affected_rows": [removed]}), None
 
         return None, "Unsupported SQL operation for Google Sheets handler."
     except Exception as e:
@@ -1,17 +1,34 @@
 # main.py
-import re
+import time
+import uuid
+
 import streamlit as st
 import pandas as pd
-import gspread
-from google.oauth2.service_account import Credentials
 
-from config import SYSTEM_PROMPT_DEFAULT, GSHEET_SERVICE_ACCOUNT_FILE
-from db_utils import connect_mysql, get_mysql_schema
-from gsheets_utils import connect_google_sheet, get_sheet_schema_from_df
-from sql_generator import generate_sql
-from query_executor import run_query
+from config import (SYSTEM_PROMPT_DEFAULT, GSHEET_SERVICE_ACCOUNT_FILE,
+                    SCHEMA_PRUNE_MIN_TABLES, SCHEMA_PRUNE_TOP_K, RESULT_CACHE_ENABLED, EXPLAIN_MODE,
+                    TRACE_METRICS_PORT, QUERY_SERVICE_URL, RESULT_PAGE_SIZE, SHEET_WRITE_BEHIND)
+from db_utils import get_mysql_pool, get_mysql_schema
+from gsheets_utils import open_google_workbook, safe_table_name
+from sql_generator import generate_sql_with_repair, get_sql_cache
+from sql_validator import validate_sql
+from query_executor import stream_query, run_progressive
+from result_cache import get_result_cache
+from explainer import explain_result, EXPLAIN_SAMPLE_ROWS
+from tracing import span, profiled, start_metrics_server
+from sheet_engine import SheetSQLEngine
+from sheet_writer import get_sheet_writer
+from schema_retriever import SchemaIndex, format_schema_context
+from result_store import EXPORT_FORMATS
+from service import ServiceClient, RemoteResult
+from sql_utils import is_single_select
 
 st.set_page_config("Text-to-SQL (Gemini) — MySQL + Google Sheets", layout="wide")
+if TRACE_METRICS_PORT:
+    try:
+        start_metrics_server(TRACE_METRICS_PORT)
+    except OSError as e:
+        st.sidebar.warning(f"Metrics endpoint not started: {e}")
 st.title("Text → SQL Agent (Gemini) • MySQL + Google Sheets")
 
 # Helper to detect change in params
@@ -20,11 +37,257 @@ def params_changed(key_prefix: str, current_params: dict) -> bool:
     stored = st.session_state.get(key_prefix)
     return stored != current_params
 
+def show_trace(trace):
+    """Stage timings of one question, as an indented table plus the profiler report."""
+    rows = []
+    for depth, s in trace.walk():
+        attrs = {k: v for k, v in s.attrs.items() if k != "profile"}
+        rows.append({"stage": "  " * depth + s.name, "ms": round(s.duration * 1000, 1),
+                     "details": ", ".join(f"{k}={v}" for k, v in attrs.items()), "error": s.error or ""})
+    with st.expander(f"Debug: {trace.duration * 1000:.0f} ms total", expanded=False):
+        st.dataframe(pd.DataFrame(rows), hide_index=True)
+        if trace.attrs.get("profile"):
+            st.code(trace.attrs["profile"])
+
+def show_explanation(job):
+    """Stream a background explanation into the page as its tokens arrive."""
+    st.success("Explanation" + (" (cached)" if job.cached else ""))
+    st.write_stream(job.tokens(timeout=120))
+    if job.error:
+        st.warning(f"Could not obtain explanation from Gemini: {job.error}")
+
+@st.fragment
+def show_result_view(store, key: str):
+    """Page through a result held server-side (ResultStore or RemoteResult).
+
+    Only the visible page is sent to the browser; sorting and column choice are
+    applied on the server, and changing them re-runs this fragment only.
+    """
+    order = "(result order)"
+    col1, col2, col3, col4, col5 = st.columns([4, 2, 1, 1, 1])
+    columns = col1.multiselect("Columns", store.columns, default=store.columns, key=f"{key}_columns")
+    sort_by = col2.selectbox("Sort by", [order] + store.columns, key=f"{key}_sort")
+    descending = col3.toggle("Descending", key=f"{key}_desc")
+    page_sizes = sorted({50, 100, 500, 1000, RESULT_PAGE_SIZE})
+    page_size = col4.selectbox("Rows per page", page_sizes, index=page_sizes.index(RESULT_PAGE_SIZE),
+                               key=f"{key}_page_size")
+    pages = store.pages(page_size)
+    page = col5.number_input(f"Page (of {pages:,})", min_value=1, max_value=pages, value=1,
+                            key=f"{key}_page_{page_size}")
+    view = {"columns": columns or None, "sort_by": None if sort_by == order else sort_by,
+            "ascending": not descending}
+    try:
+        with span("render", rows=min(page_size, store.rows)):
+            st.dataframe(store.page(page - 1, page_size, **view))
+    except (RuntimeError, ValueError) as e:
+        st.error(f"Could not load rows: {e}")
+        return
+    first = (page - 1) * page_size
+    st.caption(f"Rows {min(first + 1, store.rows):,}–{min(first + page_size, store.rows):,} of {store.rows:,}")
+    col1, col2 = st.columns([1, 4])
+    fmt = col1.selectbox("Export format", list(EXPORT_FORMATS), key=f"{key}_format", label_visibility="collapsed")
+    if col2.button("Prepare download", key=f"{key}_prepare"):
+        # written batch by batch into a temp file; Streamlit holds the finished file for the download
+        try:
+            with store.spool(fmt, **view) as f:
+                st.download_button(f"Download {fmt.upper()}", f.read(), file_name=f"result.{fmt}",
+                                   mime=EXPORT_FORMATS[fmt], key=f"{key}_download")
+        except (RuntimeError, ValueError) as e:
+            st.error(f"Export failed: {e}")
+
+def _stop_progressive():
+    job = st.session_state.get("progressive_job")
+    if job is not None:
+        job.cancel()
+        st.session_state["progressive_stopped"] = True
+
+
+def _progressive_updates(job, status):
+    """job's updates, polled: the status line is redrawn between polls so a "Stop refining"
+    click interrupts the script (Streamlit only notices reruns at st calls) and cancels the job."""
+    shown, started = 0, time.monotonic()
+    while True:
+        for df in job.updates(timeout=0.5, start=shown):
+            shown += 1
+            yield df
+        if job.done and shown == len(job.stages):
+            status.empty()
+            return
+        status.caption(f"Refining… {time.monotonic() - started:.0f}s")
+
+
+def show_progressive(job, sql: str):
+    """Render each estimate as it arrives, then the exact result (unless stopped)."""
+    header, table, caption, status = st.empty(), st.empty(), st.empty(), st.empty()
+    st.button("Stop refining", key="stop_progressive", on_click=_stop_progressive)
+    for df in _progressive_updates(job, status):
+        header.subheader("Results")
+        estimate = df.attrs.get("approximate")
+        if estimate is None:
+            with table.container():
+                show_result_view(job.store, f"result_{uuid.uuid4().hex[:8]}")
+            caption.caption("Exact result.")
+        else:
+            table.dataframe(df.head(RESULT_PAGE_SIZE))
+            caption.caption(f"Estimate from a {estimate['fraction']:.1%} sample of {estimate['table']} "
+                            f"({estimate['replicates']} subsamples; ± columns are 95% error bars).")
+    if job.error:
+        st.error(f"Execution error: {job.error}")
+    elif job.cancelled and not job.exact:
+        caption.caption(f"Stopped: showing the estimate from a {job.latest.attrs['approximate']['fraction']:.1%} "
+                        f"sample." if job.latest is not None else "Stopped before the first estimate.")
+    if job.note:
+        st.caption(job.note)
+    if job.truncated:
+        st.warning(f"Query stopped early: {job.truncated}")
+    if job.exact:
+        st.session_state["last_result"] = {"sql": sql, "sample": job.latest.head(EXPLAIN_SAMPLE_ROWS)}
+
+
+@st.fragment(run_every=2)
+def show_sheet_writes(status, flush):
+    """Queued Google Sheets writes, refreshed every 2 s; status() lists tabs, flush() writes them now."""
+    try:
+        tabs = [t for t in status() if t["pending"] or t["error"]]
+    except RuntimeError as e:
+        st.caption(f"Sheet write status unavailable: {e}")
+        return
+    if not tabs:
+        return
+    col1, col2 = st.columns([4, 1])
+    col1.caption(f"Sheet writes pending: {sum(t['pending'] for t in tabs)} statement(s) for "
+                 + ", ".join(t["sheet"] for t in tabs))
+    for t in tabs:
+        if t["error"]:
+            retry = f" (retrying in {t['retry_in']:.0f} s)" if t["retry_in"] is not None else ""
+            col1.warning(f"{t['sheet']}: {t['state']}{retry}: {t['error']}")
+    if col2.button("Flush now", key="flush_sheet_writes"):
+        with st.spinner("Writing to Google Sheets…"):
+            if not flush():
+                st.error("Some sheet writes could not be sent; they stay queued and journalled.")
+
 # ---------------- Sidebar -----------------
 with st.sidebar:
     source = st.selectbox("Data source", ["MySQL", "Google Sheets", "Both (MySQL+Sheets)"])
     temperature = st.slider("Generation temperature", 0.0, 1.0, 0.7, 0.05)
     system_prompt = st.text_area("System Prompt", value=SYSTEM_PROMPT_DEFAULT, height=220)
+    explain_modes = {"auto": "Automatic", "on_demand": "On demand", "off": "Off"}
+    explain_mode = st.radio("Result explanation", list(explain_modes.values()),
+                            index=list(explain_modes).index(EXPLAIN_MODE) if EXPLAIN_MODE in explain_modes else 0)
+    progressive = st.checkbox("Progressive estimates", value=False,
+                              help="Aggregate queries on big tables show sampled estimates with error bars first, "
+                                   "then refine to the exact result in the background.")
+    with st.expander("Debug"):
+        show_timings = st.checkbox("Show stage timings", value=False)
+        profile_kind = {"Off": None, "cProfile": "cprofile", "pyinstrument": "pyinstrument"}[
+            st.selectbox("Profile requests", ["Off", "cProfile", "pyinstrument"])]
+    sql_cache = get_sql_cache()
+    st.caption(f"SQL cache: {sql_cache.stats['hits'] + sql_cache.stats['near_hits']} hits, "
+               f"{sql_cache.stats['misses']} misses ({sql_cache.hit_rate():.0%} hit rate)")
+    result_cache = get_result_cache() if RESULT_CACHE_ENABLED else None
+    if result_cache is not None:
+        st.caption(f"Result cache: {result_cache.hit_rate():.0%} hit rate, "
+                   f"{result_cache.stats['bytes_saved'] / 1e6:.1f} MB served from cache, "
+                   f"{result_cache.used_bytes / 1e6:.1f} MB held")
+
+# ---------------- Query service (thin client) -----------------
+# With QUERY_SERVICE_URL set nothing is connected or loaded here: the service
+# keeps connections and schemas, and reruns only re-render this form.
+if QUERY_SERVICE_URL:
+    client = ServiceClient(QUERY_SERVICE_URL, user=st.session_state.setdefault("service_user", uuid.uuid4().hex[:12]))
+    datasource = {}
+    if source in ("MySQL", "Both (MySQL+Sheets)"):
+        st.subheader("MySQL connection")
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            mysql_host = st.text_input("Host", value="localhost", key="svc_mysql_host")
+            mysql_port = st.number_input("Port", value=3306, key="svc_mysql_port")
+        with col2:
+            mysql_user = st.text_input("Username", value="root", key="svc_mysql_user")
+            mysql_password = st.text_input("Password", type="password", key="svc_mysql_password")
+            mysql_db = st.text_input("Database name", key="svc_mysql_db")
+        datasource["mysql"] = {"host": mysql_host, "port": int(mysql_port), "user": mysql_user,
+                               "password": mysql_password, "database": mysql_db}
+    if source in ("Google Sheets", "Both (MySQL+Sheets)"):
+        st.subheader("Google Sheets connection (Service Account)")
+        datasource["sheets"] = {
+            "sheet_name": st.text_input("Google Sheet name", key="svc_gsheet_name"),
+            "sa_path": st.text_input("Service account JSON path (on the service host)",
+                                     value=GSHEET_SERVICE_ACCOUNT_FILE or "", key="svc_gsheet_sa"),
+        }
+    st.caption(f"Queries run on the query service at {QUERY_SERVICE_URL}.")
+    if "sheets" in datasource and SHEET_WRITE_BEHIND:
+        show_sheet_writes(client.writes, lambda: client.flush_writes(timeout=30)["flushed"])
+
+    st.subheader("Ask a question about your data")
+    user_question = st.text_area("Natural language question", height=120)
+    previous = st.session_state.get("service_job")
+    if previous:
+        try:
+            state = client.job(previous)["state"]
+        except RuntimeError:
+            state = "gone"
+        if state in ("queued", "running") and st.button("Cancel running query"):
+            client.cancel(previous)
+            st.info("Query cancelled.")
+    if st.button("Generate & Run"):
+        if not user_question.strip():
+            st.error("Please enter a question.")
+            st.stop()
+        if previous:
+            try:
+                client.cancel(previous)   # a new question replaces the one still running
+            except RuntimeError:
+                pass
+        try:
+            job = client.ask(user_question, source, datasource, wait=0, max_rows=RESULT_PAGE_SIZE,
+                             temperature=temperature, system_prompt=system_prompt)
+            st.session_state["service_job"] = job["id"]
+            status = st.empty()
+            results_header = st.empty()
+            results_table = st.empty()
+            while job["state"] in ("queued", "running"):
+                # a widget change reruns the script at the next st call
+                status.caption(f"Query {job['state']}…")
+                if job.get("result") is not None and job["state"] == "running":
+                    # first chunk is in: show it while the rest streams in on the service
+                    results_header.subheader("Results")
+                    results_table.dataframe(ServiceClient.frame(job))
+                job = client.job(job["id"], wait=1)
+            status.empty()
+        except RuntimeError as e:
+            st.error(f"Query service: {e}")
+            st.stop()
+        if job.get("sql"):
+            st.code(job["sql"], language="sql")
+        for note in job.get("warnings", []):
+            st.caption(f"Validation: {note}")
+        if job["state"] == "cancelled":
+            st.info("Query cancelled.")
+        elif job.get("error"):
+            st.error(job["error"])
+        else:
+            executed_df = ServiceClient.frame(job)
+            if executed_df is None:
+                st.info("Query produced no tabular result.")
+            else:
+                result = job["result"]
+                results_header.subheader("Results")
+                with results_table.container():
+                    show_result_view(RemoteResult(client, job), f"result_{job['id']}")
+                if result.get("cache") == "hit":
+                    st.caption("Served from the result cache (source tables unchanged).")
+                if result.get("truncated"):
+                    st.warning(f"Query stopped: {result['truncated']}")
+                if result.get("statements"):
+                    with st.expander(f"Batch: {len(result['statements'])} round trips"):
+                        st.dataframe(pd.DataFrame(result["statements"]))
+                if explain_mode == "Automatic" and is_single_select(job["sql"]):
+                    show_explanation(explain_result(job["sql"], executed_df))
+        if show_timings and job.get("trace"):
+            with st.expander(f"Debug: {job['trace']['ms']:.0f} ms on the service", expanded=False):
+                st.json(job["trace"])
+    st.stop()
 
 # ---------------- MySQL UI -----------------
 mysql_conn = None
@@ -46,7 +309,8 @@ if source in ("MySQL", "Both (MySQL+Sheets)"):
     if ("mysql_conn" not in st.session_state) or params_changed("mysql_conn_params", mysql_params):
         if st.button("Connect to MySQL"):
             try:
-                conn = connect_mysql(mysql_host, int(mysql_port), mysql_user, mysql_password, mysql_db)
+                # shared process-wide pool; sessions only keep a reference to it
+                conn = get_mysql_pool(mysql_host, int(mysql_port), mysql_user, mysql_password, mysql_db)
                 st.session_state["mysql_conn"] = conn
                 st.session_state["mysql_conn_params"] = mysql_params
                 st.success("Connected to MySQL")
@@ -63,6 +327,10 @@ if source in ("MySQL", "Both (MySQL+Sheets)"):
             mysql_schema = get_mysql_schema(mysql_conn)
             st.info(f"Using saved MySQL connection — {len(mysql_schema)} tables")
             st.write("Tables:", list(mysql_schema.keys()))
+            pool_stats = mysql_conn.stats()
+            st.caption(f"Pool: {pool_stats['open']} open / {pool_stats['idle']} idle, "
+                       f"{pool_stats['checkouts']} checkouts, {pool_stats['waits']} waits "
+                       f"({pool_stats['wait_time']:.2f}s waiting)")
         except Exception:
             # if stored connection invalid, remove it
             st.warning("Saved MySQL connection failed; please reconnect.")
@@ -70,10 +338,7 @@ if source in ("MySQL", "Both (MySQL+Sheets)"):
             st.session_state.pop("mysql_conn_params", None)
 
 # ---------------- Google Sheets UI -----------------
-df_map_sheets = {}
-sheet_ws_map = {}
-gs_df = None
-worksheets = []
+sheet_book = None
 
 if source in ("Google Sheets", "Both (MySQL+Sheets)"):
     st.subheader("Google Sheets connection (Service Account)")
@@ -82,67 +347,65 @@ if source in ("Google Sheets", "Both (MySQL+Sheets)"):
 
     gs_params = {"sheet_name": gsheet_name, "sa_path": sa_path}
 
-    if ("gs_sh" not in st.session_state) or params_changed("gs_params", gs_params):
+    if ("gs_book" not in st.session_state) or params_changed("gs_params", gs_params):
         if st.button("Connect to Google Sheet"):
             try:
-                sh, ws, df = connect_google_sheet(sa_path, gsheet_name)
-                st.session_state["gs_sh"] = sh
-                st.session_state["gs_ws"] = ws
-                st.session_state["gs_df"] = df
+                book = open_google_workbook(sa_path, gsheet_name)
+                titles = book.titles()
+                st.session_state["gs_book"] = book
                 st.session_state["gsheet_name"] = gsheet_name
                 st.session_state["gsheet_sa_path"] = sa_path
                 st.session_state["gs_params"] = gs_params
                 st.success("Connected to Google Sheet")
-                worksheets = sh.worksheets()
-                st.info(f"Total worksheets: {len(worksheets)}")
-                st.write("Worksheet names:", [w.title for w in worksheets])
-                st.dataframe(df.head(10))
+                st.info(f"Total worksheets: {len(titles)}")
+                st.write("Worksheet names:", titles)
+                if titles:
+                    st.dataframe(book.frame(titles[0]).head(10))
+                sheet_book = book
             except Exception as e:
                 st.error(f"Google Sheets connect failed: {e}")
     else:
-        # reuse
-        sh = st.session_state.get("gs_sh")
-        ws = st.session_state.get("gs_ws")
-        df = st.session_state.get("gs_df")
-        if df is not None and not df.empty:
-            st.info(f"Using saved Google Sheet connection — sheet: {st.session_state.get('gsheet_name')}")
-            try:
-                worksheets = sh.worksheets()
-                st.info(f"Total worksheets: {len(worksheets)}")
-                st.write("Worksheet names:", [w.title for w in worksheets])
-                st.dataframe(df.head(10))
-            except Exception:
-                st.warning("Saved Google sheet connection seems invalid; please reconnect.")
-                for k in ["gs_sh", "gs_ws", "gs_df", "gsheet_name", "gs_params", "gsheet_sa_path"]:
-                    st.session_state.pop(k, None)
-
-# Map df and ws for pandasql handlers (only if df loaded)
-if "gs_df" in st.session_state and st.session_state["gs_df"] is not None:
-    gs_df = st.session_state["gs_df"]
-    sheet_name = st.session_state.get("gsheet_name", "Sheet1")
-    safe_name = re.sub(r'\W|^(?=\d)', '_', sheet_name)
-    df_map_sheets[safe_name] = gs_df.copy()
-    df_map_sheets[sheet_name] = gs_df.copy()
-    # prepare sheet_ws_map using worksheet object for pushing updates
-    ws_obj = st.session_state.get("gs_ws")
-    if ws_obj:
-        sheet_ws_map[sheet_name] = ws_obj
-        sheet_ws_map[safe_name] = ws_obj
+        # reuse; worksheet list and loaded tabs are cached on the workbook
+        book = st.session_state.get("gs_book")
+        st.info(f"Using saved Google Sheet connection — sheet: {st.session_state.get('gsheet_name')}")
+        try:
+            titles = book.titles()
+            st.info(f"Total worksheets: {len(titles)}")
+            st.write("Worksheet names:", titles)
+            if titles:
+                st.dataframe(book.frame(titles[0]).head(10))
+            sheet_book = book
+        except Exception:
+            st.warning("Saved Google sheet connection seems invalid; please reconnect.")
+            for k in ["gs_book", "gsheet_name", "gs_params", "gsheet_sa_path"]:
+                st.session_state.pop(k, None)
+    if sheet_book is not None and SHEET_WRITE_BEHIND:
+        sheet_writer = get_sheet_writer()
+        spreadsheet_id = sheet_book.sh.id
+        show_sheet_writes(lambda: [t for t in sheet_writer.status() if t["spreadsheet"] == spreadsheet_id],
+                          lambda: sheet_writer.flush(timeout=30, spreadsheet=spreadsheet_id))
 
 # ---------------- Schema context -----------------
-schema_context = ""
-if mysql_schema:
-    for t, cols in mysql_schema.items():
-        schema_context += f"Table: {t}\n"
-        for c in cols:
-            schema_context += f"  - {c['name']} ({c['type']})\n"
-
-if gs_df is not None:
-    sheet_schema = get_sheet_schema_from_df(gs_df, st.session_state.get("gsheet_name", "Sheet1"))
-    for t, cols in sheet_schema.items():
-        schema_context += f"Table: {t}\n"
-        for c in cols:
-            schema_context += f"  - {c['name']} ({c['type']})\n"
+full_schema = dict(mysql_schema) if mysql_schema else {}
+schema_samples = {}
+
+if sheet_book is not None:
+    full_schema.update(sheet_book.schema())
+    for sheet_table, sheet_df in sheet_book.frames.items():
+        head = sheet_df.head(50)
+        schema_samples[sheet_table] = {
+            c: [str(v) for v in head[c].dropna().unique()[:5]] for c in head.columns if pd.api.types.is_string_dtype(head[c].dtype)
+        }
+
+schema_context = format_schema_context(full_schema)
+
+# Index the schema once per distinct schema; reruns reuse it from session_state
+schema_index = None
+if len(full_schema) > SCHEMA_PRUNE_MIN_TABLES:
+    if st.session_state.get("schema_index_key") != schema_context:
+        st.session_state["schema_index"] = SchemaIndex(full_schema, schema_samples)
+        st.session_state["schema_index_key"] = schema_context
+    schema_index = st.session_state["schema_index"]
 
 # ---------------- Query & Run -----------------
 st.subheader("Ask a question about your data")
@@ -152,54 +415,147 @@ if st.button("Generate & Run"):
     if not user_question.strip():
         st.error("Please enter a question.")
     else:
-        # generate SQL
-        st.info("Generating SQL with Gemini...")
-        sql = generate_sql(user_question, schema_context, system_prompt, temperature)
-        st.code(sql, language="sql")
+        with span("question", source=source) as trace, profiled(profile_kind, trace):
+            # generate SQL against the relevant slice of the schema
+            prompt_schema = schema_context
+            if schema_index is not None:
+                with span("schema.prune", tables=len(full_schema)):
+                    relevant = schema_index.select(user_question, k=SCHEMA_PRUNE_TOP_K)
+                if relevant:
+                    prompt_schema = format_schema_context(full_schema, relevant)
+                    st.caption(f"Schema pruned to {len(relevant)} of {len(full_schema)} tables "
+                               f"(~{len(schema_context) // 4} → ~{len(prompt_schema) // 4} tokens)")
+            sheet_schema = {}
+            if sheet_book is not None:
+                for title, cols in sheet_book.schema().items():
+                    sheet_schema[title] = sheet_schema[safe_table_name(title)] = cols
+            sheet_engine = st.session_state.setdefault("sheet_engine", SheetSQLEngine())
 
-        # execute
-        executed_df, exec_error = run_query(source, st.session_state.get("mysql_conn"), df_map_sheets, sheet_ws_map, sql)
+            def validate(candidate):
+                # only the tabs the SQL references are downloaded
+                maps = sheet_book.table_maps(sheet_book.tables_in_sql(candidate))[0] if sheet_book is not None else {}
+                return validate_sql(candidate, source, mysql_schema, sheet_schema,
+                                    st.session_state.get("mysql_conn"), maps, sheet_engine)
 
-        if exec_error:
-            st.error(f"Execution error: {exec_error}")
-        else:
-            if executed_df is None:
-                st.info("Query produced no tabular result.")
+            st.info("Generating SQL with Gemini...")
+            sql, check = generate_sql_with_repair(user_question, prompt_schema, validate, system_prompt, temperature)
+            st.code(sql, language="sql")
+            if check is None:
+                st.error(sql)
+                st.stop()
+            if check.repairs:
+                st.caption(f"SQL repaired after {check.repairs} failed validation(s).")
+            for note in check.warnings:
+                st.caption(f"Validation: {note}")
+            if check.errors:
+                st.error("SQL failed validation:\n" + "\n".join(f"- {e}" for e in check.errors))
+                st.stop()
+            if check.rejected:
+                st.error(check.rejected)
+                st.stop()
+            if check.sql != sql.strip().rstrip(';').strip():
+                sql = check.sql
+                st.code(sql, language="sql")
+            if check.rows_examined is not None:
+                st.caption(f"EXPLAIN estimate: ~{check.rows_examined:,.0f} rows examined")
+
+            # execute; the first chunk is rendered while the rest streams in
+            df_map_sheets, sheet_ws_map = {}, {}
+            if sheet_book is not None:
+                df_map_sheets, sheet_ws_map = sheet_book.table_maps(sheet_book.tables_in_sql(sql))
+            st.session_state.pop("last_result", None)
+            if progressive and is_single_select(sql):
+                job = run_progressive(source, st.session_state.get("mysql_conn"), df_map_sheets, sheet_ws_map, sql,
+                                      sheet_engine, result_cache)
+                previous = st.session_state.get("progressive_job")
+                if previous is not None:
+                    previous.cancel()
+                st.session_state["progressive_job"] = job
+                show_progressive(job, sql)
             else:
-                st.subheader("Results")
-                st.dataframe(executed_df)
-
-                # If we changed sheets in-memory, already pushed in gsheets_utils; but update session_state df snapshot
-                # Refresh session_state gs_df if sheet name is present
-                current_sheet = st.session_state.get("gsheet_name")
-                if current_sheet and current_sheet in df_map_sheets:
-                    st.session_state["gs_df"] = df_map_sheets[current_sheet]
-
-                # Ask Gemini for brief explanation (safe)
-                try:
-                    explanation = None
-                    # Reuse generate_sql's model? Keep simple: small prompt to Gemini (but it might hit quota)
-                    # Use generate_sql wrapper with low temperature; it returns error string if quota issue
-                    explain_prompt = f"""You are a data analyst. The user ran this SQL:
-{sql}
-
-Here are up to first 10 rows (CSV):
-{executed_df.head(10).to_csv(index=False)}
-
-Provide a short (2-4 sentence) plain-English summary of what the results show. Return only the summary."""
-                    explanation = generate_sql(explain_prompt, "", system_prompt, temperature=0.2)
-                    if explanation.startswith("-- ERROR:"):
-                        st.warning("Could not obtain explanation from Gemini: " + explanation)
+                result = stream_query(source, st.session_state.get("mysql_conn"), df_map_sheets, sheet_ws_map, sql,
+                                      sheet_engine, result_cache)
+                results_header = st.empty()
+                results_table = st.empty()
+                explanation_job = None
+                is_select = is_single_select(sql)
+                # chunks land in result.store; only the first page goes to the browser
+                for chunk in result:
+                    if result.store.rows == len(chunk):   # first chunk
+                        results_header.subheader("Results")
+                        with span("render", rows=min(len(chunk), RESULT_PAGE_SIZE)):
+                            results_table.dataframe(chunk.head(RESULT_PAGE_SIZE))
+                        # the explanation only needs the first rows: start it while the rest streams in
+                        if is_select and explain_mode == "Automatic" and not result.error:
+                            explanation_job = explain_result(sql, chunk)
+                exec_error = result.error
+                store = result.store if result.store.columns else None
+
+                if exec_error:
+                    st.error(f"Execution error: {exec_error}")
+                    if explanation_job is not None:
+                        explanation_job.cancel()
+                else:
+                    if store is None:
+                        st.info("Query produced no tabular result.")
                     else:
-                        st.success("Explanation")
-                        st.write(explanation)
-                except Exception as e:
-                    st.warning(f"Could not obtain explanation: {e}")
+                        results_header.subheader("Results")
+                        with results_table.container():
+                            show_result_view(store, f"result_{uuid.uuid4().hex[:8]}")
+                        if store.attrs.get("result_cache") == "hit":
+                            st.caption("Served from the result cache (source tables unchanged).")
+                        if result.truncated:
+                            st.warning(f"Showing the first {store.rows} rows; query stopped: {result.truncated}")
+                        if store.attrs.get("federated_plan"):
+                            with st.expander("Federated plan"):
+                                st.code(store.attrs["federated_plan"], language="sql")
+                        batch = store.attrs.get("batch")
+                        if batch is not None:
+                            with st.expander(f"Batch: {len(batch.statements)} round trips, one transaction"):
+                                st.dataframe(batch.summary())
+                                for position, frame in batch.frames.items():
+                                    st.caption(f"Statement {batch.statements[position]['statement']}: {len(frame)} rows")
+                                    st.dataframe(frame.head(RESULT_PAGE_SIZE))
+
+                        # If we changed sheets in-memory, already pushed (or queued) in gsheets_utils; keep the workbook in sync
+                        if sheet_book is not None and not is_select:
+                            for title in sheet_book.titles():
+                                if title in df_map_sheets:
+                                    sheet_book.set_frame(title, df_map_sheets[title])
+                            if SHEET_WRITE_BEHIND and df_map_sheets:
+                                st.caption("Sheet changes are queued and written to Google Sheets in the background.")
+
+                        if is_select:
+                            st.session_state["last_result"] = {"sql": sql, "sample": store.head(EXPLAIN_SAMPLE_ROWS)}
+                        if explanation_job is not None:
+                            show_explanation(explanation_job)
+                            st.session_state["last_result"]["explained"] = True
+        if show_timings:
+            show_trace(trace)
+
+# "Stop refining" reruns the script: keep the stopped query's last estimate on screen
+stopped_job = st.session_state.get("progressive_job")
+if st.session_state.pop("progressive_stopped", False) and stopped_job is not None:
+    st.code(stopped_job.sql, language="sql")
+    show_progressive(stopped_job, stopped_job.sql)
+
+# Deferred explanation of the last result (survives the rerun the button triggers)
+last_result = st.session_state.get("last_result")
+if last_result and explain_mode == "On demand" and not last_result.get("explained"):
+    if st.button("Explain last result"):
+        st.code(last_result["sql"], language="sql")
+        show_explanation(explain_result(last_result["sql"], last_result["sample"]))
 
 st.markdown("---")
 st.markdown("**Notes & limitations**")
 st.markdown("""
-- Google Sheets write-back overwrites the sheet with current DataFrame contents. Use caution.
-- INSERT/UPDATE/DELETE support for Sheets uses simple parsing and supports common simple cases.
+- Google Sheets write-back sends only the appended, changed or deleted rows. Use caution.
+- Sheets writes are queued: a tab's changes go out together a couple of seconds later (SHEET_WRITE_DELAY), are retried on quota errors and journalled on disk until they land.
+- Several MySQL statements separated by ';' run as one transaction and are rolled back together on an error; MySQL commits implicitly around DDL (CREATE, ALTER), so those cannot be undone. Sheets run one statement at a time.
+- INSERT/UPDATE/DELETE for Sheets accept literal values with AND/OR/NOT, comparisons, IN, LIKE, BETWEEN, IS NULL and UPPER()/LOWER() in WHERE.
 - Gemini generation may be rate-limited by Google Cloud quotas; the app surfaces errors from the API instead of crashing.
+- Generated SQL is validated before it runs (tables, columns, statement types per source, MySQL EXPLAIN cost); validation errors are sent back to Gemini for up to VALIDATE_REPAIR_ATTEMPTS fixes.
+- Results stay on the server: the table shows one page at a time, sorting and column choice happen server-side, and CSV/Parquet exports are written in batches.
+- Progressive estimates (sidebar) cover single-table-sampled aggregates (COUNT, SUM, AVG, MIN, MAX; no DISTINCT or HAVING) on tables of at least SAMPLE_MIN_ROWS rows; MySQL samples primary-key ranges, so the table needs an integer key. Other queries run exactly.
+- Result explanations use a separate short prompt, start as soon as the first rows arrive and are cached per (SQL, rows); set the sidebar option to "On demand" or "Off" to save quota.
 """)
@@ -0,0 +1,438 @@
+# mocks.py
+"""Offline stand-ins for external services, used by the batch CLI and benchmarks."""
+import asyncio
+import hashlib
+import re
+import threading
+import time
+
+
+class _MockResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class MockModel:
+    """Deterministic stand-in for genai.GenerativeModel.
+
+    Answers with a SELECT derived from the question (or a canned summary for
+    explanation prompts). The first token arrives after `latency` seconds plus
+    `prompt_latency` per 1000 prompt characters, and each further word takes
+    `token_latency`; stream=True yields the words as
+    they are produced. Every `quota_every`-th call fails with a 429-style
+    error (0 disables). `responder(question)` replaces the default SQL answer.
+    """
+
+    def __init__(self, latency: float = 0.05, quota_every: int = 0, retry_seconds: int = 1,
+                 token_latency: float = 0.0, responder=None, prompt_latency: float = 0.0):
+        self.latency = latency
+        self.prompt_latency = prompt_latency
+        self.responder = responder
+        self.token_latency = token_latency
+        self.quota_every = quota_every
+        self.retry_seconds = retry_seconds
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _answer(self, contents: str) -> str:
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.quota_every and calls % self.quota_every == 0:
+            raise RuntimeError(f"429 Resource has been exhausted (e.g. check quota). "
+                               f"retry_delay {{ seconds: {self.retry_seconds} }}")
+        if "Summary:" in contents or "Return only the summary." in contents:
+            return ("The query returns the requested rows; the sample shows the main values "
+                    "per group and no unexpected gaps.")
+        m = re.search(r"Question:\s*(.+?)\s*Return only", contents, flags=re.S)
+        question = m.group(1) if m else contents
+        if self.responder is not None:
+            return f"```sql\n{self.responder(question)};\n```"
+        tables = re.findall(r"^Table: (\S+)", contents, flags=re.M)
+        table = tables[int(hashlib.md5(question.encode()).hexdigest(), 16) % len(tables)] if tables else "dual"
+        return f"```sql\nSELECT * FROM {table} LIMIT 10;\n```"
+
+    def _first_token_delay(self, contents) -> float:
+        return self.latency + self.prompt_latency * len(str(contents)) / 1000
+
+    def generate_content(self, contents, generation_config=None, stream=False):
+        time.sleep(self._first_token_delay(contents))
+        words = re.findall(r"\S+\s*", self._answer(contents))
+        if stream:
+            return self._stream(words)
+        time.sleep(self.token_latency * max(len(words) - 1, 0))
+        return _MockResponse("".join(words))
+
+    def _stream(self, words):
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_latency)
+            yield _MockResponse(word)
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False):
+        await asyncio.sleep(self._first_token_delay(contents))
+        text = self._answer(contents)
+        await asyncio.sleep(self.token_latency * max(len(text.split()) - 1, 0))
+        return _MockResponse(text)
+
+
+def _a1_to_rowcol(cell: str):
+    m = re.match(r"([A-Z]+)(\d+)", cell.upper())
+    col = 0
+    for ch in m.group(1):
+        col = col * 26 + ord(ch) - 64
+    return int(m.group(2)), col
+
+
+class FakeSpreadsheet:
+    """Holds FakeWorksheets and handles the spreadsheet-level calls used by gsheets_utils.
+
+    `requests` counts spreadsheet-level reads (worksheet list, values_batch_get);
+    batch_update is counted on the worksheets it touches.
+    """
+
+    def __init__(self, title: str = "Fake", spreadsheet_id: str = "fake-spreadsheet"):
+        self.title = title
+        self.id = spreadsheet_id
+        self.lastUpdateTime = "1970-01-01T00:00:00.000Z"
+        self.requests = 0
+        self._worksheets = []
+
+    def add(self, ws: "FakeWorksheet") -> "FakeWorksheet":
+        ws.spreadsheet = self
+        ws.id = len(self._worksheets)
+        self._worksheets.append(ws)
+        return ws
+
+    def worksheets(self):
+        self.requests += 1
+        return list(self._worksheets)
+
+    def worksheet(self, title: str):
+        for ws in self._worksheets:
+            if ws.title == title:
+                return ws
+        raise KeyError(title)
+
+    @property
+    def sheet1(self):
+        return self._worksheets[0]
+
+    @staticmethod
+    def _parse_range(rng: str):
+        """(title, row part) of an A1 range; like the API, a quote inside a quoted title must be doubled."""
+        if not rng.startswith("'"):
+            title, _, part = rng.partition("!")
+            if "'" in title:
+                raise ValueError(f"Unable to parse range: {rng}")
+            return title, part
+        title, i = "", 1
+        while i < len(rng):
+            if rng[i] == "'":
+                if rng[i + 1:i + 2] != "'":
+                    break
+                i += 1
+            title += rng[i]
+            i += 1
+        rest = rng[i + 1:]
+        if i >= len(rng) or (rest and not rest.startswith("!")):
+            raise ValueError(f"Unable to parse range: {rng}")
+        return title, rest[1:]
+
+    def values_batch_get(self, ranges):
+        """Supports the "'Title'" and "'Title'!1:1" ranges SheetWorkbook asks for."""
+        self.requests += 1
+        out = []
+        for rng in ranges:
+            title, part = self._parse_range(rng)
+            values = self.worksheet(title).values
+            if part:
+                first, _, last = part.partition(":")
+                values = values[int(first) - 1:int(last or first)]
+            out.append({"range": rng, "values": [list(r) for r in values]})
+        return {"spreadsheetId": self.id, "valueRanges": out}
+
+    def batch_update(self, body):
+        touched = set()
+        for req in body.get("requests", []):
+            rng = req["deleteDimension"]["range"]
+            ws = self._worksheets[rng["sheetId"]]
+            del ws.values[rng["startIndex"]:rng["endIndex"]]
+            ws.rows_deleted += rng["endIndex"] - rng["startIndex"]
+            touched.add(rng["sheetId"])
+        for sheet_id in touched:
+            self._worksheets[sheet_id].requests += 1
+        return {}
+
+
+class FakeWorksheet:
+    """In-memory gspread.Worksheet stand-in that counts API requests and cells written."""
+
+    def __init__(self, values=None, title: str = "Sheet1", row_count: int = 1000, col_count: int = 26):
+        self.values = [list(r) for r in (values or [])]
+        self.title = title
+        self.id = 0
+        self.spreadsheet = None
+        self._row_count = row_count
+        self._col_count = col_count
+        self.requests = 0
+        self.reads = 0
+        self.cells_written = 0
+        self.rows_deleted = 0
+
+    @property
+    def row_count(self):
+        return max(self._row_count, len(self.values))
+
+    @property
+    def col_count(self):
+        return max([self._col_count] + [len(r) for r in self.values])
+
+    def _write(self, row: int, col: int, block):
+        for i, vals in enumerate(block):
+            r = row - 1 + i
+            while len(self.values) <= r:
+                self.values.append([])
+            line = self.values[r]
+            while len(line) < col - 1 + len(vals):
+                line.append("")
+            line[col - 1:col - 1 + len(vals)] = [str(v) for v in vals]
+            self.cells_written += len(vals)
+
+    def get_all_values(self):
+        self.requests += 1
+        self.reads += 1
+        return [list(r) for r in self.values]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, r + [""] * (len(header) - len(r)))) for r in values[1:]]
+
+    def clear(self):
+        self.requests += 1
+        self.values = []
+
+    def update(self, values, range_name: str = "A1"):
+        self.requests += 1
+        row, col = _a1_to_rowcol(range_name.split(":")[0])
+        self._write(row, col, values)
+
+    def batch_update(self, data):
+        self.requests += 1
+        for item in data:
+            row, col = _a1_to_rowcol(item["range"].split(":")[0])
+            self._write(row, col, item["values"])
+
+    def batch_clear(self, ranges):
+        self.requests += 1
+        for rng in ranges:
+            start, _, end = rng.partition(":")
+            r1, c1 = _a1_to_rowcol(start)
+            r2, c2 = _a1_to_rowcol(end or start)
+            for r in range(r1 - 1, min(r2, len(self.values))):
+                line = self.values[r]
+                for c in range(c1 - 1, min(c2, len(line))):
+                    line[c] = ""
+        while self.values and not any(self.values[-1]):
+            self.values.pop()
+
+    def append_rows(self, values, **kwargs):
+        self.requests += 1
+        self._write(len(self.values) + 1, 1, values)
+
+    def delete_rows(self, start_index: int, end_index: int = None):
+        self.requests += 1
+        end_index = end_index or start_index
+        del self.values[start_index - 1:end_index]
+        self.rows_deleted += end_index - start_index + 1
+
+
+# MySQL schema statements the stand-in answers from sqlite_master/pragmas, keyed
+# by the table they read; DESCRIBE is handled separately (it names a table).
+_SCHEMA_QUERIES = [
+    (re.compile(r"^\s*SHOW\s+TABLES\s*$", re.I),
+     "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"),
+    (re.compile(r"information_schema\.COLUMNS", re.I),
+     "SELECT m.name, p.name, COALESCE(NULLIF(p.type, ''), 'TEXT'),"
+     " CASE WHEN p.\"notnull\" THEN 'NO' ELSE 'YES' END, CASE WHEN p.pk THEN 'PRI' ELSE '' END"
+     " FROM sqlite_master m JOIN pragma_table_info(m.name) p"
+     " WHERE m.type = 'table' ORDER BY m.name, p.cid"),
+    (re.compile(r"information_schema\.STATISTICS", re.I),
+     "SELECT m.name, il.name, ii.name, NOT il.\"unique\""
+     " FROM sqlite_master m JOIN pragma_index_list(m.name) il JOIN pragma_index_info(il.name) ii"
+     " WHERE m.type = 'table' ORDER BY m.name, il.name, ii.seqno"),
+    (re.compile(r"information_schema\.KEY_COLUMN_USAGE", re.I),
+     "SELECT m.name, f.\"from\", f.\"table\", f.\"to\""
+     " FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f WHERE m.type = 'table'"),
+    (re.compile(r"CRC32\(TABLE_NAME\).*information_schema\.TABLES", re.I | re.S),
+     "SELECT COUNT(*), (SELECT schema_version FROM pragma_schema_version), NULL, total(length(name))"
+     " FROM sqlite_master WHERE type = 'table'"),
+]
+_DESCRIBE_RE = re.compile(r"^\s*(?:DESCRIBE|DESC)\s+`?([^`\s]+)`?\s*$", re.I)
+
+
+def _translate_schema_query(query: str):
+    m = _DESCRIBE_RE.match(query)
+    if m:
+        return ("SELECT name, COALESCE(NULLIF(type, ''), 'TEXT'),"
+                " CASE WHEN \"notnull\" THEN 'NO' ELSE 'YES' END,"
+                " CASE WHEN pk THEN 'PRI' ELSE '' END, dflt_value, ''"
+                " FROM pragma_table_info(?)"), (m.group(1),)
+    for pattern, sql in _SCHEMA_QUERIES:
+        if pattern.search(query):
+            return sql, ()
+    return None
+
+
+_DDL = re.compile(r"\s*(CREATE|ALTER|DROP|RENAME|TRUNCATE)\b(?!\s+TEMPORARY\b)", re.IGNORECASE)
+
+
+class _StandInCursor:
+    def __init__(self, cursor, conn):
+        self._cursor = cursor
+        self._conn = conn
+
+    def execute(self, query, params=None):
+        self._conn._round_trip()
+        translated = _translate_schema_query(query)
+        if translated:
+            query, params = translated
+        ddl = _DDL.match(query) is not None
+        if ddl:
+            self._conn._db.commit()   # like MySQL: DDL commits the open transaction first
+        self._cursor.execute(query, params or ())
+        if ddl:
+            self._conn._db.commit()
+
+    def executemany(self, query, seq):
+        self._conn._round_trip()
+        self._cursor.executemany(query, seq)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        self._conn.rows_fetched += row is not None
+        return row
+
+    def fetchmany(self, size=1):
+        rows = self._cursor.fetchmany(size)
+        self._conn.rows_fetched += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._conn.rows_fetched += len(rows)
+        return rows
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def with_rows(self):
+        return self._cursor.description is not None
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class _StandInSibling:
+    """Second session on a SQLiteMySQLStandIn; only understands KILL QUERY."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, **kwargs):
+        return self
+
+    def execute(self, query, params=None):
+        m = re.fullmatch(r"\s*KILL\s+QUERY\s+(\d+)\s*", query, re.IGNORECASE)
+        if not m:
+            raise NotImplementedError(f"stand-in sibling only runs KILL QUERY: {query!r}")
+        self._conn._round_trip()
+        self._conn.kills.append(int(m.group(1)))
+        self._conn._db.interrupt()
+
+    def close(self):
+        pass
+
+
+class SQLiteMySQLStandIn:
+    """sqlite3 connection dressed up as a mysql.connector connection for offline runs.
+
+    Covers what db_utils uses for executing queries (cursor(buffered=...),
+    commit/rollback with MySQL's implicit commit around DDL, ping,
+    connection_id), plus the schema statements
+    get_mysql_schema and the old SHOW TABLES/DESCRIBE loop send (other
+    information_schema queries are not emulated). round_trips counts the requests a
+    server would see (execute, executemany, commit, rollback, ping), each
+    delayed by latency seconds to stand in for the network; rows_fetched counts
+    the result rows sent back. open_sibling() gives QueryStream the second
+    session it sends KILL QUERY on; kills records the thread ids it killed.
+    """
+
+    def __init__(self, path: str = ":memory:", latency: float = 0.0):
+        import sqlite3
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self.server_host = "sqlite"
+        self.server_port = 0
+        self.user = "standin"
+        self.database = path
+        self.connection_id = 1
+        self.latency = latency
+        self.round_trips = 0
+        self.rows_fetched = 0
+        self.kills: list = []
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    @property
+    def in_transaction(self):
+        return self._db.in_transaction
+
+    def cursor(self, buffered=None, **kwargs):
+        return _StandInCursor(self._db.cursor(), self)
+
+    def commit(self):
+        self._round_trip()
+        self._db.commit()
+
+    def rollback(self):
+        self._round_trip()
+        self._db.rollback()
+
+    def ping(self, reconnect=False):
+        self._round_trip()
+        self._db.execute("SELECT 1")
+
+    def is_connected(self):
+        return True
+
+    def consume_results(self):
+        pass
+
+    def close(self):
+        self._db.close()
+
+    def open_sibling(self):
+        return _StandInSibling(self)
+
+    def load_frame(self, table: str, df):
+        df.to_sql(table, self._db, index=False, if_exists="replace")
+
+    def schema(self):
+        """{table: [{name,type}, ...]} in get_mysql_schema's shape."""
+        out = {}
+        for (table,) in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'"):
+            cols = self._db.execute(f'PRAGMA table_info("{table}")').fetchall()
+            out[table] = [{"name": c[1], "type": c[2] or "TEXT"} for c in cols]
+        return out
@@ -1,25 +1,257 @@
 # query_executor.py
-from db_utils import execute_mysql_query
-from gsheets_utils import execute_sheet_sql_on_df
+import pandas as pd
 
-def run_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql):
-    """
-    Run SQL against selected source. Returns (df, error)
-    sheet_ws_map: mapping used when running against Sheets (to push updates)
-    """
+from db_utils import execute_mysql_query, get_mysql_schema, mysql_table_versions, QueryStream
+from gsheets_utils import execute_sheet_sql_on_df, frame_version
+from federated import route_tables, run_federated
+from approximate import start_progressive
+from result_cache import cacheable_tables
+from result_store import ResultStore
+from sql_utils import referenced_tables, is_single_select
+from tracing import span
+
+def _run_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine=None):
     if source == "MySQL":
         return execute_mysql_query(mysql_conn, sql)
 
     if source == "Google Sheets":
-        return execute_sheet_sql_on_df(df_map_sheets, sql, sheet_ws_map)
+        return execute_sheet_sql_on_df(df_map_sheets, sql, sheet_ws_map, sheet_engine)
 
     if source == "Both (MySQL+Sheets)":
-        # try mysql first
+        # route by where the referenced tables live instead of trying MySQL blindly
+        mysql_schema = get_mysql_schema(mysql_conn) if mysql_conn else {}
+        try:
+            route = route_tables(sql, set(mysql_schema), set(df_map_sheets))
+        except ValueError:
+            route = "unknown"
+        if route == "mysql":
+            return execute_mysql_query(mysql_conn, sql)
+        if route == "sheets":
+            return execute_sheet_sql_on_df(df_map_sheets, sql, sheet_ws_map, sheet_engine)
+        if route == "federated":
+            if not is_single_select(sql):
+                return None, "Statements that modify data must target a single source."
+            return run_federated(sql, mysql_conn, mysql_schema, df_map_sheets)
+        # unknown tables: try mysql first, then the sheets
         if mysql_conn:
             df, err = execute_mysql_query(mysql_conn, sql)
             if err is None:
                 return df, None
             # else try sheets fallback
-        return execute_sheet_sql_on_df(df_map_sheets, sql, sheet_ws_map)
+        return execute_sheet_sql_on_df(df_map_sheets, sql, sheet_ws_map, sheet_engine)
 
     return None, "Invalid data source"
+
+
+def _match_name(name, names):
+    lowered = {n.lower(): n for n in names}
+    return lowered.get(name.lower())
+
+
+def _result_cache_key(result_cache, source, mysql_conn, df_map_sheets, sql):
+    """(key, tables) for a cacheable SELECT, or (None, None).
+
+    Every referenced table needs a data version: sheet frames carry one in
+    df.attrs, MySQL tables get one from information_schema. Tables found in
+    neither source make the query uncacheable.
+    """
+    tables = cacheable_tables(sql)
+    if not tables:
+        return None, None
+    if source == "MySQL":
+        mysql_names = set()  # everything runs on MySQL
+    elif source == "Both (MySQL+Sheets)" and mysql_conn is not None:
+        mysql_names = set(get_mysql_schema(mysql_conn))  # same precedence as route_tables
+    else:
+        mysql_names = None
+    versions, mysql_tables = {}, []
+    for name in tables:
+        if mysql_names is not None and (source == "MySQL" or _match_name(name, mysql_names)):
+            mysql_tables.append(name)
+        elif source != "MySQL" and _match_name(name, df_map_sheets):
+            versions[name] = ("sheet", frame_version(df_map_sheets[_match_name(name, df_map_sheets)]))
+        else:
+            return None, None
+    if mysql_tables:
+        found = mysql_table_versions(mysql_conn, mysql_tables)
+        if found is None:
+            return None, None
+        versions.update({t: ("mysql",) + v for t, v in found.items()})
+    return result_cache.make_key(sql, source, versions), tables
+
+
+def _invalidate_written(result_cache, df_map_sheets, sql):
+    """Eagerly drop cached results that read the tables a mutation wrote.
+
+    Table versions already change on every write, so this only frees memory early.
+    """
+    try:
+        written = [r.name for r in referenced_tables(sql)]
+    except ValueError:
+        return
+    names = set(written)
+    for name in written:
+        match = _match_name(name, df_map_sheets)
+        if match is not None:
+            # other names (title / safe name) bound to the same sheet
+            names.update(n for n, df in df_map_sheets.items() if df is df_map_sheets[match])
+    result_cache.invalidate_tables(names)
+
+
+def run_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine=None, result_cache=None):
+    """
+    Run SQL against selected source. Returns (df, error)
+    sheet_ws_map: mapping used when running against Sheets (to push updates)
+    sheet_engine: persistent SheetSQLEngine holding the sheet tables, if any
+    result_cache: ResultCache consulted for deterministic SELECTs; a hit is
+    returned with df.attrs["result_cache"] == "hit"
+    """
+    with span("execute", source=source, result_cache="off" if result_cache is None else "miss") as s:
+        df, err = _run_query_cached(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine,
+                                    result_cache, s)
+        if df is not None:
+            s.set(rows=len(df))
+        s.error = err
+        return df, err
+
+
+def _run_query_cached(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine, result_cache, s):
+    if result_cache is None:
+        return _run_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine)
+    key, tables = _result_cache_key(result_cache, source, mysql_conn, df_map_sheets, sql)
+    if key is not None:
+        cached = result_cache.get(key)
+        if cached is not None:
+            cached.attrs["result_cache"] = "hit"
+            s.set(result_cache="hit")
+            return cached, None
+    else:
+        s.set(result_cache="uncacheable")
+    df, err = _run_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine)
+    if key is not None:
+        if err is None and df is not None and not df.attrs.get("truncated"):
+            result_cache.put(key, df, tables)
+    elif not is_single_select(sql):
+        _invalidate_written(result_cache, df_map_sheets, sql)
+    return df, err
+
+
+class _SingleResult:
+    """QueryStream-compatible wrapper around a (df, error) result."""
+
+    def __init__(self, df, error):
+        self.df = df
+        self.error = error
+        self.truncated = df.attrs.get("truncated") if df is not None else None
+        self.rows = len(df) if df is not None else 0
+
+    def __iter__(self):
+        if self.df is not None:
+            yield self.df
+
+
+class _CachingStream:
+    """Pass a QueryStream through, storing the result once it completes untruncated.
+
+    Chunks are only kept while their total stays within the cache budget.
+    """
+
+    def __init__(self, stream, result_cache, key, tables):
+        self.stream = stream
+        self.result_cache = result_cache
+        self.key = key
+        self.tables = tables
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        chunks = []
+        for chunk in self.stream:
+            if chunks is not None:
+                chunks.append(chunk)
+                if self.stream.bytes > self.result_cache.max_bytes:
+                    chunks = None
+            yield chunk
+        if chunks is None or self.stream.error or self.stream.truncated:
+            return
+        if not chunks:
+            df = pd.DataFrame(columns=self.stream.columns)
+        else:
+            df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+        self.result_cache.put(self.key, df, self.tables)
+
+
+class _StoringStream:
+    """Pass a result through, appending every chunk to a ResultStore (.store)."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.store = ResultStore()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.store.append(chunk)
+            yield chunk
+
+
+def stream_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine=None, result_cache=None):
+    """
+    Like run_query, but MySQL SELECTs come back as a QueryStream of DataFrame chunks
+    so the caller can render the first page before the rest arrives.
+    Every return value is iterable and has .error / .truncated / .rows, and
+    .store: the ResultStore the chunks are collected in while iterating, so
+    callers page through and export the result without concatenating it.
+    """
+    return _StoringStream(_stream_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine,
+                                        result_cache))
+
+
+def _stream_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine, result_cache):
+    if source == "MySQL" and is_single_select(sql):
+        key, tables = (None, None)
+        if result_cache is not None:
+            key, tables = _result_cache_key(result_cache, source, mysql_conn, df_map_sheets, sql)
+        if key is None:
+            return QueryStream(mysql_conn, sql)
+        cached = result_cache.get(key)
+        if cached is not None:
+            cached.attrs["result_cache"] = "hit"
+            return _SingleResult(cached, None)
+        return _CachingStream(QueryStream(mysql_conn, sql), result_cache, key, tables)
+    return _SingleResult(*run_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine,
+                                    result_cache))
+
+
+def run_progressive(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine=None, result_cache=None,
+                    fractions=None):
+    """
+    Approximate mode for aggregate SELECTs on big tables: returns at once with
+    an approximate.ProgressiveResult that yields estimates from growing samples
+    (with 95% error columns) and finally the exact result from stream_query,
+    all computed in the background; .cancel() stops the refinement. Queries
+    that cannot be estimated (or "Both" queries spanning sources) only get the
+    exact stage, with the reason in .note.
+    """
+    mysql_schema = {}
+    if source == "Both (MySQL+Sheets)":
+        mysql_schema = get_mysql_schema(mysql_conn) if mysql_conn else {}
+        try:
+            route = route_tables(sql, set(mysql_schema), set(df_map_sheets))
+        except ValueError:
+            route = "unknown"
+        source = {"mysql": "MySQL", "sheets": "Google Sheets"}.get(route, source)
+    elif source == "MySQL" and mysql_conn is not None:
+        try:
+            mysql_schema = get_mysql_schema(mysql_conn)
+        except Exception:
+            mysql_schema = {}
+
+    def exact():
+        return stream_query(source, mysql_conn, df_map_sheets, sheet_ws_map, sql, sheet_engine, result_cache)
+
+    return start_progressive(sql, source, exact, mysql_conn=mysql_conn, mysql_schema=mysql_schema,
+                             df_map=df_map_sheets, fractions=fractions)
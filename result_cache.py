@@ -0,0 +1,177 @@
+# result_cache.py
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from config import RESULT_CACHE_MAX_BYTES
+from sql_utils import tokenize, is_keyword, is_op, referenced_tables, is_single_select
+
+_ARROW = None
+
+
+def _arrow():
+    """pyarrow, imported on the first put (False when missing: pyarrow ships with streamlit,
+    otherwise DataFrames are kept as they are)."""
+    global _ARROW
+    if _ARROW is None:
+        try:
+            import pyarrow
+            import pyarrow.ipc
+            _ARROW = pyarrow
+        except ImportError:
+            _ARROW = False
+    return _ARROW
+
+
+# Lower-cased when normalizing; other identifiers keep their case (table names
+# can be case sensitive in MySQL).
+_KEYWORDS = {
+    "select", "distinct", "from", "where", "and", "or", "not", "in", "is", "null", "like", "between",
+    "as", "join", "inner", "left", "right", "full", "outer", "cross", "on", "using", "group", "by",
+    "order", "asc", "desc", "limit", "offset", "having", "union", "all", "case", "when", "then",
+    "else", "end", "with", "exists", "count", "sum", "avg", "min", "max", "upper", "lower",
+}
+
+
+def normalize_sql(sql: str) -> str:
+    """Whitespace/comment/keyword-case-insensitive form of a statement."""
+    try:
+        tokens = tokenize(sql.strip().rstrip(';'))
+    except ValueError:
+        return " ".join(sql.split())
+    return json.dumps([(t.kind, t.value.lower() if is_keyword(t, *_KEYWORDS) else t.value) for t in tokens])
+
+
+# Results depending on these are never cached.
+_VOLATILE_WORDS = {"current_timestamp", "current_date", "current_time", "localtime", "localtimestamp"}
+_VOLATILE_FUNCTIONS = _VOLATILE_WORDS | {
+    "now", "sysdate", "curdate", "curtime", "utc_date", "utc_time", "utc_timestamp", "unix_timestamp",
+    "rand", "random", "uuid", "uuid_short", "connection_id", "last_insert_id", "found_rows", "row_count",
+    "user", "current_user", "session_user", "system_user", "database", "schema", "sleep", "get_lock",
+}
+
+
+def cacheable_tables(sql: str) -> Optional[List[str]]:
+    """Tables a deterministic SELECT reads, or None if its result must not be cached."""
+    try:
+        if not is_single_select(sql):
+            return None
+        tokens = tokenize(sql)
+        refs = referenced_tables(sql)
+    except ValueError:
+        return None
+    for i, tok in enumerate(tokens):
+        if is_keyword(tok, *_VOLATILE_WORDS) or is_keyword(tok, "into", "for") or \
+                (is_keyword(tok, *_VOLATILE_FUNCTIONS) and i + 1 < len(tokens) and is_op(tokens[i + 1], "(")):
+            return None  # clock/session dependent, SELECT ... INTO or locking read
+    return list(dict.fromkeys(r.name for r in refs)) or None
+
+
+def _encode(df: pd.DataFrame) -> Tuple[object, int]:
+    """Compact representation of df and its size in bytes."""
+    pa = _arrow()
+    if pa:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            sink = pa.BufferOutputStream()
+            options = pa.ipc.IpcWriteOptions(compression="lz4")
+            with pa.ipc.new_stream(sink, table.schema, options=options) as writer:
+                writer.write_table(table)
+            buf = sink.getvalue()
+            return (buf, dict(df.attrs)), buf.size
+        except (pa.ArrowException, TypeError, ValueError):
+            pass  # mixed-type object columns: keep the frame itself
+    frame = df.copy()
+    return frame, int(frame.memory_usage(deep=True).sum())
+
+
+def _decode(payload) -> pd.DataFrame:
+    if isinstance(payload, pd.DataFrame):
+        return payload.copy()
+    buf, attrs = payload
+    df = _arrow().ipc.open_stream(buf).read_all().to_pandas()
+    df.attrs.update(attrs)
+    return df
+
+
+class ResultCache:
+    """In-memory LRU cache of SELECT results within a byte budget.
+
+    Keys combine the normalized SQL, the source and a version per referenced
+    table, so a table changed by anyone produces a new key. Entries are also
+    dropped eagerly by invalidate_tables() after a mutation. Frames are stored
+    as LZ4-compressed Arrow IPC buffers when pyarrow is available.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "bytes_saved": 0, "evictions": 0, "invalidations": 0}
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (payload, size, raw size, tables)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(sql: str, source: str, versions: Dict[str, object]) -> str:
+        material = json.dumps([normalize_sql(sql), source, sorted((k.lower(), str(v)) for k, v in versions.items())])
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            self.stats["bytes_saved"] += entry[2]
+        return _decode(entry[0])
+
+    def put(self, key: str, df: pd.DataFrame, tables: Iterable[str]):
+        raw_size = int(df.memory_usage(deep=True).sum())
+        payload, size = _encode(df)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.used_bytes -= old[1]
+            self._entries[key] = (payload, size, raw_size, {t.lower() for t in tables})
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.used_bytes -= evicted[1]
+                self.stats["evictions"] += 1
+
+    def invalidate_tables(self, tables: Iterable[str]):
+        """Drop every entry that read any of `tables`."""
+        names = {t.lower() for t in tables}
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e[3] & names]:
+                self.used_bytes -= self._entries.pop(key)[1]
+                self.stats["invalidations"] += 1
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+
+_RESULT_CACHE: Optional[ResultCache] = None
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Process-wide result cache shared by all sessions."""
+    global _RESULT_CACHE
+    with _RESULT_CACHE_LOCK:
+        if _RESULT_CACHE is None:
+            _RESULT_CACHE = ResultCache()
+        return _RESULT_CACHE
@@ -0,0 +1,264 @@
+# result_store.py
+"""Query results held server-side and read a page at a time.
+
+A ResultStore collects the chunks of a result as Arrow tables, one compact copy
+instead of a list of DataFrames plus their concatenation. Viewers ask for one
+page with the columns and sort order they show: a sort computes a row order
+once per (column, direction) and only the rows of the requested page are
+converted back to pandas. Exports are written batch by batch, so a CSV or
+Parquet download never builds the whole file in memory.
+"""
+import tempfile
+import threading
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+from config import RESULT_PAGE_SIZE, RESULT_EXPORT_BATCH_ROWS, RESULT_SPOOL_MAX_BYTES
+
+EXPORT_FORMATS = {"csv": "text/csv", "parquet": "application/vnd.apache.parquet"}
+
+_ARROW = None
+
+
+def _arrow():
+    """pyarrow, imported on first use (False when missing: chunks are then kept as DataFrames)."""
+    global _ARROW
+    if _ARROW is None:
+        try:
+            import pyarrow
+            import pyarrow.compute
+            import pyarrow.csv
+            import pyarrow.parquet
+            _ARROW = pyarrow
+        except ImportError:
+            _ARROW = False
+    return _ARROW
+
+
+class ResultStore:
+    """Rows of one result, appended chunk by chunk and read back by page.
+
+    attrs holds the first chunk's df.attrs (result_cache, federated_plan, ...).
+    Chunks that Arrow cannot represent (mixed-type object columns) switch the
+    store to plain DataFrames; paging and CSV export still work, Parquet does not.
+    """
+
+    def __init__(self):
+        self.columns: List[str] = []
+        self.rows = 0
+        self.attrs: Dict[str, object] = {}
+        self._parts: list = []          # pa.Table or pd.DataFrame per chunk
+        self._data = None               # the parts concatenated, built on first read
+        self._orders: Dict[tuple, object] = {}   # (column position, ascending) -> row positions
+        self._use_arrow = bool(_arrow())
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "ResultStore":
+        store = cls()
+        store.append(df)
+        return store
+
+    @property
+    def arrow(self) -> bool:
+        return self._use_arrow
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(p.nbytes if self._use_arrow else int(p.memory_usage(deep=True).sum()) for p in self._parts)
+
+    def append(self, chunk: pd.DataFrame):
+        with self._lock:
+            if not self._parts:
+                self.columns = [str(c) for c in chunk.columns]
+                self.attrs.update(chunk.attrs)
+            part = chunk
+            if self._use_arrow:
+                pa = _arrow()
+                bare = chunk.copy(deep=False)
+                bare.attrs = {}   # kept in self.attrs; Arrow would try to store them as JSON metadata
+                try:
+                    part = pa.Table.from_pandas(bare, preserve_index=False)
+                except (pa.ArrowException, TypeError, ValueError):
+                    self._to_pandas()
+                    part = chunk
+            self._parts.append(part)
+            self.rows += len(chunk)
+            self._data = None
+            self._orders.clear()
+
+    def _to_pandas(self):
+        self._parts = [p if isinstance(p, pd.DataFrame) else p.to_pandas() for p in self._parts]
+        self._use_arrow = False
+        self._data = None
+
+    def _table(self):
+        """All rows as one pa.Table (Arrow mode) or DataFrame; caller holds the lock."""
+        if self._data is not None:
+            return self._data
+        if self._use_arrow:
+            pa = _arrow()
+            try:
+                # chunks can disagree on types (all-NULL first chunk, ints then floats)
+                self._data = pa.concat_tables(self._parts, promote_options="permissive") if self._parts else None
+            except (pa.ArrowException, TypeError, ValueError):
+                self._to_pandas()
+        if not self._use_arrow:
+            if len(self._parts) > 1:
+                self._parts = [pd.concat(self._parts, ignore_index=True)]
+            self._data = self._parts[0] if self._parts else None
+        if self._data is None:
+            self._data = pd.DataFrame(columns=self.columns)
+        return self._data
+
+    def _positions(self, columns: Optional[Sequence[str]]) -> List[int]:
+        if not columns:
+            return list(range(len(self.columns)))
+        missing = [c for c in columns if c not in self.columns]
+        if missing:
+            raise ValueError(f"Unknown column(s): {', '.join(missing)}")
+        return [self.columns.index(c) for c in columns]
+
+    def _order(self, data, position: int, ascending: bool):
+        key = (position, ascending)
+        order = self._orders.get(key)
+        if order is not None:
+            return order
+        arrow_table = not isinstance(data, pd.DataFrame)
+        if arrow_table:
+            pa = _arrow()
+            try:
+                order = pa.compute.array_sort_indices(data.column(position),
+                                                      order="ascending" if ascending else "descending",
+                                                      null_placement="at_end")
+            except pa.ArrowException:
+                order = None
+        if order is None:
+            values = (data.column(position).to_pandas() if arrow_table
+                      else data.iloc[:, position]).reset_index(drop=True)
+            try:
+                ranked = values.sort_values(ascending=ascending, kind="stable", na_position="last")
+            except TypeError:   # mixed types: compare as text
+                ranked = values.astype(str).where(values.notna()).sort_values(
+                    ascending=ascending, kind="stable", na_position="last")
+            order = ranked.index.to_numpy()
+            if arrow_table:
+                order = _arrow().array(order)
+        self._orders[key] = order
+        return order
+
+    def _slice(self, start: int, count: int, columns: Optional[Sequence[str]], sort_by: Optional[str],
+               ascending: bool):
+        """Rows [start, start + count) of the (sorted) result, as a pa.Table or DataFrame."""
+        positions = self._positions(columns)
+        with self._lock:
+            data = self._table()
+            if sort_by:
+                take = self._order(data, self._positions([sort_by])[0], ascending)[start:start + count]
+                if isinstance(data, pd.DataFrame):
+                    return data.iloc[take, positions]
+                return data.select(positions).take(take)
+            if isinstance(data, pd.DataFrame):
+                return data.iloc[start:start + count, positions]
+            return data.select(positions).slice(start, count)
+
+    def page(self, page: int = 0, page_size: int = RESULT_PAGE_SIZE, columns: Optional[Sequence[str]] = None,
+             sort_by: Optional[str] = None, ascending: bool = True) -> pd.DataFrame:
+        """One page of rows as a DataFrame whose index is the row number in the (sorted) result."""
+        start = max(0, page) * page_size
+        part = self._slice(start, page_size, columns, sort_by, ascending)
+        df = part.reset_index(drop=True) if isinstance(part, pd.DataFrame) else part.to_pandas()
+        df.columns = list(columns) if columns else self.columns
+        df.index = pd.RangeIndex(start, start + len(df))
+        return df
+
+    def head(self, n: int) -> pd.DataFrame:
+        df = self.page(0, n).reset_index(drop=True)
+        df.attrs.update(self.attrs)
+        return df
+
+    def pages(self, page_size: int = RESULT_PAGE_SIZE) -> int:
+        return max(1, -(-self.rows // page_size))
+
+    def to_frame(self) -> pd.DataFrame:
+        """The whole result as one DataFrame (for callers that really need it)."""
+        df = self.page(0, max(self.rows, 1)).reset_index(drop=True)
+        df.attrs.update(self.attrs)
+        return df
+
+    # ---------------- export -----------------
+    def iter_csv(self, columns: Optional[Sequence[str]] = None, sort_by: Optional[str] = None,
+                 ascending: bool = True, batch_rows: int = RESULT_EXPORT_BATCH_ROWS) -> Iterator[bytes]:
+        """CSV bytes, one piece per batch_rows rows; the header comes with the first."""
+        pa = _arrow()
+        start = 0
+        while True:
+            part = self._slice(start, batch_rows, columns, sort_by, ascending)
+            if isinstance(part, pd.DataFrame):
+                df = part.copy()
+                df.columns = list(columns) if columns else self.columns
+                yield df.to_csv(index=False, header=start == 0).encode("utf-8")
+            else:
+                sink = pa.BufferOutputStream()
+                options = pa.csv.WriteOptions(include_header=start == 0, quoting_style="needed")
+                pa.csv.write_csv(part.rename_columns(list(columns) if columns else self.columns), sink, options)
+                yield sink.getvalue().to_pybytes()
+            start += batch_rows
+            if start >= self.rows:
+                return
+
+    def write_parquet(self, fileobj, columns: Optional[Sequence[str]] = None, sort_by: Optional[str] = None,
+                      ascending: bool = True, batch_rows: int = RESULT_EXPORT_BATCH_ROWS):
+        """Write the result to a binary file object, one row group per batch_rows rows."""
+        pa = _arrow()
+        if not pa:
+            raise ValueError("Parquet export needs pyarrow (pip install pyarrow).")
+        writer, start = None, 0
+        try:
+            while True:
+                part = self._slice(start, batch_rows, columns, sort_by, ascending)
+                if isinstance(part, pd.DataFrame):
+                    try:
+                        part = pa.Table.from_pandas(part.reset_index(drop=True), preserve_index=False)
+                    except (pa.ArrowException, TypeError, ValueError) as e:
+                        raise ValueError(f"Parquet export failed: mixed-type column ({e})") from None
+                if writer is None:
+                    writer = pa.parquet.ParquetWriter(fileobj, part.schema)
+                writer.write_table(part.cast(writer.schema) if part.schema != writer.schema else part)
+                start += batch_rows
+                if start >= self.rows:
+                    return
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def spool(self, fmt: str, **options):
+        """The export in a temporary file (in memory up to RESULT_SPOOL_MAX_BYTES, then on disk), rewound."""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {fmt!r}; use {' or '.join(EXPORT_FORMATS)}.")
+        f = tempfile.SpooledTemporaryFile(max_size=RESULT_SPOOL_MAX_BYTES)
+        try:
+            if fmt == "csv":
+                for piece in self.iter_csv(**options):
+                    f.write(piece)
+            else:
+                self.write_parquet(f, **options)
+        except BaseException:
+            f.close()
+            raise
+        f.seek(0)
+        return f
+
+    def iter_export(self, fmt: str, block_size: int = 1 << 16, **options) -> Iterator[bytes]:
+        """The export as a byte stream: CSV is produced as it is sent, Parquet goes through spool()."""
+        if fmt == "csv":
+            yield from self.iter_csv(**options)
+            return
+        with self.spool(fmt, **options) as f:
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    return
+                yield block
@@ -0,0 +1,120 @@
+# schema_retriever.py
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Optional
+
+_STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "by", "to", "and", "or", "with", "from", "is", "are",
+    "was", "were", "what", "which", "who", "how", "many", "much", "show", "me", "list", "give", "get",
+    "all", "each", "per", "their", "its", "that", "this", "have", "has", "do", "does", "find", "top",
+}
+
+
+def _stem(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Split identifiers/prose into lower-case stemmed tokens (snake_case and camelCase aware)."""
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(text))
+    return [_stem(t) for t in re.findall(r"[a-z0-9]+", text.lower()) if t not in _STOPWORDS]
+
+
+def format_schema_context(schema: Dict[str, list], tables: Optional[List[str]] = None) -> str:
+    """Render {table: [{name,type}, ...]} as the prompt's schema block."""
+    out = ""
+    for t in (tables if tables is not None else schema):
+        out += f"Table: {t}\n"
+        for c in schema[t]:
+            ref = f" -> {c['references']}" if c.get("references") else ""
+            out += f"  - {c['name']} ({c['type']}){ref}\n"
+    return out
+
+
+class SchemaIndex:
+    """BM25 index over tables, built once per schema.
+
+    Each table is a document made of its name, column names, column types and
+    optional sample values (name tokens weigh most). Foreign keys, declared or
+    inferred from `<table>_id` naming, link tables so that selected tables can
+    pull in their join neighbours.
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, schema: Dict[str, list], samples: Optional[Dict[str, Dict[str, list]]] = None):
+        self.schema = schema
+        self.docs: Dict[str, Counter] = {}
+        for table, cols in schema.items():
+            doc = Counter()
+            for tok in tokenize(table):
+                doc[tok] += 3
+            for c in cols:
+                for tok in tokenize(c["name"]):
+                    doc[tok] += 2
+                for tok in tokenize(re.sub(r"\(.*\)", "", str(c.get("type", "")))):
+                    doc[tok] += 1
+            for values in (samples or {}).get(table, {}).values():
+                for v in values:
+                    for tok in tokenize(v):
+                        doc[tok] += 1
+            self.docs[table] = doc
+        self.lengths = {t: sum(d.values()) for t, d in self.docs.items()}
+        self.avg_length = (sum(self.lengths.values()) / len(self.lengths)) if self.lengths else 0.0
+        df = Counter()
+        for doc in self.docs.values():
+            df.update(doc.keys())
+        n = len(self.docs)
+        self.idf = {tok: math.log(1 + (n - f + 0.5) / (f + 0.5)) for tok, f in df.items()}
+        self.neighbors = self._build_neighbors()
+
+    def _build_neighbors(self) -> Dict[str, set]:
+        by_stem: Dict[str, str] = {}
+        for table in self.schema:
+            by_stem.setdefault(" ".join(tokenize(table)), table)
+        neighbors: Dict[str, set] = {t: set() for t in self.schema}
+        for table, cols in self.schema.items():
+            for c in cols:
+                target = None
+                if c.get("references"):
+                    target = c["references"].split(".", 1)[0]
+                else:
+                    m = re.match(r"(.+?)_?id$", c["name"], flags=re.I)
+                    if m and c["name"].lower() != "id":
+                        target = by_stem.get(" ".join(tokenize(m.group(1))))
+                if target in neighbors and target != table:
+                    neighbors[table].add(target)
+                    neighbors[target].add(table)
+        return neighbors
+
+    def score(self, question: str) -> Dict[str, float]:
+        terms = set(tokenize(question))
+        scores = {}
+        for table, doc in self.docs.items():
+            s = 0.0
+            norm = self.K1 * (1 - self.B + self.B * self.lengths[table] / (self.avg_length or 1))
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    s += self.idf[term] * tf * (self.K1 + 1) / (tf + norm)
+            if s > 0:
+                scores[table] = s
+        return scores
+
+    def select(self, question: str, k: int = 8, max_neighbors: int = 8) -> List[str]:
+        """Return the top-k matching tables followed by their join neighbours ([] if nothing matches)."""
+        scores = self.score(question)
+        top = sorted(scores, key=scores.get, reverse=True)[:k]
+        selected = list(top)
+        extra = []
+        for table in top:
+            for n in sorted(self.neighbors[table], key=lambda t: -scores.get(t, 0.0)):
+                if n not in selected and n not in extra:
+                    extra.append(n)
+        return selected + extra[:max_neighbors]
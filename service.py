@@ -0,0 +1,782 @@
+# service.py
+"""
+Headless query service: the question -> SQL -> result pipeline behind an HTTP/JSON API.
+
+    python service.py --port 8765
+    QUERY_SERVICE_URL=http://127.0.0.1:8765 streamlit run main.py
+
+    POST   /generate   {"question", "source", "datasource", ...}   validated SQL
+    POST   /execute    {"sql", "source", "datasource"}             result
+    POST   /ask        {"question", "source", "datasource", ...}   SQL and result
+    GET    /jobs[?user=u]                                           job list
+    GET    /jobs/<id>[?wait=seconds]                                one job
+    GET    /jobs/<id>/rows?page=&page_size=&sort=&desc=1&columns=a,b  one page of the result
+    GET    /jobs/<id>/export?format=csv|parquet[&sort=&desc=1&columns=]  streamed download
+    DELETE /jobs/<id>                                               cancel
+    GET    /writes, POST /writes/flush {"timeout"}                  queued Sheets writes
+    GET    /health, /metrics
+
+Every request becomes a job. POST bodies may carry "user" (at most
+SERVICE_USER_CONCURRENCY jobs per user run at once; the rest wait in that
+user's queue), "wait" (seconds to wait for the job; 0 answers 202 at once),
+"temperature", "system_prompt" and "max_rows" (rows inlined in the job; the
+rest is read through /rows or /export). Past SERVICE_MAX_QUEUE queued
+jobs new work is refused with 429.
+
+"datasource" is the name given to QueryService.register() or
+{"mysql": {"host", "port", "user", "password", "database"},
+ "sheets": {"sheet_name", "sa_path"}}. Connections, loaded tabs, the sheet
+engine and the schema index live on the data source and are shared by all
+jobs that use it. Jobs run on a thread pool; Sheets SELECTs over large tabs
+are sent to a process pool.
+"""
+import argparse
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from config import (SYSTEM_PROMPT_DEFAULT, GSHEET_SERVICE_ACCOUNT_FILE, SCHEMA_PRUNE_MIN_TABLES,
+                    SCHEMA_PRUNE_TOP_K, RESULT_CACHE_ENABLED, SERVICE_HOST, SERVICE_PORT, SERVICE_IO_WORKERS,
+                    SERVICE_CPU_WORKERS, SERVICE_PROCESS_MIN_ROWS, SERVICE_USER_CONCURRENCY, SERVICE_MAX_QUEUE,
+                    SERVICE_WAIT_TIMEOUT, SERVICE_JOB_TTL, SERVICE_MAX_RESULT_ROWS, RESULT_PAGE_SIZE,
+                    RESULT_SPOOL_MAX_BYTES)
+from db_utils import get_mysql_pool, get_mysql_schema
+from gsheets_utils import SheetWorkbook, open_google_workbook, safe_table_name, frame_version
+from query_executor import stream_query
+from result_cache import get_result_cache
+from result_store import ResultStore, EXPORT_FORMATS
+from schema_retriever import SchemaIndex, format_schema_context
+from sheet_engine import SheetSQLEngine
+from sheet_writer import get_sheet_writer
+from sql_generator import generate_sql_with_repair
+from sql_utils import referenced_tables, is_single_select
+from sql_validator import validate_sql
+from tracing import span, render_prometheus
+
+SOURCES = ("MySQL", "Google Sheets", "Both (MySQL+Sheets)")
+FINISHED = ("done", "failed", "cancelled")
+
+
+class QueueFull(Exception):
+    pass
+
+
+# ---------------- data sources -----------------
+# Per worker process: an engine holding the frames it was sent, keyed by frame_version.
+_WORKER_ENGINE: Optional[SheetSQLEngine] = None
+_WORKER_VERSIONS: Dict[str, int] = {}
+
+
+def _query_in_process(sql: str, versions: Dict[str, int], frames: Optional[Dict[str, pd.DataFrame]] = None):
+    """Process-pool entry point: run a SELECT over sheet frames.
+
+    Returns None when this worker does not hold the given frame versions and
+    `frames` was not sent; the caller then retries with the frames.
+    """
+    global _WORKER_ENGINE
+    if _WORKER_ENGINE is None:
+        _WORKER_ENGINE = SheetSQLEngine()
+    stale = [n for n, v in versions.items() if _WORKER_VERSIONS.get(n) != v]
+    if stale:
+        if frames is None:
+            return None
+        _WORKER_ENGINE.sync({n: frames[n] for n in stale})
+        _WORKER_VERSIONS.update((n, versions[n]) for n in stale)
+    return _WORKER_ENGINE.query(sql)
+
+
+class _OffloadingEngine:
+    """SheetSQLEngine front that runs SELECTs over big tabs in the process pool.
+
+    Workers keep the tabs they were sent, so a tab is pickled to a worker once
+    per version. Smaller SELECTs and all mutations go to the data source's
+    persistent engine.
+    """
+
+    def __init__(self, engine: SheetSQLEngine, processes: ProcessPoolExecutor, min_rows: int):
+        self.engine = engine
+        self.processes = processes
+        self.min_rows = min_rows
+        self._df_map: Dict[str, pd.DataFrame] = {}
+
+    def __getattr__(self, name):
+        return getattr(self.engine, name)
+
+    def sync(self, df_map: Dict[str, pd.DataFrame]):
+        self._df_map = df_map   # loaded into the local engine only if the query stays here
+
+    def query(self, sql: str) -> pd.DataFrame:
+        lowered = {n.lower(): n for n in self._df_map}
+        names = [lowered[r.name.lower()] for r in referenced_tables(sql) if r.name.lower() in lowered]
+        frames = {n: self._df_map[n] for n in names}
+        rows = sum(len(df) for df in {id(df): df for df in frames.values()}.values())
+        if frames and rows >= self.min_rows:
+            versions = {n: frame_version(df) for n, df in frames.items()}
+            with span("sheets.process", rows=rows, shipped=False) as s:
+                res = self.processes.submit(_query_in_process, sql, versions).result()
+                if res is None:
+                    s.set(shipped=True)
+                    res = self.processes.submit(_query_in_process, sql, versions, frames).result()
+                return res
+        self.engine.sync(self._df_map)
+        return self.engine.query(sql)
+
+
+class DataSource:
+    """Connections of one data source plus the state main.py keeps in session_state.
+
+    Built from a spec ({"mysql": {...}, "sheets": {...}}) and connected on first
+    use, or registered ready-made (e.g. with the mocks; `mysql_schema` then
+    stands in for information_schema). Sheet mutations hold `lock` so
+    concurrent jobs do not interleave write-backs.
+    """
+
+    def __init__(self, spec: Optional[dict] = None, mysql_conn=None, book: Optional[SheetWorkbook] = None,
+                 mysql_schema: Optional[Dict[str, list]] = None):
+        self.spec = spec or {}
+        self.mysql_conn = mysql_conn
+        self.book = book
+        self.mysql_schema = mysql_schema
+        self.engine = SheetSQLEngine()
+        self.lock = threading.RLock()
+        self._connected = spec is None
+        self._index: Optional[SchemaIndex] = None
+        self._index_key: Optional[str] = None
+
+    def connect(self):
+        with self.lock:
+            if self._connected:
+                return
+            mysql = self.spec.get("mysql")
+            if mysql:
+                self.mysql_conn = get_mysql_pool(mysql.get("host", "localhost"), int(mysql.get("port", 3306)),
+                                                 mysql.get("user", "root"), mysql.get("password", ""),
+                                                 mysql.get("database", ""))
+            sheets = self.spec.get("sheets")
+            if sheets:
+                self.book = open_google_workbook(sheets.get("sa_path") or GSHEET_SERVICE_ACCOUNT_FILE,
+                                                 sheets["sheet_name"])
+            self._connected = True
+
+    def schemas(self, source: str):
+        """(full_schema, mysql_schema, sheet_schema, samples) for the parts of this source in use."""
+        mysql_schema, sheet_schema, samples = {}, {}, {}
+        if source in ("MySQL", "Both (MySQL+Sheets)") and self.mysql_conn is not None:
+            mysql_schema = self.mysql_schema if self.mysql_schema is not None else get_mysql_schema(self.mysql_conn)
+        full_schema = dict(mysql_schema)
+        if source in ("Google Sheets", "Both (MySQL+Sheets)") and self.book is not None:
+            with self.lock:
+                book_schema = self.book.schema()
+                frames = dict(self.book.frames)
+            full_schema.update(book_schema)
+            for title, cols in book_schema.items():
+                sheet_schema[title] = sheet_schema[safe_table_name(title)] = cols
+            for title, df in frames.items():
+                head = df.head(50)
+                samples[title] = {c: [str(v) for v in head[c].dropna().unique()[:5]]
+                                  for c in head.columns if pd.api.types.is_string_dtype(head[c].dtype)}
+        return full_schema, mysql_schema, sheet_schema, samples
+
+    def schema_index(self, full_schema: Dict[str, list], schema_context: str, samples) -> Optional[SchemaIndex]:
+        """Index rebuilt only when the schema changes."""
+        if len(full_schema) <= SCHEMA_PRUNE_MIN_TABLES:
+            return None
+        with self.lock:
+            if self._index_key != schema_context:
+                self._index = SchemaIndex(full_schema, samples)
+                self._index_key = schema_context
+            return self._index
+
+    def table_maps(self, sql: str):
+        """(df_map, ws_map) of the tabs sql references (only those are downloaded)."""
+        if self.book is None:
+            return {}, {}
+        with self.lock:
+            return self.book.table_maps(self.book.tables_in_sql(sql))
+
+
+# ---------------- jobs -----------------
+def _json_page(df: pd.DataFrame) -> dict:
+    # to_json handles NaN, numpy scalars and timestamps
+    return json.loads(df.to_json(orient="split", index=False, date_format="iso"))
+
+
+class Job:
+    """One request. state: queued -> running -> done | failed | cancelled."""
+
+    def __init__(self, kind: str, user: str, payload: dict):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.user = user
+        self.payload = payload
+        self.state = "queued"
+        self.sql: Optional[str] = None
+        self.warnings: List[str] = []
+        self.repairs = 0
+        self.rows_examined: Optional[float] = None
+        self.result: Optional[ResultStore] = None
+        self.truncated: Optional[str] = None
+        self.error: Optional[str] = None
+        self.trace: Optional[dict] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self._done = threading.Event()
+        self._cancelled = threading.Event()
+        self._stream = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        d = {"id": self.id, "kind": self.kind, "user": self.user, "state": self.state,
+             "created": self.created, "started": self.started, "finished": self.finished}
+        if self.sql is not None:
+            d.update(sql=self.sql, warnings=self.warnings, repairs=self.repairs, rows_examined=self.rows_examined)
+        if self.result is not None:
+            max_rows = int(self.payload.get("max_rows") or SERVICE_MAX_RESULT_ROWS)
+            page = _json_page(self.result.page(0, max_rows))
+            d["result"] = {"columns": page["columns"], "data": page["data"], "row_count": self.result.rows,
+                           "truncated": self.truncated,
+                           "cache": self.result.attrs.get("result_cache")}
+            if "batch" in self.result.attrs:   # per-statement outcome of a multi-statement script
+                d["result"]["statements"] = [{k: v for k, v in e.items() if k != "sql"}
+                                             for e in self.result.attrs["batch"].statements]
+        if self.error is not None:
+            d["error"] = self.error
+        if self.trace is not None:
+            d["trace"] = self.trace
+        return d
+
+
+class QueryService:
+    """Runs generate / execute / ask jobs on a thread pool with per-user limits."""
+
+    def __init__(self, io_workers: int = SERVICE_IO_WORKERS, cpu_workers: int = SERVICE_CPU_WORKERS,
+                 user_concurrency: int = SERVICE_USER_CONCURRENCY, max_queue: int = SERVICE_MAX_QUEUE,
+                 process_min_rows: int = SERVICE_PROCESS_MIN_ROWS, job_ttl: float = SERVICE_JOB_TTL, model=None):
+        self.user_concurrency = max(1, user_concurrency)
+        self.max_queue = max_queue
+        self.process_min_rows = process_min_rows
+        self.job_ttl = job_ttl
+        self.model = model
+        self.result_cache = get_result_cache() if RESULT_CACHE_ENABLED else None
+        self._threads = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="service")
+        self._processes = (ProcessPoolExecutor(max_workers=cpu_workers, mp_context=get_context("spawn"))
+                           if cpu_workers > 0 else None)
+        self._lock = threading.Lock()
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._running: Dict[str, int] = {}
+        self._pending: Dict[str, deque] = {}
+        self._sources: Dict[str, DataSource] = {}
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+
+    # data sources
+    def register(self, name: str, mysql_conn=None, book: Optional[SheetWorkbook] = None,
+                 mysql_schema: Optional[Dict[str, list]] = None) -> DataSource:
+        ds = DataSource(mysql_conn=mysql_conn, book=book, mysql_schema=mysql_schema)
+        with self._lock:
+            self._sources[name] = ds
+        return ds
+
+    def datasource(self, spec) -> DataSource:
+        if isinstance(spec, str):
+            with self._lock:
+                if spec not in self._sources:
+                    raise KeyError(f"Unknown data source '{spec}'.")
+                return self._sources[spec]
+        if not isinstance(spec, dict) or not (spec.get("mysql") or spec.get("sheets")):
+            raise ValueError("datasource needs a registered name or a 'mysql' / 'sheets' connection spec.")
+        key = hashlib.sha256(json.dumps(spec, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+        with self._lock:
+            if key not in self._sources:
+                self._sources[key] = DataSource(spec)
+            return self._sources[key]
+
+    # scheduling
+    def submit(self, kind: str, payload: dict, user: str = "anonymous") -> Job:
+        if kind not in ("generate", "execute", "ask"):
+            raise ValueError(f"Unknown job kind '{kind}'.")
+        if payload.get("source") not in SOURCES:
+            raise ValueError(f"source must be one of: {', '.join(SOURCES)}.")
+        if not str(payload.get("sql" if kind == "execute" else "question") or "").strip():
+            raise ValueError("sql is required." if kind == "execute" else "question is required.")
+        self.datasource(payload.get("datasource"))   # fail fast on a bad spec
+        job = Job(kind, str(user or "anonymous"), payload)
+        with self._lock:
+            self._prune()
+            queued = sum(1 for j in self._jobs.values() if j.state == "queued")
+            if self.max_queue and queued >= self.max_queue:
+                self.stats["rejected"] += 1
+                raise QueueFull(f"Queue is full ({queued} jobs waiting); retry later.")
+            self._jobs[job.id] = job
+            self.stats["submitted"] += 1
+            if self._running.get(job.user, 0) < self.user_concurrency:
+                self._start(job)
+            else:
+                self._pending.setdefault(job.user, deque()).append(job)
+        return job
+
+    def _start(self, job: Job):
+        # caller holds self._lock
+        self._running[job.user] = self._running.get(job.user, 0) + 1
+        self._threads.submit(self._run, job)
+
+    def _release(self, job: Job):
+        with self._lock:
+            self._running[job.user] -= 1
+            pending = self._pending.get(job.user)
+            while pending:
+                nxt = pending.popleft()
+                if not nxt.cancelled:
+                    self._start(nxt)
+                    break
+            if not pending:
+                self._pending.pop(job.user, None)
+            if not self._running[job.user]:
+                del self._running[job.user]
+
+    def _prune(self):
+        cutoff = time.time() - self.job_ttl
+        for job_id in [i for i, j in self._jobs.items() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _finish(self, job: Job, state: str):
+        # caller holds self._lock
+        job.state = state
+        job.finished = time.time()
+        self.stats[state] += 1
+        job._done.set()
+
+    def _run(self, job: Job):
+        try:
+            if job.cancelled:
+                with self._lock:
+                    self._finish(job, "cancelled")
+                return
+            job.state = "running"
+            job.started = time.time()
+            with span(f"service.{job.kind}", user=job.user, source=job.payload["source"]) as trace:
+                try:
+                    self._pipeline(job)
+                except Exception as e:
+                    job.error = f"{type(e).__name__}: {e}"
+                    trace.error = job.error
+            job.trace = trace.to_dict()
+            with self._lock:
+                self._finish(job, "cancelled" if job.cancelled else "failed" if job.error else "done")
+        finally:
+            self._release(job)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job. Generation finishes its current call; a MySQL stream is killed."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state in FINISHED:
+                return job
+            job._cancelled.set()
+            pending = self._pending.get(job.user)
+            if pending is not None and job in pending:
+                pending.remove(job)
+                self._finish(job, "cancelled")
+                return job
+        stream = job._stream
+        if stream is not None and hasattr(stream, "cancel"):
+            stream.cancel("cancelled by user")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self, user: Optional[str] = None) -> List[Job]:
+        with self._lock:
+            return [j for j in self._jobs.values() if user is None or j.user == user]
+
+    def health(self) -> dict:
+        with self._lock:
+            states: Dict[str, int] = {}
+            for j in self._jobs.values():
+                states[j.state] = states.get(j.state, 0) + 1
+            return {"jobs": states, "users_running": len(self._running),
+                    "user_queued": sum(len(q) for q in self._pending.values()), **self.stats}
+
+    def shutdown(self):
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)
+
+    # pipeline
+    def _pipeline(self, job: Job):
+        p = job.payload
+        ds = self.datasource(p["datasource"])
+        ds.connect()
+        if job.kind == "execute":
+            job.sql = p["sql"].strip().rstrip(';').strip()
+        else:
+            if not self._generate(job, ds) or job.kind == "generate" or job.cancelled:
+                return
+        self._execute(job, ds)
+
+    def _generate(self, job: Job, ds: DataSource) -> bool:
+        p = job.payload
+        source, question = p["source"], p["question"]
+        full_schema, mysql_schema, sheet_schema, samples = ds.schemas(source)
+        schema_context = prompt_schema = format_schema_context(full_schema)
+        index = ds.schema_index(full_schema, schema_context, samples)
+        if index is not None:
+            with span("schema.prune", tables=len(full_schema)):
+                relevant = index.select(question, k=SCHEMA_PRUNE_TOP_K)
+            if relevant:
+                prompt_schema = format_schema_context(full_schema, relevant)
+
+        def validate(candidate):
+            return validate_sql(candidate, source, mysql_schema, sheet_schema, ds.mysql_conn,
+                                ds.table_maps(candidate)[0], ds.engine)
+
+        sql, check = generate_sql_with_repair(question, prompt_schema, validate,
+                                              p.get("system_prompt") or SYSTEM_PROMPT_DEFAULT,
+                                              float(p.get("temperature", 0.7)), model=self.model)
+        job.sql = sql
+        if check is None:
+            job.error = sql
+            return False
+        job.warnings, job.repairs, job.rows_examined = list(check.warnings), check.repairs, check.rows_examined
+        if check.errors:
+            job.error = "SQL failed validation: " + "; ".join(check.errors)
+            return False
+        if check.rejected:
+            job.error = check.rejected
+            return False
+        job.sql = check.sql
+        return True
+
+    def _execute(self, job: Job, ds: DataSource):
+        sql = job.sql
+        source = job.payload["source"]
+        is_select = is_single_select(sql)
+        df_map, ws_map = ds.table_maps(sql)
+        engine = ds.engine
+        if is_select and self._processes is not None and source != "MySQL":
+            engine = _OffloadingEngine(ds.engine, self._processes, self.process_min_rows)
+        # SELECTs run side by side; writes to a data source are serialized
+        with nullcontext() if is_select else ds.lock:
+            result = stream_query(source, ds.mysql_conn, df_map, ws_map, sql, engine, self.result_cache)
+            job._stream = result
+            if job.cancelled and hasattr(result, "cancel"):
+                result.cancel("cancelled by user")
+            for _ in result:
+                if job.result is None and result.store.columns:
+                    job.result = result.store   # pollers see the first rows while the rest streams in
+            job._stream = None
+            if ds.book is not None and not is_select and not result.error:
+                for title in ds.book.titles():
+                    if title in df_map:
+                        ds.book.set_frame(title, df_map[title])
+        if result.error:
+            job.result = None
+            job.error = result.error
+            return
+        job.truncated = result.truncated
+        if result.store.columns:
+            job.result = result.store
+
+
+# ---------------- HTTP -----------------
+class _Handler(BaseHTTPRequestHandler):
+    service: QueryService = None
+
+    def _send(self, status: int, body, headers: Optional[dict] = None):
+        data = (json.dumps(body, default=str) if not isinstance(body, str) else body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json" if not isinstance(body, str) else "text/plain")
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _job_response(self, job: Job, wait: float):
+        if wait > 0:
+            job.wait(wait)
+        self._send(200 if job.state in FINISHED else 202, job.to_dict())
+
+    def do_POST(self):
+        kind = self.path.split("?")[0].strip("/")
+        if kind == "writes/flush":
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                timeout = float(json.loads(self.rfile.read(length) or b"{}").get("timeout", SERVICE_WAIT_TIMEOUT))
+            except (ValueError, TypeError, AttributeError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            writer = get_sheet_writer()
+            flushed = writer.flush(min(timeout, SERVICE_WAIT_TIMEOUT))
+            self._send(200, {"flushed": flushed, "sheets": writer.status()})
+            return
+        if kind not in ("generate", "execute", "ask"):
+            self._send(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            job = self.service.submit(kind, payload, payload.get("user") or "anonymous")
+        except QueueFull as e:
+            self._send(429, {"error": str(e)}, {"Retry-After": "1"})
+            return
+        except (ValueError, KeyError, TypeError) as e:
+            self._send(400, {"error": str(e).strip("'\"")})
+            return
+        self._job_response(job, float(payload.get("wait", SERVICE_WAIT_TIMEOUT)))
+
+    def _result_view(self, job: Job, action: str, query: dict):
+        if job.result is None:
+            self._send(409 if job.state not in FINISHED else 404, {"error": f"job has no result ({job.state})"})
+            return
+        options = {"sort_by": query.get("sort") or None, "ascending": query.get("desc") not in ("1", "true"),
+                   "columns": [c for c in query.get("columns", "").split(",") if c] or None}
+        try:
+            if action == "rows":
+                page_size = max(1, min(int(query.get("page_size", RESULT_PAGE_SIZE)), SERVICE_MAX_RESULT_ROWS))
+                page = int(query.get("page", 0))
+                data = _json_page(job.result.page(page, page_size, **options))
+                self._send(200, {"page": page, "page_size": page_size, "pages": job.result.pages(page_size),
+                                 "row_count": job.result.rows, **data})
+                return
+            if job.state not in FINISHED:
+                self._send(409, {"error": f"job has no complete result yet ({job.state})"})
+                return
+            fmt = query.get("format", "csv")
+            if fmt not in EXPORT_FORMATS:
+                raise ValueError(f"Unknown export format {fmt!r}")
+            pieces = job.result.iter_export(fmt, **options)
+            first = next(pieces)   # surfaces bad columns / Parquet errors before the headers go out
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", EXPORT_FORMATS[fmt])
+        self.send_header("Content-Disposition", f'attachment; filename="{job.id}.{fmt}"')
+        self.end_headers()   # HTTP/1.0 without Content-Length: the body ends when the connection closes
+        self.wfile.write(first)
+        for piece in pieces:
+            self.wfile.write(piece)
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = url.path.strip("/").split("/")
+        if url.path == "/health":
+            self._send(200, self.service.health())
+        elif url.path == "/metrics":
+            self._send(200, render_prometheus())
+        elif url.path == "/writes":
+            self._send(200, {"sheets": get_sheet_writer().status()})
+        elif parts == ["jobs"]:
+            self._send(200, {"jobs": [{k: v for k, v in j.to_dict().items() if k not in ("result", "trace")}
+                                      for j in self.service.jobs(query.get("user"))]})
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = self.service.get(parts[1])
+            if job is None:
+                self._send(404, {"error": "no such job"})
+            else:
+                self._job_response(job, min(float(query.get("wait", 0)), SERVICE_WAIT_TIMEOUT))
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] in ("rows", "export"):
+            job = self.service.get(parts[1])
+            if job is None:
+                self._send(404, {"error": "no such job"})
+            else:
+                self._result_view(job, parts[2], query)
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        job = self.service.cancel(parts[1]) if len(parts) == 2 and parts[0] == "jobs" else None
+        if job is None:
+            self._send(404, {"error": "no such job"})
+        else:
+            self._send(200, job.to_dict())
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128   # listen backlog; the default of 5 resets bursts of clients
+
+
+def make_server(service: QueryService, host: str = SERVICE_HOST, port: int = SERVICE_PORT) -> ThreadingHTTPServer:
+    """HTTP server bound to service; call serve_forever() (port 0 picks a free port)."""
+    handler = type("ServiceHandler", (_Handler,), {"service": service})
+    return _Server((host, port), handler)
+
+
+# ---------------- client -----------------
+class ServiceClient:
+    """Thin JSON client used by main.py when QUERY_SERVICE_URL is set.
+
+    Methods return the job as a dict; HTTP errors raise RuntimeError with the service's message.
+    """
+
+    def __init__(self, base_url: str, user: str = "anonymous", timeout: float = SERVICE_WAIT_TIMEOUT + 30):
+        self.base_url = base_url.rstrip("/")
+        self.user = user
+        self.timeout = timeout
+
+    def _request(self, method: str, path: str, body: Optional[dict] = None) -> dict:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                return json.loads(resp.read() or b"{}")
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read() or b"{}").get("error") or str(e)
+            except ValueError:
+                message = str(e)
+            raise RuntimeError(f"{e.code}: {message}") from None
+        except (urllib.error.URLError, OSError) as e:
+            raise RuntimeError(f"query service unreachable: {getattr(e, 'reason', e)}") from None
+
+    def _post(self, kind: str, source: str, datasource, wait: float, **fields) -> dict:
+        body = {"source": source, "datasource": datasource, "user": self.user, "wait": wait}
+        body.update({k: v for k, v in fields.items() if v is not None})
+        return self._request("POST", f"/{kind}", body)
+
+    def generate(self, question: str, source: str, datasource, wait: float = SERVICE_WAIT_TIMEOUT, **options) -> dict:
+        return self._post("generate", source, datasource, wait, question=question, **options)
+
+    def execute(self, sql: str, source: str, datasource, wait: float = SERVICE_WAIT_TIMEOUT, **options) -> dict:
+        return self._post("execute", source, datasource, wait, sql=sql, **options)
+
+    def ask(self, question: str, source: str, datasource, wait: float = SERVICE_WAIT_TIMEOUT, **options) -> dict:
+        return self._post("ask", source, datasource, wait, question=question, **options)
+
+    def job(self, job_id: str, wait: float = 0) -> dict:
+        return self._request("GET", f"/jobs/{job_id}?wait={wait}")
+
+    def cancel(self, job_id: str) -> dict:
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    @staticmethod
+    def _view_query(sort_by: Optional[str], ascending: bool, columns: Optional[List[str]], **extra) -> str:
+        query = {k: v for k, v in extra.items() if v is not None}
+        if sort_by:
+            query.update(sort=sort_by, desc=0 if ascending else 1)
+        if columns:
+            query["columns"] = ",".join(columns)
+        return urllib.parse.urlencode(query)
+
+    def rows(self, job_id: str, page: int = 0, page_size: Optional[int] = None, sort_by: Optional[str] = None,
+             ascending: bool = True, columns: Optional[List[str]] = None) -> dict:
+        """One page of a finished job's result: {"columns", "data", "page", "pages", "row_count"}."""
+        query = self._view_query(sort_by, ascending, columns, page=page, page_size=page_size)
+        return self._request("GET", f"/jobs/{job_id}/rows?{query}")
+
+    def download(self, job_id: str, fileobj, fmt: str = "csv", sort_by: Optional[str] = None,
+                 ascending: bool = True, columns: Optional[List[str]] = None):
+        """Stream a job's result as CSV or Parquet into a binary file object."""
+        query = self._view_query(sort_by, ascending, columns, format=fmt)
+        try:
+            with urllib.request.urlopen(f"{self.base_url}/jobs/{job_id}/export?{query}", timeout=self.timeout) as resp:
+                shutil.copyfileobj(resp, fileobj, 1 << 16)
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read() or b"{}").get("error") or str(e)
+            except ValueError:
+                message = str(e)
+            raise RuntimeError(f"{e.code}: {message}") from None
+        except (urllib.error.URLError, OSError) as e:
+            raise RuntimeError(f"query service unreachable: {getattr(e, 'reason', e)}") from None
+
+    def writes(self) -> List[dict]:
+        """Write-behind status of every Sheets tab the service has written to."""
+        return self._request("GET", "/writes")["sheets"]
+
+    def flush_writes(self, timeout: float = SERVICE_WAIT_TIMEOUT) -> dict:
+        return self._request("POST", "/writes/flush", {"timeout": timeout})
+
+    def jobs(self) -> List[dict]:
+        return self._request("GET", f"/jobs?user={urllib.parse.quote(self.user)}")["jobs"]
+
+    @staticmethod
+    def frame(job: dict) -> Optional[pd.DataFrame]:
+        result = job.get("result")
+        if result is None:
+            return None
+        return pd.DataFrame(result["data"], columns=result["columns"])
+
+
+class RemoteResult:
+    """ResultStore-like view of a finished job's result; pages and exports are fetched on demand."""
+
+    def __init__(self, client: ServiceClient, job: dict):
+        self.client = client
+        self.job_id = job["id"]
+        self.columns: List[str] = job["result"]["columns"]
+        self.rows: int = job["result"]["row_count"]
+        self.attrs = {"result_cache": job["result"].get("cache")}
+
+    def pages(self, page_size: int = RESULT_PAGE_SIZE) -> int:
+        return max(1, -(-self.rows // page_size))
+
+    def page(self, page: int = 0, page_size: int = RESULT_PAGE_SIZE, columns: Optional[List[str]] = None,
+             sort_by: Optional[str] = None, ascending: bool = True) -> pd.DataFrame:
+        data = self.client.rows(self.job_id, page, page_size, sort_by, ascending, columns)
+        df = pd.DataFrame(data["data"], columns=data["columns"])
+        df.index = pd.RangeIndex(page * page_size, page * page_size + len(df))
+        return df
+
+    def spool(self, fmt: str, **options):
+        f = tempfile.SpooledTemporaryFile(max_size=RESULT_SPOOL_MAX_BYTES)
+        try:
+            self.client.download(self.job_id, f, fmt, **options)
+        except BaseException:
+            f.close()
+            raise
+        f.seek(0)
+        return f
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=SERVICE_PORT)
+    args = parser.parse_args(argv)
+    service = QueryService()
+    server = make_server(service, args.host, args.port)
+    print(f"query service on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,180 @@
+# sheet_engine.py
+import re
+import sqlite3
+import threading
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from config import SHEET_INDEX_AFTER
+
+
+def _quote(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _records(df: pd.DataFrame) -> List[list]:
+    """Rows as plain Python values with NaN/NaT turned into NULL."""
+    return df.astype(object).where(df.notna(), None).values.tolist()
+
+
+class SheetSQLEngine:
+    """Persistent in-memory SQLite database holding the sheet DataFrames.
+
+    Each distinct DataFrame in df_map is loaded once; other names that point at
+    the same object become views over it rather than second copies. Mutations
+    done by the Sheets handler are applied incrementally through the apply_*
+    methods, which address rows by a rowid array kept in DataFrame order.
+    Columns that keep showing up in WHERE clauses get an index once they have
+    been filtered on `index_after` times.
+    """
+
+    def __init__(self, index_after: int = SHEET_INDEX_AFTER):
+        self.index_after = index_after
+        self._db = sqlite3.connect(":memory:", check_same_thread=False)
+        self._lock = threading.RLock()
+        self._frames: Dict[str, pd.DataFrame] = {}   # name -> registered DataFrame object
+        self._physical: Dict[str, str] = {}          # name -> backing table
+        self._rowids: Dict[str, np.ndarray] = {}     # backing table -> rowid per DataFrame row
+        self._next_rowid: Dict[str, int] = {}
+        self._filter_counts: Dict[tuple, int] = {}
+        self._indexed: set = set()
+
+    def sync(self, df_map: Dict[str, pd.DataFrame]):
+        """(Re)load any table whose DataFrame object changed since it was registered."""
+        with self._lock:
+            groups: Dict[int, List[str]] = {}
+            for name, df in df_map.items():
+                groups.setdefault(id(df), []).append(name)
+            for names in groups.values():
+                df = df_map[names[0]]
+                if any(self._frames.get(n) is not df for n in names):
+                    self.register(names, df)
+
+    def register(self, names: List[str], df: pd.DataFrame):
+        """Load df as the first name and expose the remaining names as views."""
+        with self._lock:
+            physical = names[0]
+            for name in names:
+                self._drop(name)
+            df.to_sql(physical, self._db, index=False)
+            self._rowids[physical] = np.arange(1, len(df) + 1, dtype=np.int64)
+            self._next_rowid[physical] = len(df) + 1
+            for alias in names[1:]:
+                self._db.execute(f"CREATE VIEW {_quote(alias)} AS SELECT * FROM {_quote(physical)}")
+            for name in names:
+                self._frames[name] = df
+                self._physical[name] = physical
+            self._db.commit()
+
+    def _drop(self, name: str):
+        physical = self._physical.pop(name, None)
+        self._frames.pop(name, None)
+        if physical is None:
+            return
+        if physical == name:
+            # views over the table go with it
+            for alias in [a for a, p in self._physical.items() if p == physical]:
+                self._db.execute(f"DROP VIEW IF EXISTS {_quote(alias)}")
+                self._physical.pop(alias, None)
+                self._frames.pop(alias, None)
+            self._db.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+            self._rowids.pop(physical, None)
+            self._indexed = {ix for ix in self._indexed if ix[0] != physical}
+        else:
+            self._db.execute(f"DROP VIEW IF EXISTS {_quote(name)}")
+
+    def query(self, sql: str) -> pd.DataFrame:
+        with self._lock:
+            self._note_filters(sql)
+            return pd.read_sql_query(sql, self._db)
+
+    def check(self, sql: str):
+        """Compile sql without running it; raises sqlite3.Error for unknown tables/columns or bad syntax."""
+        with self._lock:
+            self._db.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+
+    def _columns(self, physical: str) -> List[str]:
+        return [row[1] for row in self._db.execute(f"PRAGMA table_info({_quote(physical)})")]
+
+    def _note_filters(self, sql: str):
+        m = re.search(r"\bwhere\b(.*)", sql, flags=re.I | re.S)
+        if not m or self.index_after <= 0:
+            return
+        referenced = {c.strip('`"[]') for c in
+                      re.findall(r"([`\"\[]?\w+[`\"\]]?)\s*(?:=|<|>|\bin\b|\blike\b|\bbetween\b)",
+                                 m.group(1), flags=re.I)}
+        for physical in set(self._physical.values()):
+            for col in self._columns(physical):
+                if col in referenced:
+                    key = (physical, col)
+                    self._filter_counts[key] = self._filter_counts.get(key, 0) + 1
+                    if self._filter_counts[key] >= self.index_after:
+                        self.create_index(physical, col)
+
+    def create_index(self, name: str, column: str):
+        with self._lock:
+            physical = self._physical.get(name, name)
+            if (physical, column) in self._indexed:
+                return
+            ix = _quote(f"ix_{physical}_{column}")
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS {ix} ON {_quote(physical)} ({_quote(column)})")
+            self._indexed.add((physical, column))
+
+    def _rebind(self, name: str, df: pd.DataFrame):
+        physical = self._physical[name]
+        for alias, p in self._physical.items():
+            if p == physical:
+                self._frames[alias] = df
+
+    def apply_insert(self, name: str, rows: pd.DataFrame, new_df: pd.DataFrame):
+        """Append rows (already appended to new_df) to the backing table."""
+        with self._lock:
+            if name not in self._physical:
+                return
+            physical = self._physical[name]
+            existing = self._columns(physical)
+            for col in rows.columns:
+                if col not in existing:
+                    self._db.execute(f"ALTER TABLE {_quote(physical)} ADD COLUMN {_quote(col)}")
+            start = self._next_rowid[physical]
+            rowids = np.arange(start, start + len(rows), dtype=np.int64)
+            cols = ", ".join(_quote(c) for c in rows.columns)
+            marks = ", ".join("?" for _ in range(len(rows.columns) + 1))
+            self._db.executemany(
+                f"INSERT INTO {_quote(physical)} (rowid, {cols}) VALUES ({marks})",
+                [[int(r)] + rec for r, rec in zip(rowids, _records(rows))])
+            self._rowids[physical] = np.concatenate([self._rowids[physical], rowids])
+            self._next_rowid[physical] = start + len(rows)
+            self._db.commit()
+            self._rebind(name, new_df)
+
+    def apply_update(self, name: str, mask: np.ndarray, assignments: Dict[str, object], new_df: pd.DataFrame):
+        """Set columns to constant values on the rows selected by mask."""
+        with self._lock:
+            if name not in self._physical:
+                return
+            physical = self._physical[name]
+            existing = self._columns(physical)
+            for col in assignments:
+                if col not in existing:
+                    self._db.execute(f"ALTER TABLE {_quote(physical)} ADD COLUMN {_quote(col)}")
+            sets = ", ".join(f"{_quote(c)} = ?" for c in assignments)
+            values = [None if pd.isna(v) else v for v in assignments.values()]
+            self._db.executemany(f"UPDATE {_quote(physical)} SET {sets} WHERE rowid = ?",
+                                 [values + [int(r)] for r in self._rowids[physical][mask]])
+            self._db.commit()
+            self._rebind(name, new_df)
+
+    def apply_delete(self, name: str, mask: np.ndarray, new_df: pd.DataFrame):
+        """Remove the rows selected by mask."""
+        with self._lock:
+            if name not in self._physical:
+                return
+            physical = self._physical[name]
+            self._db.executemany(f"DELETE FROM {_quote(physical)} WHERE rowid = ?",
+                                 [(int(r),) for r in self._rowids[physical][mask]])
+            self._rowids[physical] = self._rowids[physical][~mask]
+            self._db.commit()
+            self._rebind(name, new_df)
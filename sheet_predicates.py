@@ -0,0 +1,483 @@
+# sheet_predicates.py
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype, is_string_dtype
+
+from sql_utils import Token, tokenize, is_keyword
+
+_FUNCTIONS = {"upper", "lower", "trim"}
+_COMPARISONS = {"=", "!=", "<>", "<", "<=", ">", ">="}
+
+# An operand evaluates against a DataFrame to ("col", Series) or ("lit", value).
+Operand = Callable[[pd.DataFrame], Tuple[str, object]]
+# A predicate evaluates to a nullable boolean Series: NA is SQL's unknown (a NULL
+# operand), which pandas' Kleene &, | and ~ carry through AND, OR and NOT.
+Predicate = Callable[[pd.DataFrame], pd.Series]
+
+
+def resolve_column(df: pd.DataFrame, name: str) -> str:
+    """Match a (possibly table-qualified) column name, falling back to case-insensitive."""
+    if name in df.columns:
+        return name
+    lowered = {str(c).lower(): c for c in df.columns}
+    if name.lower() in lowered:
+        return lowered[name.lower()]
+    raise ValueError(f"Unknown column '{name}'.")
+
+
+def is_text(series: pd.Series) -> bool:
+    """True for object and pandas string columns."""
+    return is_string_dtype(series.dtype)
+
+
+def _number(text: str):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _as_number(value):
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float, np.number)):
+        return value
+    if isinstance(value, str):
+        try:
+            return _number(value.strip())
+        except ValueError:
+            return None
+    return None
+
+
+def coerce_value(series: pd.Series, value):
+    """Convert a literal to the column's dtype so comparisons stay typed (None if impossible)."""
+    if value is None:
+        return None
+    if is_bool_dtype(series.dtype):
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes")
+        return bool(value)
+    if is_numeric_dtype(series.dtype):
+        return _as_number(value)
+    if is_datetime64_any_dtype(series.dtype):
+        try:
+            return pd.Timestamp(value)
+        except (ValueError, TypeError):
+            return None
+    return value
+
+
+def _object_candidates(value) -> list:
+    """Forms a literal may take in an object column holding mixed strings/numbers."""
+    out = [value]
+    number = _as_number(value)
+    if number is not None:
+        out.append(number)
+        if isinstance(value, str):
+            out.append(float(number))
+        else:
+            out.append(str(int(number)) if float(number).is_integer() else str(number))
+    return out
+
+
+def _falses(df: pd.DataFrame) -> pd.Series:
+    return pd.Series(False, index=df.index)
+
+
+def _unknowns(df: pd.DataFrame) -> pd.Series:
+    return pd.Series(pd.NA, index=df.index, dtype="boolean")
+
+
+def _nulls(series: pd.Series) -> pd.Series:
+    """NULL cells: missing values, and empty strings in text columns (empty sheet cells)."""
+    mask = series.isna()
+    if is_text(series):
+        mask |= series.eq("").fillna(False).astype(bool)
+    return mask
+
+
+def _unknown_where_null(mask: pd.Series, *operands) -> pd.Series:
+    """mask as a nullable boolean that is NA wherever a column operand is NULL."""
+    out = mask.fillna(False).astype(bool).astype("boolean")
+    for kind, value in operands:
+        if kind == "col":
+            out[_nulls(value).to_numpy()] = pd.NA
+        elif value is None:
+            return pd.Series(pd.NA, index=out.index, dtype="boolean")
+    return out
+
+
+def _compare(left: pd.Series, op: str, value) -> pd.Series:
+    if op == "=":
+        return left == value
+    if op in ("!=", "<>"):
+        return left != value
+    if op == "<":
+        return left < value
+    if op == "<=":
+        return left <= value
+    if op == ">":
+        return left > value
+    return left >= value
+
+
+_FLIP = {"<": ">", "<=": ">=", ">": "<", ">=": "<=", "=": "=", "!=": "!=", "<>": "<>"}
+
+
+def _compare_column_literal(df: pd.DataFrame, series: pd.Series, op: str, value) -> pd.Series:
+    if value is None:
+        return _unknowns(df)
+    if is_text(series):
+        if op in ("=", "!=", "<>"):
+            mask = series.isin(_object_candidates(value))
+            return mask if op == "=" else ~mask & series.notna()
+        try:
+            return _compare(series, op, value).fillna(False).astype(bool)
+        except TypeError:
+            number = _as_number(value)
+            if number is not None:
+                return _compare(pd.to_numeric(series, errors="coerce"), op, number).fillna(False)
+            return _compare(series.astype(str), op, str(value))
+    typed = coerce_value(series, value)
+    if typed is None:
+        # e.g. 'abc' against a numeric column: never equal, always different
+        return ~_falses(df) if op in ("!=", "<>") else _falses(df)
+    return _compare(series, op, typed)
+
+
+def like_to_regex(pattern: str) -> str:
+    out = []
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "\\" and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+            continue
+        out.append(".*" if ch == "%" else "." if ch == "_" else re.escape(ch))
+        i += 1
+    return "".join(out)
+
+
+def _strings(series: pd.Series) -> pd.Series:
+    return series if is_text(series) else series.astype(str)
+
+
+class _Parser:
+    def __init__(self, tokens: List[Token]):
+        self.tokens = tokens
+        self.i = 0
+
+    def peek(self, offset: int = 0) -> Optional[Token]:
+        j = self.i + offset
+        return self.tokens[j] if j < len(self.tokens) else None
+
+    def next(self) -> Token:
+        tok = self.peek()
+        if tok is None:
+            raise ValueError("Unexpected end of WHERE clause.")
+        self.i += 1
+        return tok
+
+    def accept_kw(self, *words: str) -> bool:
+        tok = self.peek()
+        if tok is not None and is_keyword(tok, *words):
+            self.i += 1
+            return True
+        return False
+
+    def accept_op(self, op: str) -> bool:
+        tok = self.peek()
+        if tok is not None and tok.kind == "op" and tok.value == op:
+            self.i += 1
+            return True
+        return False
+
+    def expect_op(self, op: str):
+        if not self.accept_op(op):
+            tok = self.peek()
+            raise ValueError(f"Expected '{op}' near {tok.value if tok else 'end of clause'!r}.")
+
+    # boolean layer
+    def parse_or(self) -> Predicate:
+        left = self.parse_and()
+        while self.accept_kw("or"):
+            right = self.parse_and()
+            left = (lambda a, b: lambda df: a(df) | b(df))(left, right)
+        return left
+
+    def parse_and(self) -> Predicate:
+        left = self.parse_not()
+        while self.accept_kw("and"):
+            right = self.parse_not()
+            left = (lambda a, b: lambda df: a(df) & b(df))(left, right)
+        return left
+
+    def parse_not(self) -> Predicate:
+        if self.accept_kw("not"):
+            inner = self.parse_not()
+            return lambda df: ~inner(df)
+        return self.parse_predicate()
+
+    def parse_predicate(self) -> Predicate:
+        tok = self.peek()
+        if tok is not None and tok.kind == "op" and tok.value == "(":
+            self.i += 1
+            inner = self.parse_or()
+            self.expect_op(")")
+            return inner
+        left = self.parse_operand()
+        negate = self.accept_kw("not")
+        if self.accept_kw("in"):
+            self.expect_op("(")
+            items = [self.parse_operand()]
+            while self.accept_op(","):
+                items.append(self.parse_operand())
+            self.expect_op(")")
+            pred = self._in(left, items)
+        elif self.accept_kw("like"):
+            pred = self._like(left, self.parse_operand())
+        elif self.accept_kw("between"):
+            low = self.parse_operand()
+            if not self.accept_kw("and"):
+                raise ValueError("BETWEEN requires AND.")
+            high = self.parse_operand()
+            pred = (lambda a, b, c: lambda df: self._binary(df, a, ">=", b) & self._binary(df, a, "<=", c))(
+                left, low, high)
+        elif not negate and self.accept_kw("is"):
+            is_not = self.accept_kw("not")
+            if not self.accept_kw("null"):
+                raise ValueError("Expected NULL after IS.")
+            pred = self._is_null(left)
+            return (lambda p: lambda df: ~p(df))(pred) if is_not else pred
+        else:
+            if negate:
+                raise ValueError("Expected IN, LIKE or BETWEEN after NOT.")
+            tok = self.next()
+            if tok.kind != "op" or tok.value not in _COMPARISONS:
+                raise ValueError(f"Unsupported operator {tok.value!r} in WHERE clause.")
+            right = self.parse_operand()
+            op = tok.value
+            return lambda df: self._binary(df, left, op, right)
+        return (lambda p: lambda df: ~p(df))(pred) if negate else pred
+
+    # operands
+    def parse_operand(self) -> Operand:
+        tok = self.next()
+        if tok.kind == "op" and tok.value == "-":
+            num = self.next()
+            if num.kind != "number":
+                raise ValueError("Expected a number after '-'.")
+            value = -_number(num.value)
+            return lambda df: ("lit", value)
+        if tok.kind == "number":
+            value = _number(tok.value)
+            return lambda df: ("lit", value)
+        if tok.kind == "string":
+            value = tok.value
+            return lambda df: ("lit", value)
+        if tok.kind == "ident" and tok.value.lower() in ("null", "true", "false"):
+            value = {"null": None, "true": True, "false": False}[tok.value.lower()]
+            return lambda df: ("lit", value)
+        if tok.kind == "ident" and tok.value.lower() in _FUNCTIONS and self.accept_op("("):
+            inner = self.parse_operand()
+            self.expect_op(")")
+            return self._function(tok.value.lower(), inner)
+        if tok.kind in ("ident", "qident"):
+            name = tok.value
+            while self.accept_op("."):
+                name = self.next().value
+            quoted_text = tok.kind == "qident" and name == tok.value
+
+            def column(df, name=name, quoted_text=quoted_text):
+                try:
+                    return "col", df[resolve_column(df, name)]
+                except ValueError:
+                    if quoted_text:
+                        return "lit", name  # "text" used as a string literal
+                    raise
+            return column
+        raise ValueError(f"Unexpected token {tok.value!r} in WHERE clause.")
+
+    @staticmethod
+    def _function(name: str, inner: Operand) -> Operand:
+        def apply(df):
+            kind, value = inner(df)
+            if kind == "lit":
+                if value is None:
+                    return kind, None
+                text = str(value)
+                return kind, text.upper() if name == "upper" else text.lower() if name == "lower" else text.strip()
+            if not is_text(value):
+                return kind, value if name == "trim" else value.astype(str).where(value.notna())
+            s = value.str
+            return kind, s.upper() if name == "upper" else s.lower() if name == "lower" else s.strip()
+        return apply
+
+    @staticmethod
+    def _binary(df: pd.DataFrame, left: Operand, op: str, right: Operand) -> pd.Series:
+        lk, lv = left(df)
+        rk, rv = right(df)
+        if lk == "col" and rk == "col":
+            mask = _compare(lv, op, rv)
+        elif lk == "lit" and rk == "lit":
+            result = lv is not None and rv is not None and bool(_compare(pd.Series([lv]), op, rv).iloc[0])
+            mask = pd.Series(result, index=df.index)
+        elif lk == "lit":
+            mask = _compare_column_literal(df, rv, _FLIP[op], lv)
+        else:
+            mask = _compare_column_literal(df, lv, op, rv)
+        return _unknown_where_null(mask, (lk, lv), (rk, rv))
+
+    @staticmethod
+    def _in(left: Operand, items: List[Operand]) -> Predicate:
+        def pred(df):
+            kind, series = left(df)
+            values = [item(df)[1] for item in items]
+            if kind == "lit":
+                mask = pd.Series(series in values, index=df.index)
+            elif is_text(series):
+                mask = series.isin([c for v in values if v is not None for c in _object_candidates(v)])
+            else:
+                mask = series.isin([c for c in (coerce_value(series, v) for v in values) if c is not None])
+            mask = _unknown_where_null(mask, (kind, series))
+            if None in values:
+                mask[~mask.fillna(False)] = pd.NA   # x IN (..., NULL) is unknown unless x matched
+            return mask
+        return pred
+
+    @staticmethod
+    def _like(left: Operand, pattern: Operand) -> Predicate:
+        def pred(df):
+            kind, series = left(df)
+            _, pat = pattern(df)
+            regex = like_to_regex(str(pat))
+            if kind == "lit":
+                mask = pd.Series(series is not None and bool(re.fullmatch(regex, str(series), flags=re.I | re.S)),
+                                 index=df.index)
+            else:
+                mask = _strings(series).str.fullmatch(regex, case=False, na=False)
+            return _unknown_where_null(mask, (kind, series), ("lit", pat))
+        return pred
+
+    @staticmethod
+    def _is_null(left: Operand) -> Predicate:
+        def pred(df):
+            kind, series = left(df)
+            if kind == "lit":
+                return pd.Series(series is None, index=df.index)
+            return _nulls(series)
+        return pred
+
+
+def compile_where(where_sql: str) -> Predicate:
+    """Compile a SQL WHERE expression into a function df -> boolean mask Series.
+
+    Supports AND/OR/NOT, parentheses, = != <> < <= > >=, [NOT] IN, [NOT] LIKE,
+    [NOT] BETWEEN, IS [NOT] NULL and UPPER()/LOWER()/TRIM(). Literals are
+    converted to each column's dtype instead of stringifying the column.
+    """
+    parser = _Parser(tokenize(where_sql))
+    pred = parser.parse_or()
+    if parser.peek() is not None:
+        raise ValueError(f"Unexpected {parser.peek().value!r} in WHERE clause.")
+    return lambda df: pred(df).fillna(False).astype(bool)
+
+
+def parse_literal(tok: Token):
+    """Python value of a literal token (numbers typed, NULL -> None)."""
+    if tok.kind == "number":
+        return _number(tok.value)
+    if tok.kind in ("string", "qident"):
+        return tok.value
+    if tok.kind == "ident" and tok.value.lower() in ("null", "true", "false"):
+        return {"null": None, "true": True, "false": False}[tok.value.lower()]
+    raise ValueError(f"Only literal values are supported, got {tok.value!r}.")
+
+
+def parse_literal_tuple(tokens: List[Token], i: int) -> Tuple[list, int]:
+    """Parse "( literal, ... )" starting at tokens[i]; returns (values, next index)."""
+    if not (tokens[i].kind == "op" and tokens[i].value == "("):
+        raise ValueError("Expected '(' in VALUES.")
+    values = []
+    i += 1
+    while True:
+        tok = tokens[i]
+        if tok.kind == "op" and tok.value == "-" and tokens[i + 1].kind == "number":
+            values.append(-_number(tokens[i + 1].value))
+            i += 2
+        else:
+            values.append(parse_literal(tok))
+            i += 1
+        sep = tokens[i]
+        i += 1
+        if sep.kind == "op" and sep.value == ")":
+            return values, i
+        if not (sep.kind == "op" and sep.value == ","):
+            raise ValueError(f"Unexpected {sep.value!r} in VALUES.")
+
+
+def coerce_column_values(series: pd.Series, values: list) -> list:
+    """Convert inserted literals to the column dtype where they fit, else keep them as given."""
+    if is_text(series) or not len(values):
+        return values
+    converted = [coerce_value(series, v) for v in values]
+    if all(c is not None or v is None for c, v in zip(converted, values)):
+        return converted
+    return values
+
+
+def widened_dtype(series: pd.Series, values: list):
+    """Dtype holding both the column and `values` unchanged.
+
+    Numeric columns widen (int8 -> int16 for 5000, int -> float64 for 1.5 or
+    NULL, -> object for text or out-of-range numbers); others keep their dtype.
+    """
+    dtype = series.dtype
+    if not isinstance(dtype, np.dtype) or dtype.kind not in "iuf":
+        return dtype
+    for value in values:
+        if value is None:
+            if dtype.kind in "iu":
+                dtype = np.result_type(dtype, np.float64)
+        elif isinstance(value, (bool, np.bool_)) or not isinstance(value, (int, float, np.number)):
+            return np.dtype(object)
+        elif isinstance(value, (float, np.floating)):
+            dtype = np.result_type(dtype, np.float64)   # min_scalar_type would pick a lossy float16
+        else:
+            dtype = np.result_type(dtype, np.min_scalar_type(value))
+    return dtype
+
+
+def assignments_from_set(tokens: List[Token]) -> Dict[str, object]:
+    """Parse "col = literal, ..." tokens of an UPDATE SET clause."""
+    out = {}
+    i = 0
+    while i < len(tokens):
+        name_tok = tokens[i]
+        if name_tok.kind not in ("ident", "qident"):
+            raise ValueError(f"Invalid SET clause near {name_tok.value!r}")
+        name = name_tok.value
+        i += 1
+        while i < len(tokens) and tokens[i].kind == "op" and tokens[i].value == ".":
+            name = tokens[i + 1].value
+            i += 2
+        if i >= len(tokens) or tokens[i].value != "=":
+            raise ValueError(f"Invalid SET clause: {name}")
+        i += 1
+        if tokens[i].kind == "op" and tokens[i].value == "-" and i + 1 < len(tokens):
+            value = -_number(tokens[i + 1].value)
+            i += 2
+        else:
+            value = parse_literal(tokens[i])
+            i += 1
+        out[name] = value
+        if i < len(tokens):
+            if not (tokens[i].kind == "op" and tokens[i].value == ","):
+                raise ValueError(f"Unsupported expression in SET clause near {tokens[i].value!r}")
+            i += 1
+    return out
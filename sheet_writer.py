@@ -0,0 +1,466 @@
+# sheet_writer.py
+"""Write-behind queue for Google Sheets mutations.
+
+execute_sheet_sql_on_df applies INSERT/UPDATE/DELETE to the in-memory frame at
+once and hands the row-level change to the process-wide SheetWriter. A
+background thread pushes a tab's pending changes SHEET_WRITE_DELAY seconds
+after the first one (or once SHEET_WRITE_MAX_OPS are pending, or on flush()),
+coalesced into at most three requests: one batched row delete, one
+batch_update of the changed cells and one append.
+
+Row positions are only trusted from a session whose frame matches what the
+tab's queue holds (frame versions, see gsheets_utils.frame_version). A
+statement from a frame that another session's writes have overtaken is
+queued as SQL instead and re-run against the tab's current contents when it
+is flushed, so only its real difference is written.
+
+Changes to a tab are written in order; 429 and 5xx answers are retried with
+truncated exponential backoff, other errors stop that tab (status() reports
+them) until flush() retries or discard() drops its changes. Every statement
+is kept in an fsync'd JSON-lines journal (SHEET_WRITE_JOURNAL) until it has
+reached the sheet, and open_google_workbook() re-runs statements a previous
+process left unwritten (one process per journal file). Delivery is therefore at least once: a crash in the
+middle of a flush can apply that flush twice.
+"""
+import atexit
+import itertools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+import numpy as np
+
+from config import (SHEET_WRITE_DELAY, SHEET_WRITE_MAX_OPS, SHEET_WRITE_MAX_RETRIES, SHEET_WRITE_JOURNAL)
+from gsheets_utils import (append_sheet_values, delete_sheet_rows, execute_sheet_sql_on_df, frame_from_values,
+                           overwrite_sheet, push_df_to_sheet, safe_table_name, sheet_values_with_header,
+                           write_sheet_cells)
+from tracing import span
+
+logger = logging.getLogger("text_to_sql.sheet_writer")
+
+BACKOFF_MAX_SECONDS = 64   # Sheets API guidance: exponential backoff capped at 64 s, with jitter
+
+# _SheetQueue.version once no loaded frame is known to match the tab (frame versions start at 1)
+_STALE = 0
+
+
+def replay_statements(ws, statements: List[str]):
+    """Re-run statements on the tab's current contents and write only the difference."""
+    with span("sheets.replay", sheet=ws.title, statements=len(statements)):
+        old, _ = frame_from_values(ws.get_all_values())
+        df = old.copy()
+        df_map = {ws.title: df, safe_table_name(ws.title): df}
+        for sql in statements:
+            _, err = execute_sheet_sql_on_df(df_map, sql, {})
+            if err:
+                logger.warning("could not replay %r on %r: %s", sql, ws.title, err)
+        df = df_map[ws.title]
+        if df.empty or list(df.columns) != list(old.columns):
+            overwrite_sheet(ws, sheet_values_with_header(df))
+        else:
+            push_df_to_sheet(ws, df, previous=old)
+
+
+_STEPS = {
+    "delete": delete_sheet_rows,
+    "update": write_sheet_cells,
+    "append": append_sheet_values,
+    "overwrite": overwrite_sheet,
+    "replay": replay_statements,
+}
+
+
+def _retryable(e: Exception) -> bool:
+    """Quota (429), server (5xx) and connection errors are worth retrying."""
+    status = getattr(getattr(e, "response", None), "status_code", None) or getattr(e, "code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return isinstance(e, (ConnectionError, TimeoutError))
+
+
+class _Batch:
+    """Changes to one tab since the state it had when the batch opened (base_rows data rows).
+
+    Rows keep their order under INSERT (appends at the end), UPDATE and DELETE,
+    so the surviving base rows always come first: origin[i] is the base row of
+    current row i (-1 if appended) and cells[i] its new values, if changed.
+    A replay batch holds statements to re-run at flush time instead.
+    """
+
+    def __init__(self, base_rows: int, replay: bool = False):
+        self.base_rows = base_rows
+        self.replay: Optional[List[str]] = [] if replay else None
+        self.origin = np.arange(base_rows, dtype=np.int64)
+        self.cells: List[Optional[List[str]]] = [None] * base_rows
+        self.dirty_cols = set()
+        self.overwrite: Optional[List[List[str]]] = None   # header + rows once the columns changed
+        self.seqs: List[int] = []
+        self.opened = time.monotonic()
+
+    @property
+    def rows(self) -> int:
+        return len(self.overwrite) - 1 if self.overwrite is not None else len(self.origin)
+
+    def apply(self, op: dict):
+        kind = op["op"]
+        if kind == "replay":
+            self.replay.append(op["sql"])
+        elif kind == "overwrite":
+            self.overwrite = op["values"]
+        elif self.overwrite is not None:
+            header, rows = self.overwrite[0], self.overwrite[1:]
+            if kind == "append":
+                rows.extend(op["values"])
+            elif kind == "update":
+                for p, row in zip(op["positions"], op["values"]):
+                    rows[p] = row
+            else:
+                dropped = set(int(p) for p in op["positions"])
+                rows = [row for i, row in enumerate(rows) if i not in dropped]
+            self.overwrite = [header] + rows
+        elif kind == "append":
+            self.origin = np.concatenate([self.origin, np.full(len(op["values"]), -1, dtype=np.int64)])
+            self.cells.extend(op["values"])
+        elif kind == "update":
+            for p, row in zip(op["positions"], op["values"]):
+                self.cells[p] = row
+            self.dirty_cols.update(op["columns"])
+        else:
+            keep = np.ones(len(self.origin), dtype=bool)
+            keep[np.asarray(op["positions"], dtype=np.int64)] = False
+            self.origin = self.origin[keep]
+            self.cells = list(itertools.compress(self.cells, keep))
+
+    def steps(self) -> List[tuple]:
+        """The requests that bring the sheet from the base state to the current one."""
+        if self.replay is not None:
+            return [("replay", (self.replay,))]
+        if self.overwrite is not None:
+            return [("overwrite", (self.overwrite,))]
+        steps = []
+        kept = int((self.origin >= 0).sum())
+        deleted = np.setdiff1d(np.arange(self.base_rows, dtype=np.int64), self.origin[:kept])
+        if len(deleted):
+            steps.append(("delete", (deleted,)))
+        # after the delete the surviving base rows sit at positions 0..kept-1
+        updated = [p for p, row in enumerate(self.cells[:kept]) if row is not None]
+        if updated and self.dirty_cols:
+            lo, hi = min(self.dirty_cols), max(self.dirty_cols)
+            steps.append(("update", (np.asarray(updated, dtype=np.int64),
+                                     [self.cells[p][lo:hi + 1] for p in updated], lo, hi)))
+        if kept < len(self.cells):
+            steps.append(("append", (self.cells[kept:],)))
+        return steps
+
+
+class _Plan:
+    """A closed batch waiting to be written; steps are removed as they succeed."""
+
+    def __init__(self, batch: _Batch):
+        self.steps = batch.steps()
+        self.seqs = batch.seqs
+
+
+class _SheetQueue:
+    def __init__(self, ws):
+        self.ws = ws
+        self.plans: Deque[_Plan] = deque()
+        self.batch: Optional[_Batch] = None
+        self.state = "idle"    # idle | pending | flushing | retrying | failed
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.retry_at = 0.0
+        self.force = False
+        self.written = 0
+        self.version: Optional[int] = None   # frame version the queued changes lead to
+        self.generation = 0                  # statements submitted so far
+
+    @property
+    def pending(self) -> int:
+        return sum(len(p.seqs) for p in self.plans) + (len(self.batch.seqs) if self.batch else 0)
+
+
+class _Journal:
+    """Append-only JSON lines: {"seq", "spreadsheet", "sheet", "sql"} per statement and
+    {"done": [seq, ...]} once those reached the sheet. Truncated when nothing is open."""
+
+    def __init__(self, path: str):
+        self.path = path
+        records, done, torn = {}, set(), False
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    torn = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue   # torn last line
+                    if "done" in record:
+                        done.update(record["done"])
+                    else:
+                        records[record["seq"]] = record
+        # statements a previous process never wrote, replayed by SheetWriter.recover()
+        self.unwritten: Dict[int, dict] = {seq: r for seq, r in records.items() if seq not in done}
+        self._seq = itertools.count(max(records, default=0) + 1)
+        self._open = set(self.unwritten)
+        self._file = open(path, "a", encoding="utf-8")
+        if torn:
+            self._file.write("\n")   # keep the next record off the partial line
+
+    def _write(self, record: dict):
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def append(self, spreadsheet, sheet: str, sql: str) -> int:
+        seq = next(self._seq)
+        self._write({"seq": seq, "spreadsheet": spreadsheet, "sheet": sheet, "sql": sql, "ts": time.time()})
+        self._open.add(seq)
+        return seq
+
+    def done(self, seqs: List[int]):
+        self._open.difference_update(seqs)
+        if self._open:
+            self._write({"done": list(seqs)})
+        else:
+            self._file.truncate(0)
+
+
+class SheetWriter:
+    """Per-tab write-behind queues served by one background thread."""
+
+    def __init__(self, delay: float = SHEET_WRITE_DELAY, max_ops: int = SHEET_WRITE_MAX_OPS,
+                 max_retries: int = SHEET_WRITE_MAX_RETRIES, journal_path: str = SHEET_WRITE_JOURNAL):
+        self.delay = delay
+        self.max_ops = max_ops
+        self.max_retries = max_retries
+        self._journal = _Journal(journal_path) if journal_path else None
+        self._seq = itertools.count(1)
+        self._queues: Dict[tuple, _SheetQueue] = {}
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _key(ws) -> tuple:
+        return getattr(ws.spreadsheet, "id", None), ws.id
+
+    def submit(self, ws, sql: str, rows_before: int, op: dict, base_version: Optional[int] = None,
+               version: Optional[int] = None) -> int:
+        """Queue one statement's change to ws; rows_before is the tab's row count before it ran.
+
+        op is {"op": "append", "values"} | {"op": "update", "positions", "columns", "values"}
+        | {"op": "delete", "positions"} | {"op": "overwrite", "values"}: cells as strings,
+        positions 0-based without the header, update values full rows. base_version and
+        version are the frame's versions before and after the statement; when base_version
+        is not the version the queue leads to, op is dropped and sql re-run at flush time.
+        """
+        with self._cond:
+            q = self._queues.get(self._key(ws))
+            if q is None:
+                q = self._queues[self._key(ws)] = _SheetQueue(ws)
+            q.ws = ws
+            if self._journal is not None:
+                seq = self._journal.append(self._key(ws)[0], ws.title, sql)
+            else:
+                seq = next(self._seq)
+            stale = base_version is not None and q.version is not None and base_version != q.version
+            if stale:
+                op = {"op": "replay", "sql": sql}   # positions refer to rows the tab may no longer have there
+            if q.batch is not None and (stale != (q.batch.replay is not None) or
+                                        (not stale and q.batch.rows != rows_before and op["op"] != "overwrite")):
+                self._close_batch(q)   # the tab changed outside this queue: start from its new state
+            if q.batch is None:
+                q.batch = _Batch(rows_before, replay=stale)
+            q.batch.apply(op)
+            q.batch.seqs.append(seq)
+            q.version = _STALE if stale else version
+            q.generation += 1
+            if q.state == "idle":
+                q.state = "pending"
+            self._start()
+            self._cond.notify_all()
+        return seq
+
+    def _close_batch(self, q: _SheetQueue):
+        q.plans.append(_Plan(q.batch))
+        q.batch = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sheet-writer", daemon=True)
+            self._thread.start()
+
+    def _next(self) -> Optional[_SheetQueue]:
+        """A queue with a plan that may be written now; closes batches that are due. Lock held."""
+        now = time.monotonic()
+        for q in self._queues.values():
+            b = q.batch
+            if b is not None and (q.force or len(b.seqs) >= self.max_ops or now - b.opened >= self.delay):
+                self._close_batch(q)
+                q.force = False
+        for q in self._queues.values():
+            if q.plans and q.state != "failed" and now >= q.retry_at:
+                return q
+        return None
+
+    def _wait_time(self) -> Optional[float]:
+        now = time.monotonic()
+        times = [q.batch.opened + self.delay - now for q in self._queues.values() if q.batch is not None]
+        times += [q.retry_at - now for q in self._queues.values() if q.plans and q.state == "retrying"]
+        return max(0.0, min(times)) if times else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                q = self._next()
+                while q is None:
+                    self._cond.wait(self._wait_time())
+                    q = self._next()
+                q.state = "flushing"
+                plan = q.plans[0]
+            self._write(q, plan)
+
+    def _write(self, q: _SheetQueue, plan: _Plan):
+        with span("sheets.flush", sheet=q.ws.title, statements=len(plan.seqs), requests=len(plan.steps)) as s:
+            try:
+                while plan.steps:
+                    kind, args = plan.steps[0]
+                    _STEPS[kind](q.ws, *args)
+                    plan.steps.pop(0)
+            except Exception as e:
+                s.error = f"{type(e).__name__}: {e}"
+                with self._cond:
+                    q.attempts += 1
+                    q.error = s.error
+                    if _retryable(e) and q.attempts <= self.max_retries:
+                        q.state = "retrying"
+                        q.retry_at = time.monotonic() + min(BACKOFF_MAX_SECONDS, 2 ** q.attempts) + random.random()
+                    else:
+                        q.state = "failed"
+                    self._cond.notify_all()
+                logger.warning("sheet write to %r failed (%s): %s", q.ws.title, q.state, s.error)
+                return
+        with self._cond:
+            q.plans.popleft()
+            q.attempts, q.error = 0, None
+            q.written += len(plan.seqs)
+            q.state = "pending" if q.plans or q.batch else "idle"
+            if self._journal is not None:
+                self._journal.done(plan.seqs)
+            self._cond.notify_all()
+
+    def _selected(self, spreadsheet=None, sheet: Optional[str] = None) -> List[_SheetQueue]:
+        return [q for (sid, _), q in self._queues.items()
+                if (spreadsheet is None or sid == spreadsheet) and (sheet is None or q.ws.title == sheet)]
+
+    def flush(self, timeout: Optional[float] = None, spreadsheet=None, sheet: Optional[str] = None) -> bool:
+        """Write pending changes now (failed tabs are retried) and wait; True once none are pending."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            queues = self._selected(spreadsheet, sheet)
+            for q in queues:
+                q.force = True
+                if q.state in ("failed", "retrying"):
+                    q.state, q.retry_at, q.attempts = "pending", 0.0, 0
+            self._start()
+            self._cond.notify_all()
+            while any(q.pending for q in queues) and not any(q.state == "failed" for q in queues):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return not any(q.pending for q in queues)
+
+    def discard(self, spreadsheet=None, sheet: Optional[str] = None) -> int:
+        """Drop pending changes (the in-memory frames keep them: reload the tabs). Returns how many."""
+        with self._cond:
+            dropped = 0
+            for q in self._selected(spreadsheet, sheet):
+                if q.state == "flushing":
+                    continue
+                seqs = [seq for p in q.plans for seq in p.seqs] + (q.batch.seqs if q.batch else [])
+                q.plans.clear()
+                q.batch = None
+                q.state, q.error, q.attempts = "idle", None, 0
+                if self._journal is not None and seqs:
+                    self._journal.done(seqs)
+                if seqs:
+                    q.version = _STALE   # the frames still hold the dropped changes; the tab does not
+                dropped += len(seqs)
+            return dropped
+
+    def load_token(self, ws) -> Optional[int]:
+        """Call before reading ws from the sheet; pass the result to loaded() afterwards."""
+        with self._cond:
+            q = self._queues.get(self._key(ws))
+            return q.generation if q is not None and q.state == "idle" and not q.pending else None
+
+    def loaded(self, ws, token: Optional[int], version: int):
+        """Record that a frame of `version` was read from ws with nothing queued for it
+        in the meantime, so its row positions are trusted again after a replay."""
+        with self._cond:
+            q = self._queues.get(self._key(ws))
+            if q is not None and token is not None and q.generation == token and q.state == "idle":
+                q.version = version
+
+    def pending(self, spreadsheet=None, sheet: Optional[str] = None) -> int:
+        with self._cond:
+            return sum(q.pending for q in self._selected(spreadsheet, sheet))
+
+    def status(self) -> List[dict]:
+        """One entry per tab that has been written to."""
+        now = time.monotonic()
+        with self._cond:
+            return [{"spreadsheet": sid, "sheet": q.ws.title, "state": q.state, "pending": q.pending,
+                     "written": q.written, "error": q.error,
+                     "retry_in": round(max(0.0, q.retry_at - now), 1) if q.state == "retrying" else None}
+                    for (sid, _), q in self._queues.items()]
+
+    def recover(self, book) -> int:
+        """Re-run statements a previous process journalled for book's spreadsheet but never wrote.
+
+        They are applied to the loaded frames (book.set_frame) and queued again.
+        Returns how many were replayed.
+        """
+        if self._journal is None:
+            return 0
+        with self._cond:
+            records = sorted((r for r in self._journal.unwritten.values() if r["spreadsheet"] == book.sh.id),
+                             key=lambda r: r["seq"])
+        replayed = 0
+        with span("sheets.recover", statements=len(records)):
+            for record in records:
+                title = record["sheet"]
+                if title in book.titles():
+                    df_map, ws_map = book.table_maps([title])
+                    _, err = execute_sheet_sql_on_df(df_map, record["sql"], ws_map)
+                    if err:
+                        logger.warning("could not replay %r on %r: %s", record["sql"], title, err)
+                    else:
+                        book.set_frame(title, df_map[title])
+                        replayed += 1
+                else:
+                    logger.warning("tab %r is gone; dropping journalled %r", title, record["sql"])
+                with self._cond:
+                    self._journal.unwritten.pop(record["seq"], None)
+                    self._journal.done([record["seq"]])
+        return replayed
+
+
+_WRITER: Optional[SheetWriter] = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_sheet_writer() -> SheetWriter:
+    """Process-wide writer shared by all sessions; pending writes get a few seconds at exit."""
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None:
+            _WRITER = SheetWriter()
+            atexit.register(_WRITER.flush, 10)
+        return _WRITER
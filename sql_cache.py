@@ -0,0 +1,178 @@
+# sql_cache.py
+import hashlib
+import json
+import math
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from config import SQL_CACHE_PATH, SQL_CACHE_MAX_ENTRIES, SQL_CACHE_TTL, SQL_CACHE_SIMILARITY
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sql_cache (
+    key TEXT PRIMARY KEY,
+    scope TEXT NOT NULL,
+    question TEXT NOT NULL,
+    sql TEXT NOT NULL,
+    embedding TEXT,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS sql_cache_scope ON sql_cache (scope);
+CREATE INDEX IF NOT EXISTS sql_cache_last_access ON sql_cache (last_access);
+"""
+
+
+def normalize_question(question: str) -> str:
+    """Lower-case, collapse whitespace and drop trailing punctuation."""
+    q = re.sub(r"\s+", " ", question.strip().lower())
+    return q.rstrip(" ?.!;")
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def temperature_bucket(temperature: float) -> str:
+    return f"{round(float(temperature), 1):.1f}"
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = math.sqrt(sum(x * x for x in a))
+    nb = math.sqrt(sum(y * y for y in b))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+class SQLCache:
+    """On-disk (SQLite) cache of question -> SQL.
+
+    Entries are scoped by schema fingerprint, system prompt hash and temperature
+    bucket, so a schema or prompt change never serves stale SQL. Eviction is LRU
+    once max_entries is exceeded, plus a TTL. When an `embed` callable is given,
+    misses fall back to the most similar cached question in the same scope if its
+    cosine similarity reaches `similarity`.
+    """
+
+    def __init__(self, path: str = SQL_CACHE_PATH, max_entries: int = SQL_CACHE_MAX_ENTRIES,
+                 ttl: float = SQL_CACHE_TTL, embed: Optional[Callable[[str], List[float]]] = None,
+                 similarity: float = SQL_CACHE_SIMILARITY):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed = embed
+        self.similarity = similarity
+        self.stats: Dict[str, int] = {"hits": 0, "near_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+
+    @staticmethod
+    def scope(schema_context: str, system_prompt: str, temperature: float) -> str:
+        return f"{fingerprint(schema_context)}:{fingerprint(system_prompt)}:{temperature_bucket(temperature)}"
+
+    def _key(self, scope: str, question: str) -> str:
+        return fingerprint(f"{scope}\n{normalize_question(question)}")
+
+    def get(self, question: str, schema_context: str, system_prompt: str, temperature: float) -> Optional[str]:
+        scope = self.scope(schema_context, system_prompt, temperature)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, sql, created_at FROM sql_cache WHERE key = ?",
+                (self._key(scope, question),)).fetchone()
+            if row and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM sql_cache WHERE key = ?", (row[0],))
+                self._db.commit()
+                row = None
+            if row:
+                self._touch(row[0], now)
+                self.stats["hits"] += 1
+                return row[1]
+        if self.embed is not None:
+            sql = self._nearest(scope, question, now)
+            if sql is not None:
+                return sql
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def _nearest(self, scope: str, question: str, now: float) -> Optional[str]:
+        vector = self.embed(normalize_question(question))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, sql, embedding FROM sql_cache "
+                "WHERE scope = ? AND embedding IS NOT NULL AND created_at >= ?",
+                (scope, now - self.ttl)).fetchall()
+            best_key, best_sql, best_score = None, None, self.similarity
+            for key, sql, emb in rows:
+                score = _cosine(vector, json.loads(emb))
+                if score >= best_score:
+                    best_key, best_sql, best_score = key, sql, score
+            if best_key is None:
+                return None
+            self._touch(best_key, now)
+            self.stats["near_hits"] += 1
+            return best_sql
+
+    def _touch(self, key: str, now: float):
+        self._db.execute("UPDATE sql_cache SET last_access = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        self._db.commit()
+
+    def put(self, question: str, schema_context: str, system_prompt: str, temperature: float, sql: str):
+        scope = self.scope(schema_context, system_prompt, temperature)
+        normalized = normalize_question(question)
+        embedding = json.dumps(self.embed(normalized)) if self.embed is not None else None
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sql_cache (key, scope, question, sql, embedding, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(scope, question), scope, normalized, sql, embedding, now, now))
+            self.stats["stores"] += 1
+            self._evict(now)
+            self._db.commit()
+
+    def discard(self, question: str, schema_context: str, system_prompt: str, temperature: float):
+        """Drop the entry for this exact question and scope, if any."""
+        scope = self.scope(schema_context, system_prompt, temperature)
+        with self._lock:
+            self._db.execute("DELETE FROM sql_cache WHERE key = ?", (self._key(scope, question),))
+            self._db.commit()
+
+    def _evict(self, now: float):
+        expired = self._db.execute("DELETE FROM sql_cache WHERE created_at < ?", (now - self.ttl,)).rowcount
+        (count,) = self._db.execute("SELECT COUNT(*) FROM sql_cache").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._db.execute(
+                "DELETE FROM sql_cache WHERE key IN "
+                "(SELECT key FROM sql_cache ORDER BY last_access LIMIT ?)", (overflow,))
+        self.stats["evictions"] += max(expired, 0) + max(overflow, 0)
+
+    def get_or_generate(self, question: str, schema_context: str, system_prompt: str, temperature: float,
+                        generate: Callable[[str, str, str, float], str]) -> str:
+        """Return cached SQL or call generate(question, schema_context, system_prompt, temperature).
+
+        Error results (strings starting with "-- ERROR:") are never cached.
+        """
+        sql = self.get(question, schema_context, system_prompt, temperature)
+        if sql is not None:
+            return sql
+        sql = generate(question, schema_context, system_prompt, temperature)
+        if not sql.startswith("-- ERROR:"):
+            self.put(question, schema_context, system_prompt, temperature, sql)
+        return sql
+
+    def hit_rate(self) -> float:
+        lookups = self.stats["hits"] + self.stats["near_hits"] + self.stats["misses"]
+        return (self.stats["hits"] + self.stats["near_hits"]) / lookups if lookups else 0.0
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM sql_cache")
+            self._db.commit()
+
@@ -1,24 +1,64 @@
 # sql_generator.py
-from config import GOOGLE_API_KEY, DEFAULT_GEMINI_MODEL, SYSTEM_PROMPT_DEFAULT
-import google.generativeai as genai
-from google.generativeai import types
+from config import (GOOGLE_API_KEY, DEFAULT_GEMINI_MODEL, SYSTEM_PROMPT_DEFAULT,
+                    SQL_CACHE_ENABLED, SQL_CACHE_EMBEDDINGS, GEMINI_EMBEDDING_MODEL,
+                    VALIDATE_REPAIR_ATTEMPTS)
+import asyncio
+import re
+import threading
 import time
+from typing import Callable, List, Optional, Tuple
 
-# configure if API key available
-if GOOGLE_API_KEY:
-    genai.configure(api_key=GOOGLE_API_KEY)
+from sql_cache import SQLCache
+from tracing import span, record_usage
+
+_GENAI = None
+_GENAI_LOCK = threading.Lock()
+
+
+def _genai():
+    """google.generativeai, imported and configured on first use (it takes ~1s to import)."""
+    global _GENAI
+    with _GENAI_LOCK:
+        if _GENAI is None:
+            import google.generativeai as genai
+            if GOOGLE_API_KEY:
+                genai.configure(api_key=GOOGLE_API_KEY)
+            _GENAI = genai
+        return _GENAI
+
+
+_SQL_CACHE: Optional[SQLCache] = None
+_SQL_CACHE_LOCK = threading.Lock()
 
-def generate_sql(question: str, schema_context: str, system_prompt: str = SYSTEM_PROMPT_DEFAULT, temperature: float = 0.7):
-    """
-    Call Gemini to generate SQL. Returns SQL string or raises/returns error message.
-    Contains simple retry with backoff for transient quota errors.
-    """
-    if not GOOGLE_API_KEY:
-        return "-- ERROR: GOOGLE_API_KEY not set in environment."
 
-    MODEL = genai.GenerativeModel(DEFAULT_GEMINI_MODEL)
+def embed_text(text: str) -> List[float]:
+    """Gemini embedding used for near-duplicate cache lookups."""
+    return _genai().embed_content(model=GEMINI_EMBEDDING_MODEL, content=text)["embedding"]
 
-    full_prompt = f"""
+
+def get_sql_cache() -> SQLCache:
+    """Return the process-wide question -> SQL cache (created on first use)."""
+    global _SQL_CACHE
+    with _SQL_CACHE_LOCK:
+        if _SQL_CACHE is None:
+            _SQL_CACHE = SQLCache(embed=embed_text if SQL_CACHE_EMBEDDINGS and GOOGLE_API_KEY else None)
+        return _SQL_CACHE
+
+
+_MODELS = {}
+_MODELS_LOCK = threading.Lock()
+
+
+def get_model(model_name: str = DEFAULT_GEMINI_MODEL):
+    """Return a shared GenerativeModel per model name instead of building one per call."""
+    with _MODELS_LOCK:
+        if model_name not in _MODELS:
+            _MODELS[model_name] = _genai().GenerativeModel(model_name)
+        return _MODELS[model_name]
+
+
+def build_prompt(question: str, schema_context: str, system_prompt: str) -> str:
+    return f"""
 Schema:
 {schema_context}
 
@@ -30,21 +70,70 @@ Question:
 
 Return only the SQL statement (no explanation). Make sure SQL is syntactically correct.
 """
+
+
+def _clean_sql(text: str) -> str:
+    sql = text.strip()
+    return sql.replace("```sql", "").replace("```", "").strip()
+
+
+def _is_quota_error(err_text: str) -> bool:
+    return "Quota" in err_text or "quota" in err_text or "429" in err_text or "ResourceExhausted" in err_text
+
+
+def _retry_delay(err_text: str, default: float) -> float:
+    """Pull the server-suggested retry delay out of a quota error, if present."""
+    m = re.search(r"retry_delay\s*\{\s*seconds:\s*(\d+)", err_text) or \
+        re.search(r"retry in ([0-9.]+)\s*s", err_text, flags=re.I)
+    return float(m.group(1)) if m else default
+
+
+def generation_config(temperature: float, max_output_tokens: int = 512) -> dict:
+    """generate_content accepts a plain mapping; building it needs no SDK import."""
+    return {"temperature": temperature, "max_output_tokens": max_output_tokens}
+
+
+def generate_sql(question: str, schema_context: str, system_prompt: str = SYSTEM_PROMPT_DEFAULT, temperature: float = 0.7,
+                 use_cache: bool = SQL_CACHE_ENABLED, model=None):
+    """
+    Call Gemini to generate SQL. Returns SQL string or raises/returns error message.
+    Answers are served from the local SQL cache when the same question was asked
+    against the same schema, prompt and temperature bucket.
+    `model` overrides the shared Gemini client (e.g. with mocks.MockModel).
+    """
+    if model is None and not GOOGLE_API_KEY:
+        return "-- ERROR: GOOGLE_API_KEY not set in environment."
+
+    with span("generate_sql", cached=use_cache) as s:
+        def _generate(q, ctx, prompt, temp):
+            s.set(cached=False)
+            return _generate_sql_uncached(q, ctx, prompt, temp, model or get_model())
+
+        if use_cache:
+            return get_sql_cache().get_or_generate(question, schema_context, system_prompt, temperature, _generate)
+        return _generate(question, schema_context, system_prompt, temperature)
+
+
+def _generate_sql_uncached(question: str, schema_context: str, system_prompt: str, temperature: float, model):
+    """
+    Contains simple retry with backoff for transient quota errors.
+    """
+    full_prompt = build_prompt(question, schema_context, system_prompt)
     max_retries = 2
     backoff = 1.0
     for attempt in range(max_retries + 1):
         try:
-            response = MODEL.generate_content(
-                contents=full_prompt,
-                generation_config=types.GenerationConfig(temperature=temperature, max_output_tokens=512)
-            )
-            sql = response.text.strip()
-            sql = sql.replace("```sql", "").replace("```", "").strip()
-            return sql
+            with span("gemini.call", attempt=attempt, prompt_chars=len(full_prompt)) as s:
+                response = model.generate_content(
+                    contents=full_prompt,
+                    generation_config=generation_config(temperature)
+                )
+                record_usage(s, response)
+            return _clean_sql(response.text)
         except Exception as e:
             err_text = str(e)
             # If quota error, surface concise message rather than crash
-            if "Quota" in err_text or "quota" in err_text or "429" in err_text or "ResourceExhausted" in err_text:
+            if _is_quota_error(err_text):
                 # Do not retry aggressively on quota=0; just return a clear message
                 return f"-- ERROR: Gemini quota or rate limit exceeded: {err_text}"
             # transient: retry
@@ -53,3 +142,154 @@ Return only the SQL statement (no explanation). Make sure SQL is syntactically c
                 backoff *= 2
                 continue
             return f"-- ERROR: Could not generate SQL: {err_text}"
+
+
+REPAIR_PROMPT = """{question}
+
+A previous attempt produced this SQL:
+{sql}
+
+It failed validation:
+{errors}
+
+Fix these problems and return the corrected single SQL statement."""
+
+
+def generate_sql_with_repair(question: str, schema_context: str, validate: Callable[[str], object],
+                             system_prompt: str = SYSTEM_PROMPT_DEFAULT, temperature: float = 0.7,
+                             max_attempts: int = VALIDATE_REPAIR_ATTEMPTS, use_cache: bool = SQL_CACHE_ENABLED,
+                             model=None) -> Tuple[str, Optional[object]]:
+    """
+    generate_sql followed by validate(sql); while validation reports errors the
+    errors are fed back to Gemini, at most `max_attempts` times.
+    Returns (sql, last validation result); the result is None when generation itself failed.
+    A repaired statement replaces the invalid one in the SQL cache; when repair
+    gives up (or the statement is rejected) the cache entry is dropped.
+    """
+    sql = generate_sql(question, schema_context, system_prompt, temperature, use_cache, model)
+    if sql.startswith("-- ERROR:"):
+        return sql, None
+    with span("validate"):
+        check = validate(sql)
+    repairs = 0
+    while check.errors and repairs < max_attempts:
+        repairs += 1
+        repair_question = REPAIR_PROMPT.format(question=question, sql=sql,
+                                               errors="\n".join(f"- {e}" for e in check.errors))
+        repaired = generate_sql(repair_question, schema_context, system_prompt, min(temperature, 0.2),
+                                use_cache=False, model=model)
+        if repaired.startswith("-- ERROR:"):
+            break
+        sql = repaired
+        with span("validate", repair=repairs):
+            check = validate(sql)
+    check.repairs = repairs
+    if use_cache and not check.ok:
+        # generate_sql cached the first answer; keep SQL that never validated out of the cache
+        get_sql_cache().discard(question, schema_context, system_prompt, temperature)
+    elif use_cache and repairs:
+        get_sql_cache().put(question, schema_context, system_prompt, temperature, sql)
+    return sql, check
+
+
+class TokenBucket:
+    """Async token-bucket limiter shared by concurrent generate calls.
+
+    `rate` tokens per second refill up to `capacity`. pause() blocks every caller
+    for a while, used when Gemini reports a quota error.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+async def agenerate_sql(question: str, schema_context: str, system_prompt: str = SYSTEM_PROMPT_DEFAULT,
+                        temperature: float = 0.7, model=None, limiter: Optional[TokenBucket] = None,
+                        use_cache: bool = SQL_CACHE_ENABLED, max_retries: int = 6) -> str:
+    """
+    Async generate_sql. Quota errors pause the shared limiter for the server's
+    suggested delay and retry instead of giving up; other errors back off.
+    """
+    if model is None and not GOOGLE_API_KEY:
+        return "-- ERROR: GOOGLE_API_KEY not set in environment."
+    model = model or get_model()
+    cache = get_sql_cache() if use_cache else None
+    if cache is not None:
+        cached = await asyncio.to_thread(cache.get, question, schema_context, system_prompt, temperature)
+        if cached is not None:
+            return cached
+
+    full_prompt = build_prompt(question, schema_context, system_prompt)
+    backoff = 1.0
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            await limiter.acquire()
+        try:
+            with span("gemini.call", attempt=attempt, prompt_chars=len(full_prompt)) as s:
+                response = await model.generate_content_async(
+                    contents=full_prompt,
+                    generation_config=generation_config(temperature)
+                )
+                record_usage(s, response)
+            sql = _clean_sql(response.text)
+            if cache is not None:
+                await asyncio.to_thread(cache.put, question, schema_context, system_prompt, temperature, sql)
+            return sql
+        except Exception as e:
+            err_text = str(e)
+            if attempt >= max_retries:
+                if _is_quota_error(err_text):
+                    return f"-- ERROR: Gemini quota or rate limit exceeded: {err_text}"
+                return f"-- ERROR: Could not generate SQL: {err_text}"
+            delay = _retry_delay(err_text, backoff) if _is_quota_error(err_text) else backoff
+            if limiter is not None and _is_quota_error(err_text):
+                limiter.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+            backoff = min(backoff * 2, 60.0)
+
+
+async def agenerate_sql_batch(questions: List[str], schema_context: str, system_prompt: str = SYSTEM_PROMPT_DEFAULT,
+                              temperature: float = 0.7, concurrency: int = 8, requests_per_minute: float = 60,
+                              model=None, use_cache: bool = SQL_CACHE_ENABLED) -> List[str]:
+    """Generate SQL for many questions with at most `concurrency` in flight; results keep input order."""
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = TokenBucket(requests_per_minute / 60.0, capacity=max(1.0, min(concurrency, requests_per_minute / 60.0)))
+
+    async def _one(q):
+        async with semaphore:
+            return await agenerate_sql(q, schema_context, system_prompt, temperature,
+                                       model=model, limiter=limiter, use_cache=use_cache)
+
+    return await asyncio.gather(*(_one(q) for q in questions))
+
+
+def generate_sql_batch(questions: List[str], schema_context: str, system_prompt: str = SYSTEM_PROMPT_DEFAULT,
+                       temperature: float = 0.7, concurrency: int = 8, requests_per_minute: float = 60,
+                       model=None, use_cache: bool = SQL_CACHE_ENABLED) -> List[str]:
+    """Synchronous wrapper around agenerate_sql_batch."""
+    return asyncio.run(agenerate_sql_batch(questions, schema_context, system_prompt, temperature,
+                                           concurrency, requests_per_minute, model, use_cache))
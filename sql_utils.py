@@ -0,0 +1,309 @@
+# sql_utils.py
+import re
+from typing import List, NamedTuple, Tuple
+
+
+class Token(NamedTuple):
+    kind: str   # "string" | "number" | "ident" | "qident" | "op"
+    value: str
+    pos: int
+
+
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+|--[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*')
+  | (?P<dq>"(?:[^"\\]|\\.|"")*")
+  | (?P<bt>`(?:[^`]|``)*`)
+  | (?P<br>\[[^\]]*\])
+  | (?P<number>(?:\d+\.\d*|\.\d+|\d+)(?:[eE][+-]?\d+)?)
+  | (?P<ident>[A-Za-z_À-￿][\w$À-￿]*)
+  | (?P<op><=|>=|<>|!=|\|\||[=<>(),.;*+\-/%])
+""", re.X | re.S)
+
+
+def _unquote(text: str) -> str:
+    quote = text[0]
+    body = text[1:-1]
+    if quote == "[":
+        return body
+    if quote * 2 not in body and "\\" not in body:
+        return body
+    body = body.replace(quote * 2, quote)
+    if quote in "'\"":
+        body = re.sub(r"\\(.)", lambda m: {"n": "\n", "t": "\t", "0": "\0"}.get(m.group(1), m.group(1)), body)
+    return body
+
+
+def tokenize(sql: str) -> List[Token]:
+    """Split SQL into tokens, dropping whitespace and comments.
+
+    Quoted identifiers (backticks, brackets) become "qident"; double-quoted text
+    becomes "qident" too and callers decide whether it is a column or a string.
+    String and identifier values are unquoted.
+    """
+    tokens = []
+    pos = 0
+    # finditer skips what no alternative matches; a gap means an unexpected character
+    for m in _TOKEN_RE.finditer(sql):
+        if m.start() != pos:
+            break
+        kind = m.lastgroup
+        if kind == "string":
+            tokens.append(Token("string", _unquote(m.group()), pos))
+        elif kind in ("dq", "bt", "br"):
+            tokens.append(Token("qident", _unquote(m.group()), pos))
+        elif kind != "ws":
+            tokens.append(Token(kind, m.group(), pos))
+        pos = m.end()
+    if pos < len(sql):
+        raise ValueError(f"Unexpected character {sql[pos]!r} at position {pos}")
+    return tokens
+
+
+def is_keyword(token: Token, *words: str) -> bool:
+    return token.kind == "ident" and token.value.lower() in words
+
+
+def is_op(token: Token, *ops: str) -> bool:
+    return token.kind == "op" and token.value in ops
+
+
+_CLAUSE_WORDS = {
+    "where", "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on", "using",
+    "group", "order", "limit", "having", "union", "intersect", "except", "window", "offset",
+    "set", "values", "select", "from", "as", "lateral", "straight_join", "for", "into",
+}
+
+
+class TableRef(NamedTuple):
+    name: str
+    alias: str
+    outer: bool    # appears on the nullable side of an outer join
+
+
+def _read_name(tokens: List[Token], i: int):
+    """Read a possibly dotted name at tokens[i]; returns (name, next index)."""
+    name = tokens[i].value
+    i += 1
+    while i + 1 < len(tokens) and is_op(tokens[i], ".") \
+            and tokens[i + 1].kind in ("ident", "qident"):
+        name += "." + tokens[i + 1].value
+        i += 2
+    return name, i
+
+
+def referenced_tables(sql: str) -> List[TableRef]:
+    """Tables read or written by a statement (FROM/JOIN/INTO/UPDATE targets, any nesting).
+
+    CTE names are excluded; the alias is the table name when none is given.
+    """
+    tokens = tokenize(sql)
+    ctes = set()
+    for j, tok in enumerate(tokens[:-2]):
+        if tok.kind in ("ident", "qident") and is_keyword(tokens[j + 1], "as") \
+                and is_op(tokens[j + 2], "(") and (j == 0 or is_keyword(tokens[j - 1], "with", "recursive")
+                                                    or is_op(tokens[j - 1], ",")):
+            ctes.add(tok.value.lower())
+    refs = []
+    i = 0
+    outer_next = False
+    while i < len(tokens):
+        tok = tokens[i]
+        if is_keyword(tok, "left", "right", "full"):
+            outer_next = True
+        starts_list = is_keyword(tok, "from", "join", "into", "update")
+        if not starts_list:
+            i += 1
+            continue
+        i += 1
+        while i < len(tokens):
+            if tokens[i].kind not in ("ident", "qident") or \
+                    (tokens[i].kind == "ident" and tokens[i].value.lower() in _CLAUSE_WORDS):
+                break  # subquery or something other than a table name
+            name, i = _read_name(tokens, i)
+            alias = name.split(".")[-1]
+            if i < len(tokens) and is_keyword(tokens[i], "as"):
+                i += 1
+            if i < len(tokens) and tokens[i].kind in ("ident", "qident") and \
+                    not (tokens[i].kind == "ident" and tokens[i].value.lower() in _CLAUSE_WORDS):
+                alias = tokens[i].value
+                i += 1
+            if name.lower() not in ctes:
+                refs.append(TableRef(name, alias, outer_next and is_keyword(tok, "join")))
+            if i < len(tokens) and is_op(tokens[i], ",") and is_keyword(tok, "from"):
+                i += 1
+                continue
+            break
+        if is_keyword(tok, "join"):
+            outer_next = False
+    return refs
+
+
+def top_level_tables(tokens: List[Token]) -> List[Tuple[TableRef, int, int]]:
+    """FROM/JOIN tables of the outermost query: (ref, index of the name's first token, index after it)."""
+    out = []
+    depth = 0
+    outer_next = False
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        i += 1
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        if depth or tok.kind != "ident":
+            continue
+        if is_keyword(tok, "left", "right", "full"):
+            outer_next = True
+        if not is_keyword(tok, "from", "join"):
+            continue
+        while i < len(tokens) and tokens[i].kind in ("ident", "qident") and \
+                not (tokens[i].kind == "ident" and tokens[i].value.lower() in _CLAUSE_WORDS):
+            start = i
+            name, i = _read_name(tokens, i)
+            end = i
+            alias = name.split(".")[-1]
+            if i < len(tokens) and is_keyword(tokens[i], "as"):
+                i += 1
+            if i < len(tokens) and tokens[i].kind in ("ident", "qident") and \
+                    not (tokens[i].kind == "ident" and tokens[i].value.lower() in _CLAUSE_WORDS):
+                alias = tokens[i].value
+                i += 1
+            out.append((TableRef(name, alias, outer_next and is_keyword(tok, "join")), start, end))
+            if i < len(tokens) and is_op(tokens[i], ",") and is_keyword(tok, "from"):
+                i += 1
+                continue
+            break
+        if is_keyword(tok, "join"):
+            outer_next = False
+    return out
+
+
+def token_end(sql: str, tok: Token) -> int:
+    """End offset of a token in the original SQL text (quoted tokens hold unquoted values)."""
+    if tok.kind not in ("string", "qident"):
+        return tok.pos + len(tok.value)
+    quote = sql[tok.pos]
+    closing = "]" if quote == "[" else quote
+    i = tok.pos + 1
+    while i < len(sql):
+        if sql[i] == "\\" and quote in "'\"":
+            i += 2
+            continue
+        if sql[i] == closing:
+            if i + 1 < len(sql) and sql[i + 1] == closing and closing != "]":
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    return len(sql)
+
+
+def statement_type(sql: str) -> str:
+    """Lower-case leading keyword; WITH queries report the statement after the CTEs."""
+    tokens = tokenize(sql)
+    if not tokens:
+        return ""
+    if not is_keyword(tokens[0], "with"):
+        return tokens[0].value.lower()
+    depth = 0
+    for tok in tokens[1:]:
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif depth == 0 and is_keyword(tok, "select", "insert", "update", "delete", "replace"):
+            return tok.value.lower()
+    return "select"
+
+
+def split_top_level(tokens: List[Token], word: str) -> List[List[Token]]:
+    """Split tokens on a keyword (e.g. AND) outside parentheses; BETWEEN's AND is kept."""
+    parts, current = [], []
+    depth = 0
+    pending_between = 0
+    for tok in tokens:
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif depth == 0 and is_keyword(tok, "between"):
+            pending_between += 1
+        elif depth == 0 and is_keyword(tok, word):
+            if word == "and" and pending_between:
+                pending_between -= 1
+            else:
+                parts.append(current)
+                current = []
+                continue
+        current.append(tok)
+    parts.append(current)
+    return parts
+
+
+def top_level_clause(tokens: List[Token], word: str, enders=("group", "order", "limit", "having", "union",
+                                                          "window", "intersect", "except", "for")):
+    """(start, end) token indexes of the outermost `word` clause body, or None."""
+    depth = 0
+    start = None
+    for i, tok in enumerate(tokens):
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif depth == 0 and start is None and is_keyword(tok, word):
+            start = i + 1
+        elif depth == 0 and start is not None and is_keyword(tok, *enders):
+            return start, i
+    return (start, len(tokens)) if start is not None else None
+
+
+# Stored-program bodies contain ';' between BEGIN ... END; such a statement runs to the end of the text.
+_COMPOUND_OBJECTS = {"procedure", "function", "trigger", "event"}
+
+
+def split_statements(sql: str) -> List[str]:
+    """Split a script on top-level ';' (not inside strings, comments or parentheses).
+
+    Empty statements are dropped and the text of each one is kept as written.
+    CREATE PROCEDURE/FUNCTION/TRIGGER/EVENT is not split further.
+    """
+    return [text for text, _ in split_statement_tokens(sql)]
+
+
+def split_statement_tokens(sql: str) -> List[Tuple[str, List[Token]]]:
+    """split_statements plus each statement's tokens, so callers need not tokenize again.
+
+    Token positions index into sql; a statement's text starts at its first token.
+    """
+    tokens = tokenize(sql)
+    statements, start, depth = [], None, 0
+    for i, tok in enumerate(tokens):
+        if start is None:
+            start = i
+            if is_keyword(tok, "create") and any(is_keyword(t, *_COMPOUND_OBJECTS) for t in tokens[i + 1:i + 4]):
+                break
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif is_op(tok, ";") and depth <= 0:
+            if i > start:
+                statements.append((sql[tokens[start].pos:tok.pos].strip(), tokens[start:i]))
+            start, depth = None, 0
+    if start is not None:
+        end = len(tokens)
+        while end > start and is_op(tokens[end - 1], ";"):
+            end -= 1
+        if end > start:
+            statements.append((sql[tokens[start].pos:].strip().rstrip(";").strip(), tokens[start:end]))
+    return statements
+
+
+def is_single_select(sql: str) -> bool:
+    """True for exactly one statement that returns rows: SELECT, or WITH ... SELECT."""
+    try:
+        return statement_type(sql) == "select" and len(split_statements(sql)) == 1
+    except ValueError:
+        return False
@@ -0,0 +1,386 @@
+# sql_validator.py
+import json
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from config import VALIDATE_MAX_ROWS_EXAMINED, VALIDATE_AUTO_LIMIT
+from db_utils import borrow_connection
+from federated import route_tables
+from sheet_engine import SheetSQLEngine
+from sql_utils import (Token, tokenize, is_keyword, is_op, referenced_tables, statement_type, top_level_clause,
+                       split_statements)
+
+# Statements each source can execute (first keyword; WITH counts as its main statement for MySQL).
+ALLOWED_STATEMENTS = {
+    "MySQL": {"select", "insert", "update", "delete", "replace", "create", "alter",
+              "show", "describe", "desc", "explain"},
+    # the Sheets handler dispatches on the leading keyword, so no WITH
+    "Google Sheets": {"select", "insert", "update", "delete"},
+}
+
+# Statements EXPLAIN accepts.
+_EXPLAINABLE = {"select", "insert", "update", "delete", "replace"}
+
+# Words that can appear unquoted in a statement without being a column.
+_SQL_WORDS = {
+    "select", "distinct", "from", "where", "and", "or", "not", "xor", "in", "is", "null", "like", "between",
+    "as", "join", "inner", "left", "right", "full", "outer", "cross", "natural", "on", "using", "group",
+    "by", "order", "asc", "desc", "limit", "offset", "having", "union", "intersect", "except", "all",
+    "any", "some", "case", "when", "then", "else", "end", "with", "recursive", "exists", "true", "false",
+    "unknown", "insert", "into", "values", "value", "update", "set", "delete", "replace", "ignore",
+    "default", "interval", "year", "quarter", "month", "week", "day", "hour", "minute", "second",
+    "microsecond", "day_hour", "day_minute", "day_second", "hour_minute", "hour_second",
+    "minute_second", "year_month", "current_date", "current_time", "current_timestamp", "localtime",
+    "localtimestamp", "over", "partition", "rows", "range", "unbounded", "preceding", "following",
+    "current", "row", "window", "collate", "binary", "signed", "unsigned", "integer", "int", "char",
+    "varchar", "text", "date", "time", "datetime", "timestamp", "decimal", "double", "float", "real",
+    "json", "separator", "escape", "regexp", "rlike", "div", "mod", "straight_join", "for", "share",
+    "lock", "mode", "nowait", "skip", "locked", "of", "lateral", "duplicate", "key", "primary",
+    "unique", "index", "table", "if", "create", "alter", "drop", "column", "add", "modify", "change",
+    "references", "foreign", "constraint", "auto_increment", "engine", "charset", "character", "utf8mb4",
+    "no", "action", "cascade", "restrict", "temporary", "view", "top", "fetch", "first", "next", "only",
+    "nulls", "last", "glob", "cast", "convert", "extract", "trim", "leading", "trailing", "both",
+    "position", "substring", "soundex", "sounds", "memberof", "member", "array",
+}
+
+
+class ValidationResult:
+    """Outcome of validate_sql.
+
+    errors: problems the generator can fix (fed back by the repair loop)
+    rejected: reason the statement must not run (e.g. over the cost budget)
+    warnings: advisory notes; sql is the statement to execute (LIMIT may have been added)
+    """
+
+    def __init__(self, sql: str):
+        self.sql = sql
+        self.errors: List[str] = []
+        self.warnings: List[str] = []
+        self.rejected: Optional[str] = None
+        self.rows_examined: Optional[float] = None
+        self.query_cost: Optional[float] = None
+        self.repairs = 0
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors and self.rejected is None
+
+
+def _match(name: str, names) -> Optional[str]:
+    lowered = {n.lower(): n for n in names}
+    return lowered.get(name.lower())
+
+
+def _num(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _rows_examined(node) -> float:
+    """Estimated rows examined from EXPLAIN FORMAT=JSON output (format versions 1 and 2).
+
+    In a nested loop each table is scanned once per row produced by the join so far.
+    """
+    if isinstance(node, list):
+        return sum(_rows_examined(n) for n in node)
+    if not isinstance(node, dict):
+        return 0.0
+    total = 0.0
+    if "access_type" in node and "estimated_rows" in node and "rows_examined_per_scan" not in node:
+        total += _num(node["estimated_rows"])   # version 2 access path
+    tables = []
+    if isinstance(node.get("nested_loop"), list):
+        tables = [item.get("table", {}) for item in node["nested_loop"] if isinstance(item, dict)]
+    elif isinstance(node.get("table"), dict):
+        tables = [node["table"]]
+    loops = 1.0
+    for table in tables:
+        total += loops * _num(table.get("rows_examined_per_scan"))
+        loops = max(_num(table.get("rows_produced_per_join")), 1.0)
+        total += sum(_rows_examined(v) for v in table.values() if isinstance(v, (dict, list)))
+    for key, value in node.items():
+        if key not in ("nested_loop", "table") and isinstance(value, (dict, list)):
+            total += _rows_examined(value)
+    return total
+
+
+def _query_cost(doc: dict) -> Optional[float]:
+    block = doc.get("query_block", {})
+    if "cost_info" in block:
+        return _num(block["cost_info"].get("query_cost"))
+    if "estimated_total_cost" in doc:
+        return _num(doc["estimated_total_cost"])
+    return None
+
+
+def _limit_helps(tokens: List[Token]) -> bool:
+    """True for plain SELECTs where LIMIT stops the scan early (no grouping, sorting or set ops)."""
+    depth = 0
+    for i, tok in enumerate(tokens):
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+        elif depth == 0:
+            if is_keyword(tok, "group", "order", "having", "distinct", "union", "intersect", "except",
+                           "into", "for", "with", "window"):
+                return False
+            if is_keyword(tok, "count", "sum", "avg", "min", "max", "group_concat") and \
+                    i + 1 < len(tokens) and is_op(tokens[i + 1], "("):
+                return False
+    return True
+
+
+def _check_columns(result: ValidationResult, sql: str, tokens: List[Token], refs, schema: Dict[str, list]):
+    """Unknown alias.column references are errors; unknown bare identifiers are warnings."""
+    by_alias = {}
+    for ref in refs:
+        table = _match(ref.name, schema)
+        if table is not None:
+            cols = {c["name"].lower() for c in schema[table]}
+            by_alias[ref.alias.lower()] = cols
+            by_alias.setdefault(ref.name.lower(), cols)
+    for i in range(len(tokens) - 2):
+        tok, dot, col = tokens[i], tokens[i + 1], tokens[i + 2]
+        if tok.kind in ("ident", "qident") and is_op(dot, ".") and col.kind in ("ident", "qident") \
+                and not (i + 3 < len(tokens) and is_op(tokens[i + 3], "(")) and (i == 0 or not is_op(tokens[i - 1], ".")):
+            cols = by_alias.get(tok.value.lower())
+            if cols is not None and col.value.lower() not in cols:
+                result.errors.append(f"Unknown column '{col.value}' in table '{tok.value}'.")
+
+    if any(_match(r.name, schema) is None for r in refs) or \
+            any(is_op(t, "(") and i + 1 < len(tokens) and is_keyword(tokens[i + 1], "select") for i, t in enumerate(tokens)):
+        return  # derived tables / subqueries: their columns are not known here
+    known = set().union(*by_alias.values()) if by_alias else set()
+    known |= set(by_alias)
+    known |= {tokens[i + 1].value.lower() for i, t in enumerate(tokens[:-1]) if is_keyword(t, "as")}
+    unknown = []
+    for i, tok in enumerate(tokens):
+        quoted = tok.kind == "qident" and sql[tok.pos] in "`["
+        if not (tok.kind == "ident" or quoted):
+            continue
+        if (i + 1 < len(tokens) and is_op(tokens[i + 1], "(", ".")) or (i > 0 and is_op(tokens[i - 1], ".")):
+            continue
+        name = tok.value.lower()
+        if name in known or (tok.kind == "ident" and name in _SQL_WORDS):
+            continue
+        if i > 0 and (is_op(tokens[i - 1], ")") or tokens[i - 1].kind in ("ident", "qident")):
+            continue  # alias without AS
+        if name not in unknown:
+            unknown.append(name)
+    for name in unknown:
+        result.warnings.append(f"'{name}' is not a column of the referenced tables.")
+
+
+def _explain_mysql(result: ValidationResult, mysql_conn, sql: str, max_rows_examined: int, auto_limit: int,
+                   tokens: List[Token], kind: str):
+    try:
+        with borrow_connection(mysql_conn) as raw:
+            cursor = raw.cursor()
+            try:
+                cursor.execute("EXPLAIN FORMAT=JSON " + sql)
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
+    except Exception as e:
+        errno = getattr(e, "errno", None)
+        if errno is not None and 1000 <= errno < 2000:
+            result.errors.append(f"MySQL: {getattr(e, 'msg', None) or e}")   # server-side: bad SQL for this schema
+        else:
+            result.warnings.append(f"Cost check skipped: {e}")
+        return
+    try:
+        doc = json.loads(row[0])
+    except (TypeError, ValueError, IndexError):
+        result.warnings.append("Cost check skipped: EXPLAIN returned no JSON plan.")
+        return
+    result.rows_examined = _rows_examined(doc)
+    result.query_cost = _query_cost(doc)
+    if not max_rows_examined or result.rows_examined <= max_rows_examined:
+        return
+    over = f"estimated {result.rows_examined:,.0f} rows examined (budget {max_rows_examined:,})"
+    if kind == "select" and auto_limit and top_level_clause(tokens, "limit", ("for",)) is None and _limit_helps(tokens):
+        result.sql = f"{sql} LIMIT {int(auto_limit)}"
+        result.warnings.append(f"Added LIMIT {int(auto_limit)}: {over}.")
+    else:
+        result.rejected = f"Query rejected: {over}. Add a more selective WHERE clause or raise VALIDATE_MAX_ROWS_EXAMINED."
+
+
+# Table-element keywords in CREATE TABLE that do not start a column definition.
+_TABLE_CONSTRAINTS = {"primary", "key", "index", "unique", "constraint", "foreign", "check", "fulltext",
+                      "spatial", "period"}
+
+
+def _ddl_table(tokens: List[Token]) -> Optional[int]:
+    """Index of the table name in CREATE TABLE / ALTER TABLE (past any database prefix), else None."""
+    i = next((i for i, t in enumerate(tokens[:4]) if is_keyword(t, "table")), None)
+    if i is None:
+        return None
+    i += 1
+    while i < len(tokens) and is_keyword(tokens[i], "if", "not", "exists"):
+        i += 1
+    while i + 2 < len(tokens) and is_op(tokens[i + 1], "."):
+        i += 2
+    return i if i < len(tokens) and tokens[i].kind in ("ident", "qident") else None
+
+
+def _created_columns(tokens: List[Token], name_at: int) -> Optional[List[dict]]:
+    """Columns defined by CREATE TABLE name (...), or None (CREATE ... AS SELECT / LIKE)."""
+    if name_at + 1 >= len(tokens) or not is_op(tokens[name_at + 1], "("):
+        return None
+    columns, depth, element = [], 0, True
+    for tok in tokens[name_at + 1:]:
+        if is_op(tok, "("):
+            depth += 1
+        elif is_op(tok, ")"):
+            depth -= 1
+            if depth == 0:
+                return columns
+        elif depth == 1 and is_op(tok, ","):
+            element = True
+        elif element:
+            element = False
+            if depth == 1 and tok.kind in ("ident", "qident") and \
+                    not (tok.kind == "ident" and tok.value.lower() in _TABLE_CONSTRAINTS):
+                columns.append({"name": tok.value, "type": ""})
+    return None
+
+
+def _validate_batch(statements: List[str], source: str, mysql_schema: Dict[str, list],
+                    sheet_schema: Dict[str, list], mysql_conn, max_rows_examined: int,
+                    auto_limit: int) -> ValidationResult:
+    """validate_sql for a multi-statement script, which only MySQL runs (in one transaction).
+
+    Statements are checked in order; tables created earlier in the script count
+    as known. Statements on tables the script creates or alters are not sent
+    to EXPLAIN, since those tables do not exist in their final shape yet.
+    """
+    result = ValidationResult(";\n".join(statements))
+    if source == "Google Sheets" or (source != "MySQL" and any(
+            _match(r.name, sheet_schema) is not None and _match(r.name, mysql_schema) is None
+            for q in statements for r in referenced_tables(q))):
+        result.errors.append("Only a single SQL statement can be executed on Google Sheets; "
+                             "multi-statement scripts run on MySQL only.")
+        return result
+    schema = dict(mysql_schema)
+    changed = set()     # lower-cased tables created or altered by the script
+    opaque = set()      # ... of which the columns are not known
+    checked = []
+    for n, q in enumerate(statements, 1):
+        tokens = tokenize(q)
+        refs = referenced_tables(q)
+        kind = statement_type(q)
+        names = {r.name.lower() for r in refs}
+        part = validate_sql(q, "MySQL", schema, None, None if names & changed else mysql_conn,
+                            max_rows_examined=max_rows_examined, auto_limit=auto_limit)
+        if names & opaque:
+            part.errors = [e for e in part.errors if not e.startswith("Unknown column")]
+        if names & opaque or kind in ("create", "alter"):   # definitions name new columns
+            part.warnings = [w for w in part.warnings if not w.endswith("is not a column of the referenced tables.")]
+        result.errors.extend(f"Statement {n}: {e}" for e in part.errors)
+        result.warnings.extend(f"Statement {n}: {w}" for w in part.warnings)
+        if part.rejected and result.rejected is None:
+            result.rejected = f"Statement {n}: {part.rejected}"
+        for attr in ("rows_examined", "query_cost"):
+            if getattr(part, attr) is not None:
+                setattr(result, attr, (getattr(result, attr) or 0.0) + getattr(part, attr))
+        checked.append(part.sql)
+        name_at = _ddl_table(tokens) if kind in ("create", "alter") else None
+        if name_at is not None:
+            name = tokens[name_at].value
+            changed.add(name.lower())
+            columns = _created_columns(tokens, name_at) if kind == "create" else None
+            if columns is not None:
+                schema[name] = columns
+                opaque.discard(name.lower())
+            else:
+                schema.setdefault(name, [])
+                opaque.add(name.lower())
+    result.sql = ";\n".join(checked)
+    return result
+
+
+def validate_sql(sql: str, source: str, mysql_schema: Optional[Dict[str, list]] = None,
+                 sheet_schema: Optional[Dict[str, list]] = None, mysql_conn=None,
+                 df_map: Optional[Dict[str, pd.DataFrame]] = None, sheet_engine: Optional[SheetSQLEngine] = None,
+                 max_rows_examined: int = VALIDATE_MAX_ROWS_EXAMINED,
+                 auto_limit: int = VALIDATE_AUTO_LIMIT) -> ValidationResult:
+    """Check a generated statement before it is executed.
+
+    Local checks: tokenizes, statement type allowed for the source, referenced
+    tables exist, alias.column references exist; a script of several
+    statements is accepted for MySQL and checked statement by statement. Then the
+    target engine compiles it without running it: EXPLAIN FORMAT=JSON on MySQL
+    (which also yields the rows-examined estimate used for the cost budget)
+    and EXPLAIN QUERY PLAN on the sheet engine for Sheets SELECTs.
+    """
+    q = sql.strip().rstrip(';').strip()
+    result = ValidationResult(q)
+    mysql_schema = mysql_schema or {}
+    sheet_schema = sheet_schema or {}
+    if not q or q.startswith("-- ERROR:"):
+        result.errors.append(q or "Empty statement.")
+        return result
+    try:
+        statements = split_statements(q)
+        if len(statements) > 1:
+            return _validate_batch(statements, source, mysql_schema, sheet_schema, mysql_conn,
+                                   max_rows_examined, auto_limit)
+        tokens = tokenize(q)
+        refs = referenced_tables(q)
+        kind = statement_type(q)
+    except ValueError as e:
+        result.errors.append(f"Syntax: {e}")
+        return result
+    if any(is_op(t, ";") for t in tokens):   # inside CREATE PROCEDURE and friends
+        result.errors.append("Only a single SQL statement can be executed; remove the extra statements.")
+        return result
+    depth = 0
+    for tok in tokens:
+        depth += 1 if is_op(tok, "(") else -1 if is_op(tok, ")") else 0
+        if depth < 0:
+            break
+    if depth:
+        result.errors.append("Unbalanced parentheses.")
+        return result
+
+    # which engine runs it
+    target = source
+    if source == "Both (MySQL+Sheets)":
+        target = {"mysql": "MySQL", "sheets": "Google Sheets", "federated": "federated"}.get(
+            route_tables(q, set(mysql_schema), set(sheet_schema)), source)
+    first = tokens[0].value.lower()
+    # cross-source queries are SELECT-only; unknown tables are reported below
+    allowed = ALLOWED_STATEMENTS.get(target, {"select"} if target == "federated" else ALLOWED_STATEMENTS["MySQL"])
+    if (first if target == "Google Sheets" else kind) not in allowed:
+        where = "a cross-source query" if target == "federated" else target
+        result.errors.append(f"{first.upper()} statements are not supported for {where}; "
+                             f"use one of: {', '.join(sorted(s.upper() for s in allowed))}.")
+        return result
+
+    # tables and columns
+    schema = {"MySQL": mysql_schema, "Google Sheets": sheet_schema}.get(target, {**sheet_schema, **mysql_schema})
+    if kind != "create":
+        for ref in refs:
+            if "." in ref.name and target == "MySQL":
+                continue  # other database; EXPLAIN checks it
+            if _match(ref.name, schema) is None:
+                known = ", ".join(sorted(schema)[:30])
+                result.errors.append(f"Unknown table '{ref.name}'. Available tables: {known}.")
+    if result.errors:
+        return result
+    _check_columns(result, q, tokens, refs, schema)
+
+    # engine-side compile and cost
+    if target == "MySQL" and mysql_conn is not None and kind in _EXPLAINABLE:
+        _explain_mysql(result, mysql_conn, q, max_rows_examined, auto_limit, tokens, kind)
+    elif target == "Google Sheets" and first == "select" and sheet_engine is not None and df_map:
+        try:
+            sheet_engine.sync(df_map)
+            sheet_engine.check(q)
+        except Exception as e:
+            result.errors.append(f"Sheets: {e}")
+    return result
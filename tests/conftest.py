@@ -0,0 +1,38 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gsheets_utils  # noqa: E402
+from mocks import FakeSpreadsheet, FakeWorksheet  # noqa: E402
+
+
+ROWS = [["id", "price", "name"], ["1", "10", "a"], ["2", "20", "b"]]
+# empty cells: price of row 2, name of row 3
+NULL_ROWS = [["id", "price", "name"], ["1", "5", "a"], ["2", "", "b"], ["3", "20", ""], ["4", "10", "d"]]
+
+
+@pytest.fixture
+def sheet(request, monkeypatch):
+    """Tab "t" on a FakeSpreadsheet (ROWS, or the rows passed via indirect parametrize),
+    pushed synchronously: (workbook, worksheet)."""
+    monkeypatch.setattr(gsheets_utils, "SHEET_WRITE_BEHIND", False)
+    gsheets_utils._SHEET_CACHE.clear()
+    sh = FakeSpreadsheet()
+    ws = sh.add(FakeWorksheet(getattr(request, "param", ROWS), title="t"))
+    return gsheets_utils.SheetWorkbook(sh), ws
+
+
+@pytest.fixture
+def run(sheet):
+    """Execute one statement against the sheet fixture; returns (df, error)."""
+    book, _ = sheet
+    df_map, ws_map = book.table_maps(["t"])
+
+    def execute(sql):
+        return gsheets_utils.execute_sheet_sql_on_df(df_map, sql, ws_map)
+    execute.df_map = df_map
+    return execute
@@ -0,0 +1,133 @@
+# tests/test_db_utils.py
+import threading
+
+import pytest
+
+import db_utils
+from db_utils import execute_mysql_query, QueryStream
+from mocks import SQLiteMySQLStandIn
+
+
+@pytest.fixture
+def db():
+    conn = SQLiteMySQLStandIn()
+    execute_mysql_query(conn, "CREATE TABLE t (id INT PRIMARY KEY, name VARCHAR(20))")
+    conn.round_trips = 0
+    return conn
+
+
+def test_literal_inserts_are_merged(db):
+    script = ";\n".join(f"INSERT INTO t (id, name) VALUES ({i}, 'n{i}')" for i in range(1, 6))
+    df, err = execute_mysql_query(db, script)
+    assert err is None
+    statements = df.attrs["batch"].statements
+    assert len(statements) == 1 and statements[0]["statement"] == "1-5"
+    assert execute_mysql_query(db, "SELECT COUNT(*) AS n FROM t")[0]["n"].iloc[0] == 5
+
+
+def test_next_id_subquery_inserts_run_one_by_one(db):
+    # the pattern SYSTEM_PROMPT_DEFAULT asks for when there is no auto-increment
+    script = ";\n".join(f"INSERT INTO t (id, name) VALUES ((SELECT COALESCE(MAX(id), 0) + 1 FROM t), '{name}')"
+                        for name in ("a", "b", "c"))
+    df, err = execute_mysql_query(db, script)
+    assert err is None
+    statements = df.attrs["batch"].statements
+    assert [s["statement"] for s in statements] == ["1", "2", "3"]
+    assert [s["affected_rows"] for s in statements] == [1, 1, 1]
+    rows = execute_mysql_query(db, "SELECT id, name FROM t ORDER BY id")[0]
+    assert rows.values.tolist() == [[1, "a"], [2, "b"], [3, "c"]]
+
+
+def test_function_values_are_not_merged(db):
+    df, err = execute_mysql_query(db, "INSERT INTO t (id, name) VALUES (1, 'x');\n"
+                                      "INSERT INTO t (id, name) VALUES (2, LOWER('Y'));\n"
+                                      "INSERT INTO t (id, name) VALUES (-3, \"z\")")
+    assert err is None
+    assert [s["statement"] for s in df.attrs["batch"].statements] == ["1", "2", "3"]
+
+
+def _writes(conn):
+    key = db_utils._schema_cache_key(conn)
+    return {name: n for (k, name), n in db_utils._MYSQL_WRITES.items() if k == key}
+
+
+@pytest.mark.parametrize("query", ["SHOW TABLES", "DESCRIBE t", "EXPLAIN SELECT * FROM t"])
+def test_read_only_statements_keep_write_epoch(db, query):
+    before = _writes(db)
+    df, err = execute_mysql_query(db, query)
+    assert err is None and df is not None
+    assert _writes(db) == before
+
+
+def test_writes_bump_table_and_ddl_bumps_epoch(db):
+    before = _writes(db)
+    execute_mysql_query(db, "INSERT INTO t (id, name) VALUES (1, 'a')")
+    after = _writes(db)
+    assert after.get("t", 0) == before.get("t", 0) + 1
+    assert after.get(None, 0) == before.get(None, 0)
+    execute_mysql_query(db, "CREATE TABLE u (id INT)")
+    assert _writes(db).get(None, 0) == before.get(None, 0) + 1
+
+
+def _fill(conn, n):
+    execute_mysql_query(conn, ";\n".join(f"INSERT INTO t (id, name) VALUES ({i}, 'n{i}')" for i in range(1, n + 1)))
+
+
+def test_stream_of_exactly_max_rows_is_complete(db):
+    _fill(db, 4)
+    stream = QueryStream(db, "SELECT * FROM t", chunk_rows=2, max_rows=4)
+    assert len(stream.to_frame()) == 4
+    assert stream.truncated is None and stream.error is None and db.kills == []
+
+
+def test_row_limit_kills_query_on_raw_connection(db):
+    _fill(db, 5)
+    stream = QueryStream(db, "SELECT * FROM t", chunk_rows=2, max_rows=4)
+    assert len(stream.to_frame()) == 4
+    assert stream.truncated == "row limit of 4 reached"
+    assert stream.error is None
+    assert db.kills == [db.connection_id]
+
+
+def test_row_limit_without_second_connection_is_an_error(db, monkeypatch):
+    _fill(db, 5)
+    monkeypatch.delattr(type(db), "open_sibling")
+    stream = QueryStream(db, "SELECT * FROM t", chunk_rows=2, max_rows=4)
+    stream.to_frame()
+    assert stream.truncated == "row limit of 4 reached"
+    assert stream.error.startswith("Could not stop the query (row limit of 4 reached)")
+
+
+def test_pool_counts_concurrent_checkouts(monkeypatch):
+    monkeypatch.setattr(db_utils, "connect_mysql", lambda **params: SQLiteMySQLStandIn())
+    pool = db_utils.MySQLPool("h", 0, "u", "p", "d", size=2, max_overflow=2, pre_ping=False)
+
+    def work():
+        for _ in range(200):
+            pool.release(pool.acquire())
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = pool.stats()
+    assert stats["checkouts"] == 1600
+    # closed overflow connections leave no recycle bookkeeping behind
+    assert len(pool._created_at) == stats["open"]
+
+
+def test_failed_batch_reports_statements_committed_by_ddl(db):
+    df, err = execute_mysql_query(db, "INSERT INTO t (id, name) VALUES (1, 'a');\n"
+                                      "CREATE TABLE u (id INT);\n"
+                                      "INSERT INTO t (id, name) VALUES (2, 'b');\n"
+                                      "INSERT INTO missing (id) VALUES (3)")
+    assert df is None
+    assert err.startswith("Statement 4 failed (2 statements already committed by an implicit commit, 1 rolled back)")
+    assert execute_mysql_query(db, "SELECT id FROM t")[0]["id"].tolist() == [1]
+
+
+def test_failed_batch_without_ddl_rolls_back_everything(db):
+    _, err = execute_mysql_query(db, "INSERT INTO t (id, name) VALUES (1, 'a');\n"
+                                     "INSERT INTO missing (id) VALUES (2)")
+    assert err.startswith("Statement 2 failed (2 statements rolled back)")
+    assert execute_mysql_query(db, "SELECT id FROM t")[0].empty
@@ -0,0 +1,52 @@
+# tests/test_federated.py
+import pandas as pd
+import pytest
+
+import federated
+from federated import plan_federated, run_federated
+from mocks import SQLiteMySQLStandIn
+
+
+@pytest.fixture
+def sources():
+    db = SQLiteMySQLStandIn()
+    db.load_frame("orders", pd.DataFrame({"id": range(1, 101), "customer_id": [i % 10 + 1 for i in range(100)],
+                                          "amount": [float(i) for i in range(100)]}))
+    vip = pd.DataFrame({"customer_id": [2, 3, 3], "tier": ["gold", "silver", "silver"]})
+    return db, db.schema(), {"vip": vip}
+
+
+JOIN = ("SELECT v.tier, COUNT(*) AS n FROM orders o JOIN vip v ON v.customer_id = o.customer_id "
+        "GROUP BY v.tier ORDER BY v.tier")
+
+
+def test_join_keys_are_pushed_into_mysql_scan(sources):
+    db, schema, df_map = sources
+    plan = plan_federated(JOIN, schema, df_map)
+    assert "`o`.`customer_id` IN (2, 3)" in plan.mysql_queries["orders"]
+    df, err = run_federated(JOIN, db, schema, df_map)
+    assert err is None
+    assert df.values.tolist() == [["gold", 10], ["silver", 20]]
+
+
+def test_preserved_side_of_left_join_is_not_narrowed(sources):
+    _, schema, df_map = sources
+    plan = plan_federated("SELECT o.id, v.tier FROM orders o LEFT JOIN vip v ON v.customer_id = o.customer_id",
+                          schema, df_map)
+    assert "IN (" not in plan.mysql_queries["orders"]
+    plan = plan_federated("SELECT o.id, v.tier FROM vip v LEFT JOIN orders o ON v.customer_id = o.customer_id",
+                          schema, df_map)
+    assert "IN (2, 3)" in plan.mysql_queries["orders"]
+
+
+def test_truncated_mysql_scan_is_an_error(sources, monkeypatch):
+    db, schema, df_map = sources
+
+    def capped(conn, q):
+        df = pd.DataFrame({"customer_id": [2], "id": [1]})
+        df.attrs["truncated"] = "row limit of 1 reached"
+        return df, None
+
+    monkeypatch.setattr(federated, "execute_mysql_query", capped)
+    df, err = run_federated(JOIN, db, schema, df_map)
+    assert df is None and "incomplete" in err and "row limit of 1 reached" in err
@@ -0,0 +1,109 @@
+# tests/test_gsheets_utils.py
+import pytest
+
+import gsheets_utils
+from conftest import NULL_ROWS, ROWS
+from mocks import FakeSpreadsheet, FakeWorksheet
+
+
+def test_integer_columns_load_as_int64(sheet):
+    book, _ = sheet
+    assert str(book.frame("t")["price"].dtype) == "int64"
+
+
+def test_tab_title_with_apostrophe_loads():
+    gsheets_utils._SHEET_CACHE.clear()
+    sh = FakeSpreadsheet(spreadsheet_id="apostrophe")
+    sh.add(FakeWorksheet(ROWS, title="Q1's data"))
+    book = gsheets_utils.SheetWorkbook(sh)
+    assert book.headers() == {"Q1's data": ["id", "price", "name"]}
+    assert book.frame("Q1's data")["price"].tolist() == [10, 20]
+
+
+def test_fake_spreadsheet_rejects_unescaped_quote():
+    sh = FakeSpreadsheet()
+    sh.add(FakeWorksheet(ROWS, title="Q1's data"))
+    with pytest.raises(ValueError):
+        sh.values_batch_get(["'Q1's data'"])
+
+
+def test_failed_push_does_not_leak_into_shared_cache(sheet, run):
+    book, ws = sheet
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("quota exceeded")
+    ws.batch_update = fail
+    _, err = run("UPDATE t SET price = 15 WHERE id = 2")
+    assert "failed to push" in err
+    assert gsheets_utils.SheetWorkbook(book.sh).frame("t")["price"].tolist() == [10, 20]
+
+
+def test_insert_out_of_range_value_widens_column(run, sheet):
+    _, ws = sheet
+    run.df_map["t"]["price"] = run.df_map["t"]["price"].astype("int8")   # narrowest dtype the values allow
+    _, err = run("INSERT INTO t (id, price, name) VALUES (3, 5000, 'c')")
+    assert err is None
+    assert ws.values[-1] == ["3", "5000", "c"]
+    assert run.df_map["t"]["price"].tolist() == [10, 20, 5000]
+
+
+def test_insert_fraction_into_integer_column(run, sheet):
+    _, ws = sheet
+    _, err = run("INSERT INTO t (id, price, name) VALUES (3, 1.1, 'c')")
+    assert err is None
+    assert ws.values[-1] == ["3", "1.1", "c"]
+    assert run.df_map["t"]["price"].tolist() == [10, 20, 1.1]
+
+
+def test_update_out_of_range_and_fractional_values(run, sheet):
+    _, ws = sheet
+    run.df_map["t"]["price"] = run.df_map["t"]["price"].astype("int8")
+    assert run("UPDATE t SET price = 999 WHERE id = 1")[1] is None
+    assert run("UPDATE t SET price = 1.5 WHERE id = 2")[1] is None
+    assert run.df_map["t"]["price"].tolist() == [999, 1.5]
+    assert [row[1] for row in ws.values[1:]] == ["999", "1.5"]
+
+
+def test_update_null_into_integer_column(run, sheet):
+    _, ws = sheet
+    assert run("UPDATE t SET price = NULL WHERE id = 1")[1] is None
+    assert ws.values[1] == ["1", "", "a"]
+
+
+def test_engine_sees_widened_values(sheet):
+    book, _ = sheet
+    df_map, ws_map = book.table_maps(["t"])
+    engine = gsheets_utils.SheetSQLEngine(index_after=0)
+    gsheets_utils.execute_sheet_sql_on_df(df_map, "SELECT * FROM t", ws_map, engine)
+    gsheets_utils.execute_sheet_sql_on_df(df_map, "UPDATE t SET price = 2.5 WHERE id = 1", ws_map, engine)
+    gsheets_utils.execute_sheet_sql_on_df(df_map, "INSERT INTO t (id, price, name) VALUES (3, 70000, 'c')",
+                                          ws_map, engine)
+    df, err = gsheets_utils.execute_sheet_sql_on_df(df_map, "SELECT price FROM t ORDER BY id", ws_map, engine)
+    assert err is None and df["price"].tolist() == [2.5, 20, 70000]
+
+
+@pytest.mark.parametrize("sheet", [NULL_ROWS], indirect=True)
+@pytest.mark.parametrize("where, kept", [
+    ("price != 5", ["1", "2"]),
+    ("NOT (price > 10)", ["2", "3"]),
+    ("price NOT IN (5, 20)", ["1", "2", "3"]),
+    ("price NOT BETWEEN 1 AND 6", ["1", "2"]),
+    ("name NOT LIKE 'a%'", ["1", "3"]),
+    ("name != 'a'", ["1", "3"]),
+    ("id NOT IN (1, NULL)", ["1", "2", "3", "4"]),
+])
+def test_delete_leaves_null_cells_alone(run, sheet, where, kept):
+    _, ws = sheet
+    assert run(f"DELETE FROM t WHERE {where}")[1] is None
+    assert [row[0] for row in ws.values[1:]] == kept
+
+
+@pytest.mark.parametrize("sheet", [NULL_ROWS], indirect=True)
+def test_update_negated_predicate_skips_null_cells(run, sheet):
+    _, ws = sheet
+    df, err = run("UPDATE t SET name = 'x' WHERE NOT (price >= 10)")
+    assert err is None and int(df["affected_rows"].iloc[0]) == 1
+    assert [row[2] for row in ws.values[1:]] == ["x", "b", "", "d"]
+    df, _ = run("UPDATE t SET price = 0 WHERE price IS NULL OR name != 'x'")
+    assert int(df["affected_rows"].iloc[0]) == 2   # rows 2 (NULL price) and 4; row 3's empty name is unknown
+    assert [float(row[1]) for row in ws.values[1:]] == [5, 0, 20, 0]
@@ -0,0 +1,56 @@
+# tests/test_sheet_writer.py
+import pytest
+
+import gsheets_utils
+import sheet_writer
+from conftest import ROWS
+from mocks import FakeSpreadsheet, FakeWorksheet
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    """Write-behind on, with a journal-less writer that only writes on flush()."""
+    monkeypatch.setattr(gsheets_utils, "SHEET_WRITE_BEHIND", True)
+    gsheets_utils._SHEET_CACHE.clear()
+    w = sheet_writer.SheetWriter(delay=3600, journal_path="")
+    monkeypatch.setattr(sheet_writer, "_WRITER", w)
+    return w
+
+
+def _session(sh):
+    book = gsheets_utils.SheetWorkbook(sh)
+    df_map, ws_map = book.table_maps(["t"])
+
+    def execute(sql):
+        df, err = gsheets_utils.execute_sheet_sql_on_df(df_map, sql, ws_map)
+        assert err is None
+        return df
+    return execute
+
+
+def test_stale_session_is_replayed_against_current_rows(writer):
+    sh = FakeSpreadsheet(spreadsheet_id="two-sessions")
+    ws = sh.add(FakeWorksheet(ROWS, title="t"))
+    a, b = _session(sh), _session(sh)
+    # same row count afterwards, but every row moved up one position
+    a("DELETE FROM t WHERE id = 1")
+    a("INSERT INTO t (id, price, name) VALUES (3, 30, 'c')")
+    # b still sees id 2 at position 1, where the sheet now has id 3
+    b("UPDATE t SET name = 'z' WHERE id = 2")
+    assert writer.flush(5)
+    assert ws.get_all_values() == [["id", "price", "name"], ["2", "20", "z"], ["3", "30", "c"]]
+
+
+def test_fresh_load_is_trusted_again_after_replay(writer):
+    sh = FakeSpreadsheet(spreadsheet_id="reload")
+    ws = sh.add(FakeWorksheet(ROWS, title="t"))
+    a, b = _session(sh), _session(sh)
+    a("DELETE FROM t WHERE id = 1")
+    b("UPDATE t SET name = 'z' WHERE id = 2")
+    assert writer.flush(5)
+    gsheets_utils._SHEET_CACHE.clear()
+    c = _session(sh)
+    c("UPDATE t SET price = 25 WHERE id = 2")
+    assert writer._queues[writer._key(ws)].batch.replay is None
+    assert writer.flush(5)
+    assert ws.get_all_values() == [["id", "price", "name"], ["2", "25", "z"]]
@@ -0,0 +1,43 @@
+# tests/test_sql_generator.py
+import pytest
+
+import sql_generator
+from mocks import MockModel
+from sql_cache import SQLCache
+from sql_validator import ValidationResult
+
+SCHEMA = "Table: t\n- id (INT)"
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = SQLCache(path=":memory:")
+    monkeypatch.setattr(sql_generator, "_SQL_CACHE", cache)
+    return cache
+
+
+def _validate(sql):
+    check = ValidationResult(sql)
+    if "missing" in sql:
+        check.errors.append("Unknown column 'missing'")
+    return check
+
+
+def _cached(cache):
+    return cache.get("q", SCHEMA, sql_generator.SYSTEM_PROMPT_DEFAULT, 0.7)
+
+
+def test_failed_repair_is_not_cached(cache):
+    model = MockModel(latency=0, responder=lambda q: "SELECT missing FROM t")
+    sql, check = sql_generator.generate_sql_with_repair("q", SCHEMA, _validate, max_attempts=2,
+                                                        use_cache=True, model=model)
+    assert check.errors and check.repairs == 2
+    assert _cached(cache) is None
+
+
+def test_repaired_sql_replaces_invalid_answer(cache):
+    answers = iter(["SELECT missing FROM t", "SELECT id FROM t"])
+    model = MockModel(latency=0, responder=lambda q: next(answers))
+    sql, check = sql_generator.generate_sql_with_repair("q", SCHEMA, _validate, use_cache=True, model=model)
+    assert check.ok and check.repairs == 1
+    assert _cached(cache) == sql == "SELECT id FROM t;"
@@ -0,0 +1,254 @@
+# tracing.py
+"""Lightweight spans for the question pipeline.
+
+    with span("generate", model=name) as s:
+        ...
+        s.add("prompt_tokens", n)
+
+Spans nest through a contextvar. A finished root span is a trace: it is kept
+in recent_traces() for the debug panel, written as one JSON line to the
+"text_to_sql.trace" logger (see TRACE_LOG) and folded into in-process metrics
+that render_prometheus() / start_metrics_server() expose.
+"""
+import contextvars
+import io
+import json
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+from config import TRACE_LOG, TRACE_KEEP
+
+_CURRENT: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+# Numeric span attributes that are also summed into <name>_total counters.
+COUNTED_ATTRS = ("rows", "bytes", "cells", "requests", "prompt_tokens", "response_tokens")
+
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+logger = logging.getLogger("text_to_sql.trace")
+if TRACE_LOG:
+    _handler = logging.StreamHandler(sys.stderr) if TRACE_LOG == "stderr" else logging.FileHandler(TRACE_LOG)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.attrs: Dict[str, object] = dict(attrs)
+        self.children: List["Span"] = []
+        self.error: Optional[str] = None
+        self.start = time.perf_counter()
+        self.wall_start = time.time()
+        self.end_time: Optional[float] = None
+        self._lock = threading.Lock()
+        if parent is not None:
+            with parent._lock:
+                parent.children.append(self)
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time if self.end_time is not None else time.perf_counter()) - self.start
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key: str, value=1):
+        with self._lock:
+            self.attrs[key] = self.attrs.get(key, 0) + value
+
+    def end(self, error: Optional[str] = None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.perf_counter()
+        if error:
+            self.error = error
+        _record(self)
+        if self.parent is None:
+            _finish_trace(self)
+
+    def to_dict(self) -> dict:
+        d = {"name": self.name, "ms": round(self.duration * 1000, 3), **self.attrs}
+        if self.error:
+            d["error"] = self.error
+        if self.children:
+            d["children"] = [c.to_dict() for c in self.children]
+        return d
+
+    def walk(self, depth: int = 0):
+        """(depth, span) for this span and its descendants, in start order."""
+        yield depth, self
+        for child in sorted(self.children, key=lambda c: c.start):
+            yield from child.walk(depth + 1)
+
+
+def current_span() -> Optional[Span]:
+    return _CURRENT.get()
+
+
+def start_span(name: str, **attrs) -> Span:
+    """Child of the current span that is NOT made current; call .end() yourself.
+
+    For generators: setting the contextvar across a yield would leak into the consumer.
+    """
+    return Span(name, _CURRENT.get(), **attrs)
+
+
+@contextmanager
+def span(name: str, **attrs):
+    s = Span(name, _CURRENT.get(), **attrs)
+    token = _CURRENT.set(s)
+    try:
+        yield s
+    except Exception as e:
+        s.end(error=f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _CURRENT.reset(token)
+        s.end()
+
+
+def in_current_context(fn):
+    """Bind fn to a copy of the caller's context so spans opened in a worker thread nest correctly."""
+    ctx = contextvars.copy_context()
+    return lambda *args, **kwargs: ctx.run(fn, *args, **kwargs)
+
+
+def record_usage(s: Span, response):
+    """Copy Gemini usage_metadata token counts onto a span, when the response has them."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for attr, key in (("prompt_token_count", "prompt_tokens"), ("candidates_token_count", "response_tokens")):
+        value = getattr(usage, attr, None)
+        if value:
+            s.add(key, int(value))
+
+
+# ---------------- traces & metrics -----------------
+_TRACES: deque = deque(maxlen=TRACE_KEEP)
+_METRICS_LOCK = threading.Lock()
+_HISTOGRAMS: Dict[str, list] = {}    # stage -> [bucket counts..., +Inf count, sum]
+_COUNTERS: Dict[tuple, float] = {}   # (metric, stage) -> value
+
+
+def _record(s: Span):
+    with _METRICS_LOCK:
+        hist = _HISTOGRAMS.setdefault(s.name, [0] * (len(_DURATION_BUCKETS) + 2))
+        for i, bound in enumerate(_DURATION_BUCKETS):
+            if s.duration <= bound:
+                hist[i] += 1
+        hist[len(_DURATION_BUCKETS)] += 1
+        hist[-1] += s.duration
+        if s.error:
+            _COUNTERS[("errors", s.name)] = _COUNTERS.get(("errors", s.name), 0) + 1
+        for key in COUNTED_ATTRS:
+            value = s.attrs.get(key)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                _COUNTERS[(key, s.name)] = _COUNTERS.get((key, s.name), 0) + value
+
+
+def _finish_trace(root: Span):
+    _TRACES.append(root)
+    if logger.isEnabledFor(logging.INFO):
+        record = {"ts": root.wall_start, **root.to_dict()}
+        logger.info(json.dumps(record, default=str))
+
+
+def recent_traces() -> List[Span]:
+    return list(_TRACES)
+
+
+def render_prometheus() -> str:
+    """Metrics in the Prometheus text exposition format."""
+    lines = ["# HELP t2s_stage_seconds Duration of pipeline stages.", "# TYPE t2s_stage_seconds histogram"]
+    with _METRICS_LOCK:
+        for stage, hist in sorted(_HISTOGRAMS.items()):
+            for bound, count in zip(_DURATION_BUCKETS, hist):
+                lines.append(f't2s_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f't2s_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[len(_DURATION_BUCKETS)]}')
+            lines.append(f't2s_stage_seconds_count{{stage="{stage}"}} {hist[len(_DURATION_BUCKETS)]}')
+            lines.append(f't2s_stage_seconds_sum{{stage="{stage}"}} {hist[-1]:.6f}')
+        for metric in sorted({m for m, _ in _COUNTERS}):
+            lines.append(f"# TYPE t2s_{metric}_total counter")
+            for (m, stage), value in sorted(_COUNTERS.items()):
+                if m == metric:
+                    lines.append(f't2s_{metric}_total{{stage="{stage}"}} {value:g}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_SERVER: Optional[ThreadingHTTPServer] = None
+_SERVER_LOCK = threading.Lock()
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serve /metrics on a daemon thread (once per process)."""
+    global _SERVER
+    with _SERVER_LOCK:
+        if _SERVER is None:
+            _SERVER = ThreadingHTTPServer((host, port), _MetricsHandler)
+            threading.Thread(target=_SERVER.serve_forever, name="metrics", daemon=True).start()
+        return _SERVER
+
+
+# ---------------- profiling -----------------
+@contextmanager
+def profiled(kind: Optional[str], s: Optional[Span] = None, top: int = 30):
+    """Profile the block with "cprofile" or "pyinstrument" (None: no-op); the report lands in s.attrs["profile"]."""
+    if not kind:
+        yield
+        return
+    if kind == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            if s is not None:
+                s.set(profile="pyinstrument is not installed (pip install pyinstrument).")
+            yield
+            return
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            if s is not None:
+                s.set(profile=profiler.output_text(unicode=True, color=False))
+        return
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if s is not None:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+            s.set(profile=out.getvalue())